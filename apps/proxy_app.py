@@ -1,11 +1,13 @@
 import argparse
-import pandas as pd
 import sys
 import requests
 import threading
+import time
+import uuid
 import uvicorn
 
 from datetime import datetime
+from pathlib import Path
 from fastapi import FastAPI, Body
 from pydantic import BaseModel
 from tclogger import logger
@@ -14,34 +16,157 @@ from typing import Optional, List, Literal
 
 from apps.arg_parser import ArgParser
 from configs.envs import PROXY_APP_ENVS, PROXY_VIEW_APP_ENVS, WORKER_APP_ENVS
+from networks.keyed_heap import KeyedHeap
 from networks.proxy_pool import ProxyPool, ProxyBenchmarker
+from networks.proxy_snapshot import ProxiesSnapshotter
 
 
 class ProxiesDatabase:
-    COLUMN_DTYPES = {
-        "server": str,
-        "latency": float,
-        "last_checked": "datetime64[ns]",
-        "success_rate": float,
-    }
-    COLUMNS = list(COLUMN_DTYPES.keys())
-    INDEX_COLUMNS = ["server"]
-
-    def __init__(self):
-        self.init_df()
-        self.lock = threading.Lock()
+    """Good, bad and using proxies, each item is `{latency, last_checked, success_rate}`.
+
+    Good proxies are in a KeyedHeap ordered by (highest success_rate, lowest latency),
+    so lease (`pop_best_proxy`), release, drop and re-scoring are all O(log n).
+    Scores start from ProxyBenchmarker, and then follow EWMA of feedback from workers,
+    see `report_proxy`.
+    Bad and using proxies are dicts of `server -> item`.
+    All operations hold `self.lock`, so a proxy is never leased to two workers.
+
+    Each using proxy has a lease `{lease_id, server, holder, leased_at, expires_at}`,
+    which expires after its `ttl` seconds unless renewed by `heartbeat_leases`
+    or by feedback of the proxy (`report_proxy`). Expired leases are reclaimed
+    into good proxies by `reap_expired_leases`, so proxies of dead workers are not leaked.
+    """
 
-    def init_df(self):
-        # create a pandas dataframe to store good proxies
-        # columns: server(ip:port):str, latency:float, last_checked:datetime
-        self.df_good = self.default_df()
-        self.df_bad = self.default_df()
-        self.df_using = self.default_df()
+    STATUSES = ["good", "bad", "using"]
+
+    def __init__(
+        self,
+        score_alpha: float = 0.1,
+        score_half_life: float = 300,
+        lease_ttl: float = 300,
+    ):
+        self.score_alpha = score_alpha
+        self.score_half_life = score_half_life
+        self.lease_ttl = lease_ttl
+        self.lock = threading.Lock()
+        self.init_stores()
+
+    def init_stores(self):
+        self.good = KeyedHeap()
+        self.bad = {}
+        self.using = {}
+        self.leases = {}
+        self.server_leases = {}
+        # lease_id ordered by expires_at
+        self.lease_expiries = KeyedHeap()
+
+    def get_priority(self, item: dict) -> tuple:
+        return (-item["success_rate"], item["latency"])
+
+    def new_item(self, latency: float, success_rate: float) -> dict:
+        return {
+            "latency": latency,
+            "last_checked": datetime.now(),
+            "success_rate": success_rate,
+        }
 
-    def default_df(self):
-        df = pd.DataFrame(columns=self.COLUMNS).astype(self.COLUMN_DTYPES)
-        df = df.set_index(self.INDEX_COLUMNS)
-        return df
+    def put_item(self, server: str, item: dict, status: str):
+        """Should be called with lock held."""
+        if status == "good":
+            self.good.push(server, self.get_priority(item), item)
+        elif status == "bad":
+            self.bad[server] = item
+        elif status == "using":
+            self.lease_item(server, item)
+
+    def lease_item(
+        self, server: str, item: dict, holder: str = "", ttl: float = None
+    ) -> dict:
+        """Add proxy to using with a new lease. Should be called with lock held."""
+        self.end_lease(server)
+        now = time.time()
+        ttl = ttl or self.lease_ttl
+        lease = {
+            "lease_id": uuid.uuid4().hex,
+            "server": server,
+            "holder": holder or "",
+            "ttl": ttl,
+            "leased_at": now,
+            "expires_at": now + ttl,
+        }
+        self.using[server] = item
+        self.leases[lease["lease_id"]] = lease
+        self.server_leases[server] = lease["lease_id"]
+        self.lease_expiries.push(lease["lease_id"], (lease["expires_at"],))
+        return lease
+
+    def end_lease(self, server: str) -> dict:
+        """Should be called with lock held."""
+        lease_id = self.server_leases.pop(server, None)
+        if lease_id is None:
+            return None
+        self.lease_expiries.remove(lease_id)
+        return self.leases.pop(lease_id, None)
+
+    def renew_lease(self, lease_id: str, ttl: float = None) -> bool:
+        """Should be called with lock held."""
+        lease = self.leases.get(lease_id)
+        if lease is None:
+            return False
+        lease["expires_at"] = time.time() + (ttl or lease["ttl"])
+        self.lease_expiries.push(lease_id, (lease["expires_at"],))
+        return True
+
+    def heartbeat_leases(self, lease_ids: List[str], ttl: float = None) -> dict:
+        """Renew leases. Unknown leases are expired and reclaimed, or released."""
+        renewed, expired = [], []
+        with self.lock:
+            for lease_id in lease_ids:
+                if self.renew_lease(lease_id, ttl=ttl):
+                    renewed.append(lease_id)
+                else:
+                    expired.append(lease_id)
+        return {"renewed": renewed, "expired": expired}
+
+    def reap_expired_leases(self) -> List[str]:
+        """Move proxies of expired leases from using back to good."""
+        now = time.time()
+        reclaimed = []
+        with self.lock:
+            while True:
+                lease_id, _ = self.lease_expiries.peek()
+                if lease_id is None or self.leases[lease_id]["expires_at"] > now:
+                    break
+                server = self.leases[lease_id]["server"]
+                item = self.pop_item(server, "using")
+                if item is not None:
+                    self.put_item(server, item, "good")
+                reclaimed.append(server)
+        return reclaimed
+
+    def get_leases(self) -> List[dict]:
+        now = time.time()
+        with self.lock:
+            leases = sorted(self.leases.values(), key=lambda x: x["expires_at"])
+            return [
+                {
+                    **lease,
+                    "leased_at": datetime.fromtimestamp(lease["leased_at"]),
+                    "expires_at": datetime.fromtimestamp(lease["expires_at"]),
+                    "expires_in": round(lease["expires_at"] - now, 1),
+                }
+                for lease in leases
+            ]
+
+    def pop_item(self, server: str, status: str) -> dict:
+        """Should be called with lock held."""
+        if status == "good":
+            return self.good.remove(server)
+        elif status == "bad":
+            return self.bad.pop(server, None)
+        elif status == "using":
+            self.end_lease(server)
+            return self.using.pop(server, None)
 
     def add_proxy(
         self,
@@ -50,46 +175,30 @@ class ProxiesDatabase:
         status: Literal["good", "bad", "using"] = "good",
         success_rate: float = -1,
     ):
-        new_item = {
-            "latency": latency,
-            "last_checked": pd.Timestamp.now(),
-            "success_rate": success_rate,
-        }
-        new_row = pd.Series(new_item)
-
+        if status not in self.STATUSES:
+            logger.warn(f"  ? Unknown proxy status: {status}")
+            return
+        if status == "good":
+            logger.success(
+                f"  + Add good proxy: [{latency:.2f}s] [{success_rate:.2f}] {server}"
+            )
+        elif status == "bad":
+            logger.back(f"  x Add bad proxy: {server}")
+        else:
+            logger.note(f"  + Add using proxy: {server}")
         with self.lock:
-            if status == "good":
-                logger.success(
-                    f"  + Add good proxy: [{latency:.2f}s] [{success_rate:.2f}] {server}"
-                )
-                self.df_good.loc[server] = new_row
-            elif status == "bad":
-                logger.back(f"  x Add bad proxy: {server}")
-                self.df_bad.loc[server] = new_row
-            elif status == "using":
-                logger.note(f"  + Add using proxy: {server}")
-                self.df_using.loc[server] = new_row
-            else:
-                logger.warn(f"  ? Unknown proxy status: {status}")
+            self.put_item(server, self.new_item(latency, success_rate), status)
 
     def remove_proxy(
         self, server: str, status: Literal["good", "bad", "using"] = "good"
     ):
-        with self.lock:
-            if status == "good":
-                if server in self.df_good.index:
-                    self.df_good.drop(index=server, inplace=True)
-                    logger.warn(f"- Remove good proxy: {server}")
-            elif status == "bad":
-                if server in self.df_bad.index:
-                    self.df_bad.drop(index=server, inplace=True)
-                    logger.warn(f"- Remove bad proxy: {server}")
-            elif status == "using":
-                if server in self.df_using.index:
-                    self.df_using.drop(index=server, inplace=True)
-                    logger.warn(f"- Remove using proxy: {server}")
-            else:
-                logger.warn(f"Unknown proxy status: {status}")
+        if status not in self.STATUSES:
+            logger.warn(f"Unknown proxy status: {status}")
+        else:
+            with self.lock:
+                item = self.pop_item(server, status)
+            if item is not None:
+                logger.warn(f"- Remove {status} proxy: {server}")
 
         return {"server": server, "status": "removed"}
 
@@ -111,64 +220,223 @@ class ProxiesDatabase:
     def remove_using_proxy(self, server: str):
         return self.remove_proxy(server, "using")
 
+    def drop_proxy(self, server: str):
+        """Move proxy from good or using to bad, in one step."""
+        with self.lock:
+            item = self.pop_item(server, "using") or self.pop_item(server, "good")
+            self.put_item(server, self.new_item(-1, -1), "bad")
+        return item
+
+    def release_proxy(self, server: str) -> bool:
+        """Move leased proxy back to good, with its last scores."""
+        with self.lock:
+            item = self.pop_item(server, "using")
+            if item is None:
+                return False
+            self.put_item(server, item, "good")
+        return True
+
+    def get_live_item(self, server: str) -> dict:
+        """Item of a good or using proxy. Should be called with lock held."""
+        if server in self.good:
+            return self.good.get(server)
+        return self.using.get(server)
+
+    def reorder_item(self, server: str, item: dict):
+        """Should be called with lock held."""
+        if server in self.good:
+            self.good.push(server, self.get_priority(item), item)
+
+    def update_proxy_score(
+        self, server: str, latency: float = None, success_rate: float = None
+    ) -> bool:
+        """Update scores of a good or using proxy, and re-order it in good heap."""
+        with self.lock:
+            item = self.get_live_item(server)
+            if item is None:
+                return False
+            if latency is not None:
+                item["latency"] = latency
+            if success_rate is not None:
+                item["success_rate"] = success_rate
+            item["last_checked"] = datetime.now()
+            self.reorder_item(server, item)
+        return True
+
+    def get_ewma_weight(self, count: int, elapsed_seconds: float) -> float:
+        """Weight of old score after `count` new samples in `elapsed_seconds`.
+        Old score decays both by samples (`score_alpha`) and by time (`score_half_life`).
+        """
+        sample_decay = (1 - self.score_alpha) ** count
+        time_decay = 0.5 ** (max(elapsed_seconds, 0) / self.score_half_life)
+        return sample_decay * time_decay
+
+    def report_proxy(
+        self,
+        server: str,
+        requests: int,
+        successes: int,
+        latency_sum: float = 0.0,
+        latencies: int = 0,
+    ) -> bool:
+        """Fold a batch of requests outcomes from workers into EWMA scores of proxy."""
+        if requests <= 0:
+            return False
+        now = datetime.now()
+        with self.lock:
+            item = self.get_live_item(server)
+            if item is None:
+                return False
+            elapsed_seconds = (now - item["last_checked"]).total_seconds()
+            weight = self.get_ewma_weight(requests, elapsed_seconds)
+            success_rate = successes / requests
+            item["success_rate"] = (
+                weight * item["success_rate"] + (1 - weight) * success_rate
+            )
+            if latencies > 0:
+                weight = self.get_ewma_weight(latencies, elapsed_seconds)
+                latency = latency_sum / latencies
+                item["latency"] = weight * item["latency"] + (1 - weight) * latency
+            item["last_checked"] = now
+            self.reorder_item(server, item)
+            # requests through a leased proxy show its holder is alive
+            if server in self.server_leases:
+                self.renew_lease(self.server_leases[server])
+        return True
+
     def get_good_proxies_list(self) -> List[str]:
         with self.lock:
-            res = self.df_good.index.tolist()
+            res = self.good.keys()
         return res
 
     def get_bad_proxies_list(self) -> List[str]:
         with self.lock:
-            res = self.df_bad.index.tolist()
+            res = list(self.bad.keys())
         return res
 
     def get_using_proxies_list(self) -> List[str]:
         with self.lock:
-            res = self.df_using.index.tolist()
+            res = list(self.using.keys())
         return res
 
+    def get_rows(self) -> List[dict]:
+        """All proxies as rows of `{server, status, **item, lease}`, for snapshot.
+        `lease` is None unless the proxy is using."""
+        with self.lock:
+            stores = {
+                "good": {server: self.good.get(server) for server in self.good},
+                "bad": self.bad,
+                "using": self.using,
+            }
+            rows = []
+            for status, store in stores.items():
+                for server, item in store.items():
+                    lease_id = self.server_leases.get(server)
+                    lease = dict(self.leases[lease_id]) if lease_id else None
+                    rows.append(
+                        {"server": server, "status": status, **item, "lease": lease}
+                    )
+        return rows
+
+    def restore_lease(self, server: str, item: dict, lease: dict):
+        """Add proxy to using with lease of previous process, so its holder could
+        keep heartbeating it. Should be called with lock held."""
+        self.end_lease(server)
+        lease = {**lease, "server": server}
+        self.using[server] = item
+        self.leases[lease["lease_id"]] = lease
+        self.server_leases[server] = lease["lease_id"]
+        self.lease_expiries.push(lease["lease_id"], (lease["expires_at"],))
+
+    def load_rows(self, rows: List[dict], bad_cooldown_seconds: float = 300) -> dict:
+        """Load proxies from snapshot rows.
+        Using proxies with unexpired leases are still using, so they are not leased
+        twice, and the others are loaded as good.
+        Bad proxies are only kept if dropped within `bad_cooldown_seconds`."""
+        now = datetime.now()
+        with self.lock:
+            for row in rows:
+                item = {
+                    "latency": row["latency"],
+                    "last_checked": row["last_checked"],
+                    "success_rate": row["success_rate"],
+                }
+                lease = row.get("lease")
+                if row["status"] == "using" and lease:
+                    if lease["expires_at"] > time.time():
+                        self.restore_lease(row["server"], item, lease)
+                    else:
+                        self.put_item(row["server"], item, "good")
+                elif row["status"] in ["good", "using"]:
+                    self.put_item(row["server"], item, "good")
+                elif row["status"] == "bad":
+                    bad_seconds = (now - row["last_checked"]).total_seconds()
+                    if bad_seconds < bad_cooldown_seconds:
+                        self.put_item(row["server"], item, "bad")
+        return self.get_counts()
+
+    def get_counts(self) -> dict:
+        with self.lock:
+            return {
+                "good": len(self.good),
+                "bad": len(self.bad),
+                "using": len(self.using),
+                "leases": len(self.leases),
+            }
+
     def empty_good_proxies(self):
-        old_good_proxies = self.get_good_proxies_list()
         with self.lock:
-            self.df_good = self.default_df()
+            old_good_proxies = self.good.keys()
+            self.good = KeyedHeap()
         logger.success(f"+ Empty {len(old_good_proxies)} good proxies")
         return old_good_proxies
 
     def empty_bad_proxies(self):
-        old_bad_proxies = self.get_bad_proxies_list()
         with self.lock:
-            self.df_bad = self.default_df()
+            old_bad_proxies = list(self.bad.keys())
+            self.bad = {}
         logger.success(f"+ Empty {len(old_bad_proxies)} bad proxies")
         return old_bad_proxies
 
-    def empty_using_proxies(self):
-        old_using_proxies = self.get_using_proxies_list()
+    def empty_using_proxies(self, flag_as_good: bool = False):
+        """If `flag_as_good`, using proxies are moved back to good, otherwise dropped."""
         with self.lock:
-            self.df_using = self.default_df()
-        logger.success(f"+ Empty {len(old_using_proxies)} using proxies")
-        return old_using_proxies
-
-    def pop_best_proxy(self) -> dict:
-        """Get the proxy with highest success_rate and lowest latency, and not in using list"""
+            old_using = self.using
+            self.using = {}
+            self.leases = {}
+            self.server_leases = {}
+            self.lease_expiries = KeyedHeap()
+            if flag_as_good:
+                for server, item in old_using.items():
+                    self.put_item(server, item, "good")
+        logger.success(f"+ Empty {len(old_using)} using proxies")
+        return list(old_using.keys())
+
+    def pop_best_proxy(self, holder: str = "", ttl: float = None) -> dict:
+        """Lease the proxy with highest success_rate and lowest latency.
+        Pop from good and add to using are done in one lock, so leasing is atomic."""
         with self.lock:
-            good_rows = self.df_good.sort_values(
-                by=["success_rate", "latency"], ascending=[False, True]
-            )
-        if good_rows.empty:
+            server, item = self.good.pop()
+            if server is not None:
+                lease = self.lease_item(server, item, holder=holder, ttl=ttl)
+        if server is None:
             res = {
                 "server": "",
                 "latency": -1,
                 "success_rate": -1,
                 "status": "error",
+                "lease_id": "",
+                "lease_ttl": -1,
             }
         else:
             res = {
-                "server": good_rows.index[0],
-                "latency": good_rows.iloc[0]["latency"],
-                "success_rate": good_rows.iloc[0]["success_rate"],
+                "server": server,
+                "latency": item["latency"],
+                "success_rate": item["success_rate"],
                 "status": "ok",
+                "lease_id": lease["lease_id"],
+                "lease_ttl": lease["ttl"],
             }
-            self.add_using_proxy(res["server"], res["latency"], res["success_rate"])
-            self.remove_good_proxy(res["server"])
         return res
 
 
@@ -183,16 +451,69 @@ class ProxyApp:
             version=self.version,
             swagger_ui_parameters={"defaultModelsExpandDepth": -1},
         )
-        self.db = ProxiesDatabase()
+        self.db = ProxiesDatabase(
+            score_alpha=app_envs.get("score_alpha", 0.1),
+            score_half_life=app_envs.get("score_half_life", 300),
+            lease_ttl=app_envs.get("lease_ttl", 300),
+        )
         self.last_refresh_time = None
         self.is_refreshing_proxies = False
         self.trigger_refresh_proxies_min_goods = 3
         self.trigger_refresh_proxies_min_seconds = 30
         self.empty_bad_proxies_time = None
         self.trigger_empty_bad_proxies_min_seconds = 300
+        self.snapshotter = ProxiesSnapshotter(
+            db=self.db,
+            snapshot_path=(
+                Path(__file__).parents[1]
+                / "data"
+                / "proxies"
+                / f"proxies_{self.test_type}.sqlite"
+            ),
+            interval=app_envs.get("snapshot_interval", 30),
+        )
+        self.warm_load_proxies()
+        self.snapshotter.start()
+        self.lease_reap_interval = app_envs.get("lease_reap_interval", 10)
+        self.reaper_stop_event = threading.Event()
+        self.reaper_thread = threading.Thread(target=self.reap_loop, daemon=True)
+        self.reaper_thread.start()
         self.setup_routes()
         logger.success(f"> {self.title} - v{self.version}")
 
+    def warm_load_proxies(self):
+        """Serve good proxies of last snapshot right away, and re-verify them in background.
+        So workers would not starve until a full `refresh_proxies` finished."""
+        rows = self.snapshotter.load()
+        if not rows:
+            return
+        counts = self.db.load_rows(
+            rows, bad_cooldown_seconds=self.trigger_empty_bad_proxies_min_seconds
+        )
+        logger.success(
+            f"+ Warm loaded proxies: "
+            f"{counts['good']} good, {counts['bad']} bad, {counts['using']} using"
+        )
+        if counts["good"] <= 0:
+            return
+        # skip full refresh triggered by first get_proxy, unless good proxies run low
+        self.last_refresh_time = datetime.now()
+        self.empty_bad_proxies_time = datetime.now()
+        thread = threading.Thread(target=self.reverify_proxies, daemon=True)
+        thread.start()
+
+    def reverify_proxies(self):
+        """Re-test good proxies, which may be leased meanwhile, so only update their
+        scores if still usable (not re-add as good), and drop them if not."""
+        servers = self.db.get_good_proxies_list()
+        logger.note(f"> Re-verifying {len(servers)} warm loaded proxies")
+        benchmarker = ProxyBenchmarker(test_type=self.test_type)
+        benchmarker.batch_test_proxy(
+            servers,
+            good_callback=self.db.update_proxy_score,
+            bad_callback=self.db.drop_proxy,
+        )
+
     class RefreshProxiesPostItem(BaseModel):
         refresh_good: Optional[bool] = False
 
@@ -259,8 +580,14 @@ class ProxyApp:
         return res
 
     # ANCHOR[id=get_proxy]
-    def get_proxy(self):
-        res = self.db.pop_best_proxy()
+    def reap_loop(self):
+        while not self.reaper_stop_event.wait(self.lease_reap_interval):
+            reclaimed = self.db.reap_expired_leases()
+            if reclaimed:
+                logger.note(f"> Reclaimed {len(reclaimed)} proxies of expired leases")
+
+    def get_proxy(self, holder: Optional[str] = ""):
+        res = self.db.pop_best_proxy(holder=holder)
 
         if not res["server"]:
             logger.warn(f"> No usable good proxy")
@@ -268,8 +595,9 @@ class ProxyApp:
             logger.success(
                 f"> Get proxy: [{res['status']}] {res['server']}, {res['latency']:.2f}s, {res['success_rate']*100}%"
             )
-            using_count = len(self.db.df_using.index.tolist())
-            remain_count = len(self.db.df_good.index.tolist())
+            counts = self.db.get_counts()
+            using_count = counts["using"]
+            remain_count = counts["good"]
             using_str = colored("Using", "yellow")
             remain_str = colored("Remain", "blue")
             using_count_str = colored(using_count, "yellow")
@@ -317,6 +645,50 @@ class ProxyApp:
 
         return res
 
+    class ProxyReportItem(BaseModel):
+        server: str
+        requests: int = 0
+        successes: int = 0
+        latency_sum: float = 0.0
+        latencies: int = 0
+
+    class ReportPostItem(BaseModel):
+        reports: List["ProxyApp.ProxyReportItem"] = []
+        lease_ids: List[str] = []
+
+    # ANCHOR[id=report]
+    def report(self, item: ReportPostItem):
+        updated_count = 0
+        for report in item.reports:
+            is_updated = self.db.report_proxy(
+                report.server,
+                requests=report.requests,
+                successes=report.successes,
+                latency_sum=report.latency_sum,
+                latencies=report.latencies,
+            )
+            updated_count += int(is_updated)
+        heartbeat_res = self.db.heartbeat_leases(item.lease_ids)
+        return {
+            "status": "ok",
+            "reported": len(item.reports),
+            "updated": updated_count,
+            **heartbeat_res,
+        }
+
+    class HeartbeatPostItem(BaseModel):
+        lease_ids: List[str] = []
+        ttl: Optional[float] = None
+
+    # ANCHOR[id=heartbeat]
+    def heartbeat(self, item: HeartbeatPostItem):
+        res = self.db.heartbeat_leases(item.lease_ids, ttl=item.ttl)
+        return {"status": "ok", **res}
+
+    def get_leases(self):
+        leases = self.db.get_leases()
+        return {"count": len(leases), "leases": leases}
+
     class DropProxyPostItem(BaseModel):
         server: str = Body(default="", description="Proxy server to drop")
 
@@ -324,9 +696,7 @@ class ProxyApp:
     def drop_proxy(self, item: DropProxyPostItem):
         server = item.server
         logger.note(f"> Drop proxy: {server}")
-        self.db.remove_using_proxy(server)
-        self.db.remove_good_proxy(server)
-        self.db.add_bad_proxy(server)
+        self.db.drop_proxy(server)
         logger.success(f"+ Dropped proxy: {server}")
         logger.note(f"  ({len(self.db.get_using_proxies_list())} using proxies)")
         logger.mesg(f"  ({len(self.db.get_good_proxies_list())} good proxies left)")
@@ -357,14 +727,9 @@ class ProxyApp:
 
     # ANCHOR[id=reset_using_proxies]
     def reset_using_proxies(self, flag_as_good: Optional[bool] = Body(True)):
+        old_using_proxies = self.db.empty_using_proxies(flag_as_good=flag_as_good)
         if flag_as_good:
-            self.db.df_good = pd.concat(
-                [self.db.df_good, self.db.df_using], sort=False
-            ).drop_duplicates()
-            logger.note(
-                f"> Flag {len(self.db.get_good_proxies_list())} using proxies as good"
-            )
-        old_using_proxies = self.db.empty_using_proxies()
+            logger.note(f"> Flag {len(old_using_proxies)} using proxies as good")
         message = f"Reset {len(old_using_proxies)} using proxies"
         logger.mesg(f"> {message}")
         res = {
@@ -385,12 +750,31 @@ class ProxyApp:
         logger.mesg(f"√ Resume workers: [{data.get('status')}] {data.get('count')}")
         return data
 
+    def __del__(self):
+        self.reaper_stop_event.set()
+        self.snapshotter.stop()
+
     def setup_routes(self):
         self.app.get(
             "/get_proxy",
             summary="Get a usable proxy",
         )(self.get_proxy)
 
+        self.app.post(
+            "/report",
+            summary="Report requests outcomes and latencies of proxies",
+        )(self.report)
+
+        self.app.post(
+            "/heartbeat",
+            summary="Renew leases of proxies",
+        )(self.heartbeat)
+
+        self.app.get(
+            "/leases",
+            summary="Get leased proxies with holders and expiry",
+        )(self.get_leases)
+
         self.app.post(
             "/drop_proxy",
             summary="Drop a proxy as bad",
@@ -3,6 +3,7 @@ import requests
 import threading
 import uvicorn
 
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Body
 from pydantic import BaseModel
 from tclogger import logger
@@ -10,8 +11,17 @@ from typing import Optional, List
 
 from apps.arg_parser import ArgParser
 from configs.envs import WORKER_APP_ENVS, PROXY_APP_ENVS
+from networks.rate_control import RATE_CONTROLLERS
 from networks.sql import SQLOperator
-from workers.worker import WorkerParamsGenerator, Worker
+from networks.sql_buffer import SQLWriteBuffer
+from networks.sql_spool import SQLSpool
+from networks.transport import HTTP_TRANSPORT
+from transforms.video_row import VideoInfoConverter
+from workers.worker import WorkerParamsGenerator, Worker, VIDEOS_PRIMARY_KEY
+from workers.async_worker import AsyncWorker, AsyncWorkersEngine
+from workers.pipeline import VideoRowsPipeline
+from workers.stats_history import VideoStatsHistory
+from workers.checkpoint import GeneratorCheckpointer
 
 
 class WorkerApp:
@@ -21,12 +31,25 @@ class WorkerApp:
             title=WORKER_APP_ENVS["app_name"],
             swagger_ui_parameters={"defaultModelsExpandDepth": -1},
             version=WORKER_APP_ENVS["version"],
+            lifespan=self.lifespan,
         )
         self.setup_routes()
         self.workers = []
         self.generator = None
         self.sql = None
+        self.spool = None
+        self.pipeline = None
+        self.write_buffer = None
+        self.stats_history = None
         self.lock = threading.Lock()
+        # set when no workers are running in `run_workers`
+        self.workers_exited = threading.Event()
+        self.workers_exited.set()
+        self.engine = WORKER_APP_ENVS.get("engine", "thread")
+        self.max_connections = WORKER_APP_ENVS.get("max_connections", 1000)
+        self.checkpointer = GeneratorCheckpointer(
+            interval=WORKER_APP_ENVS.get("checkpoint_interval", 30)
+        )
         logger.success(
             f"> {WORKER_APP_ENVS['app_name']} - v{WORKER_APP_ENVS['version']}"
         )
@@ -46,12 +69,125 @@ class WorkerApp:
         logger.mesg(f"√ Reset using proxies: {data.get('status')}")
         return data
 
+    def create_sql(self):
+        if not self.sql:
+            self.sql = SQLOperator(pool_size=WORKER_APP_ENVS.get("sql_pool_size", 1))
+            self.check_videos_primary_key()
+        self.create_spool()
+
+    def check_videos_primary_key(self):
+        """`ON CONFLICT (videos_primary_key)` fails every write if it is not
+        the primary key of `videos`, e.g. after migrating to partitioned table."""
+        key_columns = self.sql.get_table_key_columns("videos")
+        if key_columns is None:
+            logger.warn(f"× Could not check primary key of table: videos")
+            return
+        if set(key_columns) != set(self.sql.get_key_columns(VIDEOS_PRIMARY_KEY)):
+            raise ValueError(
+                f"× `videos_primary_key` ({VIDEOS_PRIMARY_KEY}) in configs/envs.json "
+                f"does not match primary key of videos: ({', '.join(key_columns)})"
+            )
+
+    def create_spool(self):
+        spool_envs = WORKER_APP_ENVS.get("spool", {})
+        if not spool_envs.get("enabled", False):
+            return
+        if not self.spool:
+            self.spool = SQLSpool(
+                sql=self.sql,
+                segment_max_mb=spool_envs.get("segment_max_mb", 64),
+                replay_interval=spool_envs.get("replay_interval", 5),
+                replay_batch_rows=spool_envs.get("replay_batch_rows", 5000),
+                fresh_column=spool_envs.get("fresh_column", "insert_at"),
+            )
+            self.sql.spool = self.spool
+        self.spool.start()
+
+    def create_write_buffer(self):
+        buffer_envs = WORKER_APP_ENVS.get("write_buffer", {})
+        if not buffer_envs.get("enabled", False):
+            return
+        if not self.write_buffer:
+            converter = VideoInfoConverter()
+            write_method = buffer_envs.get("write_method", "copy")
+            if buffer_envs.get("only_update_changed", True):
+                compare_columns = converter.get_tracked_columns()
+            else:
+                compare_columns = None
+            if write_method == "unnest":
+                # e.g. stats columns, to only refresh stats of existing videos on conflict
+                unnest_query = converter.create_unnest_upsert_query(
+                    table_name="videos",
+                    primary_key=VIDEOS_PRIMARY_KEY,
+                    update_columns=buffer_envs.get("update_columns", None),
+                    compare_columns=compare_columns,
+                )
+            else:
+                unnest_query = None
+            self.write_buffer = SQLWriteBuffer(
+                sql=self.sql,
+                table_name="videos",
+                columns=converter.get_sql_columns(),
+                primary_key=VIDEOS_PRIMARY_KEY,
+                write_method=write_method,
+                unnest_query=unnest_query,
+                compare_columns=compare_columns,
+                max_rows=buffer_envs.get("max_rows", 1000),
+                max_delay_ms=buffer_envs.get("max_delay_ms", 1000),
+                max_pending_rows=buffer_envs.get("max_pending_rows", 20000),
+            )
+        self.write_buffer.start()
+
+    def create_stats_history(self):
+        history_envs = WORKER_APP_ENVS.get("stats_history", {})
+        if not history_envs.get("enabled", False):
+            return
+        if not self.stats_history:
+            history_buffer = SQLWriteBuffer(
+                sql=self.sql,
+                table_name=VideoStatsHistory.TABLE_NAME,
+                columns=VideoStatsHistory.COLUMNS,
+                primary_key="aid",
+                write_method="append",
+                max_rows=history_envs.get("max_rows", 5000),
+                max_delay_ms=history_envs.get("max_delay_ms", 5000),
+                max_pending_rows=history_envs.get("max_pending_rows", 50000),
+            )
+            self.stats_history = VideoStatsHistory(write_buffer=history_buffer)
+        self.stats_history.write_buffer.start()
+
+    def create_pipeline(self):
+        pipeline_envs = WORKER_APP_ENVS.get("pipeline", {})
+        if not pipeline_envs.get("enabled", False) or not self.write_buffer:
+            return
+        if not self.pipeline:
+            self.pipeline = VideoRowsPipeline(
+                write_buffer=self.write_buffer,
+                generator=self.generator,
+                converters_num=pipeline_envs.get("converters_num", 2),
+                writers_num=pipeline_envs.get("writers_num", 1),
+                pages_queue_size=pipeline_envs.get("pages_queue_size", 200),
+                rows_queue_size=pipeline_envs.get("rows_queue_size", 5000),
+            )
+        self.pipeline.generator = self.generator
+        self.pipeline.start()
+
     def create_workers(self, max_workers: Optional[int] = Body(40)):
         self.reset_using_proxies()
         self.workers: List[Worker] = []
+        if self.engine == "async":
+            worker_class = AsyncWorker
+        else:
+            worker_class = Worker
         for i in range(max_workers):
-            worker = Worker(
-                wid=i, generator=self.generator, sql=self.sql, lock=self.lock
+            worker = worker_class(
+                wid=i,
+                generator=self.generator,
+                sql=self.sql,
+                lock=self.lock,
+                pipeline=self.pipeline,
+                write_buffer=self.write_buffer,
+                stats_history=self.stats_history,
             )
             self.workers.append(worker)
 
@@ -66,6 +202,7 @@ class WorkerApp:
         end_tid: Optional[int] = Body(-1),
         end_pn: Optional[int] = Body(-1),
         log_mids: Optional[list[int]] = Body([]),
+        incremental: Optional[bool] = Body(False),
     ):
         if not self.generator:
             self.generator = WorkerParamsGenerator(
@@ -77,27 +214,99 @@ class WorkerApp:
                 end_tid=end_tid,
                 end_pn=end_pn,
                 log_mids=log_mids,
+                max_active_regions=WORKER_APP_ENVS.get("max_active_regions", 16),
             )
             log_str = (
                 f"Get {len(self.generator.tids)} region tids:\n{self.generator.tids}"
             )
             self.generator.log_to_file(log_type="others", log_str=log_str)
-        if not self.sql:
-            self.sql = SQLOperator()
+            if incremental:
+                # only crawl videos published since last crawl of each region
+                self.create_sql()
+                self.generator.planner.set_since_pubdates(
+                    self.generator.tids,
+                    sql=self.sql,
+                    overlap_seconds=WORKER_APP_ENVS.get(
+                        "incremental_overlap_seconds", 21600
+                    ),
+                )
+        self.run_workers(max_workers=max_workers)
+        return {"status": "started"}
+
+    def run_workers(self, max_workers: int = 100):
+        self.create_sql()
+        self.create_write_buffer()
+        self.create_stats_history()
+        self.create_pipeline()
+        self.checkpointer.generator = self.generator
+        self.checkpointer.start()
         self.max_workers = max_workers
         self.create_workers(max_workers=max_workers)
 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = [executor.submit(worker.run) for worker in self.workers]
-            for future in concurrent.futures.as_completed(futures):
-                future.result()
+        self.workers_exited.clear()
+        try:
+            if self.engine == "async":
+                if WORKER_APP_ENVS.get("sql_backend", "sync") == "async":
+                    sql_pool_size = WORKER_APP_ENVS.get("sql_pool_size", 1)
+                else:
+                    sql_pool_size = 0
+                workers_engine = AsyncWorkersEngine(
+                    max_connections=self.max_connections,
+                    sql_pool_size=sql_pool_size,
+                    spool=self.spool,
+                )
+                workers_engine.run(self.workers)
+            else:
+                with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=max_workers
+                ) as executor:
+                    futures = [executor.submit(worker.run) for worker in self.workers]
+                    for future in concurrent.futures.as_completed(futures):
+                        future.result()
+        finally:
+            self.workers_exited.set()
 
-        return {"status": "started"}
+    def exit_workers(self):
+        """Exit loops of running workers, and wait until `run_workers` returns."""
+        if self.workers_exited.is_set():
+            return
+        logger.note(f"> Exiting {len(self.workers)} workers ...")
+        for worker in self.workers:
+            worker.exit()
+        self.workers_exited.wait()
+        logger.mesg(f"√ All workers exited")
+
+    class ResumeFromCheckpointPostItem(BaseModel):
+        max_workers: Optional[int] = 100
+
+    def resume_from_checkpoint(self, item: ResumeFromCheckpointPostItem):
+        if not self.workers_exited.is_set():
+            # workers of running crawl would crawl pages of old generator again,
+            # so exit them, and save their progress into checkpoint before loading
+            self.exit_workers()
+            self.stop()
+        generator = self.checkpointer.load_generator()
+        if not generator:
+            return {"status": "error", "message": "No checkpoint found"}
+        self.generator = generator
+        self.run_workers(max_workers=item.max_workers)
+        return {"status": "resumed_from_checkpoint"}
 
     def stop(self):
         for worker in self.workers:
             worker.deactivate()
         logger.mesg(f"> All workers stopped")
+        # drain queued pages before checkpoint, so completed pages are really written,
+        # and pages put by workers still in flight stay in flight of checkpoint
+        if self.pipeline:
+            self.pipeline.stop()
+        if self.write_buffer:
+            self.write_buffer.flush()
+        if self.stats_history:
+            self.stats_history.write_buffer.flush()
+        if self.generator:
+            self.checkpointer.save()
+            logger.mesg(f"> Checkpoint saved: {self.checkpointer.checkpoint_path}")
 
     class ResumePostItem(BaseModel):
         num: Optional[int] = -1
@@ -108,6 +317,8 @@ class WorkerApp:
         if num == -1:
             num = self.max_workers
         logger.note(f"> Resuming workers: {num}")
+        if self.pipeline:
+            self.pipeline.start()
         resume_count = 0
         for worker in self.workers:
             if not worker.active:
@@ -121,8 +332,54 @@ class WorkerApp:
             "count": resume_count,
         }
 
-    def __del__(self):
+    def get_transport_stats(self):
+        return HTTP_TRANSPORT.stats.get()
+
+    def get_rate_controllers(self):
+        return RATE_CONTROLLERS.get_states()
+
+    def get_write_buffer_stats(self):
+        if not self.write_buffer:
+            return {"status": "disabled"}
+        return self.write_buffer.get_stats()
+
+    def get_stats_history_stats(self):
+        if not self.stats_history:
+            return {"status": "disabled"}
+        return {
+            **self.stats_history.write_buffer.get_stats(),
+            "seen_stats": self.stats_history.seen_stats.get_stats(),
+        }
+
+    def get_spool_stats(self):
+        if not self.spool:
+            return {"status": "disabled"}
+        return self.spool.get_stats()
+
+    def get_pipeline_stats(self):
+        if not self.pipeline:
+            return {"status": "disabled"}
+        return self.pipeline.get_stats()
+
+    @asynccontextmanager
+    async def lifespan(self, app: FastAPI):
+        yield
+        self.shutdown()
+
+    def shutdown(self):
+        """Stop in order of data flow, so rows of pipeline are flushed by buffers,
+        and rows failed on flush are spooled before spool is closed."""
         logger.note(f"> Shutting down: {WORKER_APP_ENVS['app_name']}")
+        if self.pipeline:
+            self.pipeline.stop()
+        if self.write_buffer:
+            self.write_buffer.stop()
+        if self.stats_history:
+            self.stats_history.write_buffer.stop()
+        if self.spool:
+            self.spool.stop()
+        if self.generator:
+            self.checkpointer.stop()
         self.reset_using_proxies()
 
     def setup_routes(self):
@@ -141,6 +398,41 @@ class WorkerApp:
             summary="Resume inactive workers",
         )(self.resume)
 
+        self.app.post(
+            "/resume_from_checkpoint",
+            summary="Resume crawl from last checkpoint",
+        )(self.resume_from_checkpoint)
+
+        self.app.get(
+            "/transport_stats",
+            summary="Get requests, bytes and latency per proxy",
+        )(self.get_transport_stats)
+
+        self.app.get(
+            "/pipeline_stats",
+            summary="Get queue sizes and written rows of pipeline",
+        )(self.get_pipeline_stats)
+
+        self.app.get(
+            "/write_buffer_stats",
+            summary="Get flush sizes and latencies of write buffer",
+        )(self.get_write_buffer_stats)
+
+        self.app.get(
+            "/stats_history_stats",
+            summary="Get appended rows and skipped unchanged stats of stats history",
+        )(self.get_stats_history_stats)
+
+        self.app.get(
+            "/spool_stats",
+            summary="Get pending segments and replayed records of local spool",
+        )(self.get_spool_stats)
+
+        self.app.get(
+            "/rate_controllers",
+            summary="Get adaptive rate states of proxies",
+        )(self.get_rate_controllers)
+
 
 app = WorkerApp().app
 
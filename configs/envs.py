@@ -16,7 +16,8 @@ BILI_DATA_ROOT = Path(BILI_DATA_ENVS["root"])
 
 secrets_path = configs_root / "secrets.json"
 SECRETS = OSEnver(secrets_path)
-SQL_ENVS = SECRETS["sql"]
+# secrets.json is local only, so modules could be imported (e.g. in tests) without it
+SQL_ENVS = SECRETS["sql"] or {}
 
-COOKIES_DICT = SECRETS["cookies"]
-COOKIES = "; ".join(f"{key}={val}" for key, val in SECRETS["cookies"].items())
+COOKIES_DICT = SECRETS["cookies"] or {}
+COOKIES = "; ".join(f"{key}={val}" for key, val in COOKIES_DICT.items())
@@ -0,0 +1,558 @@
+import asyncio
+import psycopg
+import re
+import time
+
+from tclogger import logger
+from typing import AsyncIterator, Union, Tuple, List
+
+from configs.envs import SQL_ENVS
+from networks.sql_queries import SQLQueriesMixin
+
+
+class AsyncSQLOperator(SQLQueriesMixin):
+    """Async counterpart of SQLOperator on psycopg3, with the same `exec` interface.
+    Query builders are shared by SQLQueriesMixin, and all I/O methods are coroutines.
+
+    Queries from converters in `transforms` work unchanged:
+    - `is_many=True`: `INSERT ... VALUES %s` (psycopg2 `execute_values` style) is expanded
+      to one placeholder per column, and rows are sent by `executemany`,
+      which runs in libpq pipeline mode, so all rows go in one round trip.
+    - `is_many=False`: queries with `%s` placeholders are executed as is.
+
+    `exec_prepared` uses prepared statements of psycopg3 protocol (`prepare=True`),
+    so `%s` placeholders need no conversion to `PREPARE ... $n`.
+
+    Like SQLOperator, a lane whose connection is lost is marked broken, and is
+    reconnected at most once per `reconnect_interval`. Rows to write meanwhile
+    are appended to `spool` if given, otherwise their writes return None.
+
+    Must be created and used inside a running event loop:
+
+        async with AsyncSQLOperator(pool_size=4) as sql:
+            await sql.exec(query, values, is_many=True)
+    """
+
+    VALUES_PLACEHOLDER_PATTERN = re.compile(r"VALUES\s+%s", re.IGNORECASE)
+    ROW_ERRORS = (
+        psycopg.DataError,
+        psycopg.IntegrityError,
+        psycopg.errors.CardinalityViolation,
+        ValueError,
+    )
+    CONNECTION_ERRORS = (psycopg.OperationalError, psycopg.InterfaceError)
+
+    def __init__(self, pool_size: int = 1, spool=None, reconnect_interval: float = 5.0):
+        self.host = SQL_ENVS["host"]
+        self.port = SQL_ENVS["port"]
+        self.dbname = SQL_ENVS["dbname"]
+        self.user = SQL_ENVS["user"]
+        self.password = SQL_ENVS["password"]
+        self.init_logs()
+        self.pool_size = max(pool_size, 1)
+        self.spool = spool
+        self.reconnect_interval = reconnect_interval
+        self.lanes = []
+
+    async def create_connection(self) -> psycopg.AsyncConnection:
+        return await psycopg.AsyncConnection.connect(
+            host=self.host,
+            port=self.port,
+            dbname=self.dbname,
+            user=self.user,
+            password=self.password,
+        )
+
+    async def connect(self):
+        logger.note(f"> Connecting to: {self.host}:{self.port} (async) ...")
+        self.lanes = []
+        for i in range(self.pool_size):
+            lane = {
+                "lock": asyncio.Lock(),
+                "commit_batch_idx": 0,
+                "is_broken": False,
+                "reconnect_time": 0.0,
+            }
+            await self.connect_lane(lane)
+            self.lanes.append(lane)
+        logger.success(
+            f"+ Connected to [{self.dbname}] as ({self.user}): "
+            f"{self.pool_size} async connections"
+        )
+
+    async def connect_lane(self, lane: dict):
+        lane.update(
+            {
+                "conn": await self.create_connection(),
+                "staging_tables": set(),
+                "is_broken": False,
+            }
+        )
+
+    def on_connection_error(self, lane: dict, e: Exception):
+        lane["is_broken"] = True
+        logger.warn(f"× SQL connection lost (async): {repr(e)[:200]}")
+
+    async def ensure_lane(self, lane: dict) -> bool:
+        """Same as `SQLOperator.ensure_lane`. Should be called with lane lock held."""
+        if not lane["is_broken"] and not lane["conn"].closed:
+            return True
+        if time.time() - lane["reconnect_time"] < self.reconnect_interval:
+            return False
+        lane["reconnect_time"] = time.time()
+        try:
+            await lane["conn"].close()
+        except Exception:
+            pass
+        try:
+            await self.connect_lane(lane)
+        except self.CONNECTION_ERRORS as e:
+            lane["is_broken"] = True
+            logger.warn(f"× SQL reconnect failed (async): {repr(e)[:200]}")
+            return False
+        logger.success(f"+ Reconnected to: {self.host}:{self.port} (async)")
+        return True
+
+    async def async_spool_rows(self, method: str, kwargs: dict, rows_count: int):
+        """Spool file is appended and fsynced, so not on the event loop."""
+        return await asyncio.to_thread(self.spool_rows, method, kwargs, rows_count)
+
+    async def async_log_error(
+        self, query: str, values: Union[Tuple, List[Tuple]] = None, e: Exception = None
+    ):
+        """Error log is appended to file, so not on the event loop."""
+        await asyncio.to_thread(self.log_error, query, values, e)
+
+    async def async_quarantine_rows(
+        self, query: str, values_list: List[Tuple], e: Exception
+    ):
+        await asyncio.to_thread(self.quarantine_rows, query, values_list, e)
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def expand_values_placeholder(self, query: str, values: Tuple) -> str:
+        placeholders = ", ".join(["%s"] * len(values))
+        return self.VALUES_PLACEHOLDER_PATTERN.sub(
+            f"VALUES ({placeholders})", query, count=1
+        )
+
+    async def executemany_isolated(
+        self,
+        conn: psycopg.AsyncConnection,
+        query: str,
+        values_list: List[Tuple],
+        is_fetchall: bool = False,
+    ) -> list:
+        """Same as `SQLOperator.execute_values_isolated`, with `executemany`."""
+        await conn.execute("SAVEPOINT batch")
+        try:
+            res = []
+            async with conn.cursor() as cur:
+                many_query = self.expand_values_placeholder(query, values_list[0])
+                await cur.executemany(many_query, values_list, returning=is_fetchall)
+                if is_fetchall:
+                    while True:
+                        if cur.description:
+                            res.extend(await cur.fetchall())
+                        if not cur.nextset():
+                            break
+            await conn.execute("RELEASE SAVEPOINT batch")
+            return res
+        except self.ROW_ERRORS as e:
+            await conn.execute("ROLLBACK TO SAVEPOINT batch")
+            await conn.execute("RELEASE SAVEPOINT batch")
+            if len(values_list) <= 1:
+                await self.async_quarantine_rows(query, values_list, e)
+                return []
+            mid = len(values_list) // 2
+            return await self.executemany_isolated(
+                conn, query, values_list[:mid], is_fetchall
+            ) + await self.executemany_isolated(
+                conn, query, values_list[mid:], is_fetchall
+            )
+
+    async def exec(
+        self,
+        query: str,
+        values: Union[Tuple, List[Tuple]] = None,
+        is_fetchall: bool = False,
+        is_many: bool = False,
+        commit_batch_size: int = 1,
+        lane_idx: int = 0,
+    ):
+        lane = self.lanes[lane_idx]
+        res = None
+        async with lane["lock"]:
+            spool_kwargs = {
+                "query": query,
+                "values": values,
+                "is_fetchall": is_fetchall,
+                "is_many": True,
+            }
+            if not await self.ensure_lane(lane):
+                if is_many and values:
+                    return await self.async_spool_rows(
+                        "exec", spool_kwargs, len(values)
+                    )
+                return res
+            conn = lane["conn"]
+            try:
+                if not is_many:
+                    async with conn.cursor() as cur:
+                        await cur.execute(query, values)
+                        if is_fetchall and cur.description:
+                            res = await cur.fetchall()
+                elif values:
+                    # fetched rows, or [] if not `is_fetchall`, so None means failed
+                    res = await self.executemany_isolated(
+                        conn, query, values, is_fetchall
+                    )
+            except self.CONNECTION_ERRORS as e:
+                self.on_connection_error(lane, e)
+                if is_many and values:
+                    return await self.async_spool_rows(
+                        "exec", spool_kwargs, len(values)
+                    )
+                return res
+            except Exception as e:
+                await self.async_log_error(query, values, e)
+                await conn.rollback()
+
+            try:
+                if commit_batch_size <= 1:
+                    await conn.commit()
+                else:
+                    lane["commit_batch_idx"] += 1
+                    if lane["commit_batch_idx"] % commit_batch_size == 0:
+                        await conn.commit()
+            except Exception as e:
+                await self.async_log_error(query, values, e)
+                res = None
+
+        return res
+
+    async def run_in_lanes(self, lane_func, lanes_values: dict) -> list:
+        """Await `lane_func(lane_idx, values_list)` of each lane concurrently."""
+        return await asyncio.gather(
+            *[
+                lane_func(lane_idx, lanes_values[lane_idx])
+                for lane_idx in sorted(lanes_values.keys())
+            ]
+        )
+
+    async def exec_by_keys(
+        self, query: str, values_list: List[Tuple], keys: list
+    ) -> dict:
+        async def exec_lane(lane_idx: int, lane_values_list: List[Tuple]):
+            res = await self.exec(
+                query,
+                lane_values_list,
+                is_fetchall=True,
+                is_many=True,
+                lane_idx=lane_idx,
+            )
+            return self.to_upsert_counts(res, len(lane_values_list))
+
+        return self.sum_upsert_counts(
+            await self.run_in_lanes(
+                exec_lane, self.partition_by_keys(values_list, keys)
+            )
+        )
+
+    async def exec_prepared(
+        self,
+        query: str,
+        values: Tuple = None,
+        is_fetchall: bool = False,
+        lane_idx: int = 0,
+    ):
+        lane = self.lanes[lane_idx]
+        spool_kwargs = {"query": query, "values": values}
+        rows_count = len(values[0]) if values else 0
+        res = None
+        async with lane["lock"]:
+            if not await self.ensure_lane(lane):
+                return await self.async_spool_rows(
+                    "exec_prepared", spool_kwargs, rows_count
+                )
+            conn = lane["conn"]
+            try:
+                async with conn.cursor() as cur:
+                    await cur.execute(query, values, prepare=True)
+                    if is_fetchall and cur.description:
+                        res = await cur.fetchall()
+                    else:
+                        res = cur.rowcount
+                await conn.commit()
+            except self.CONNECTION_ERRORS as e:
+                self.on_connection_error(lane, e)
+                return await self.async_spool_rows(
+                    "exec_prepared", spool_kwargs, rows_count
+                )
+            except Exception as e:
+                await conn.rollback()
+                await self.async_log_error(query, values, e)
+        return res
+
+    async def exec_unnest_by_keys(
+        self,
+        query: str,
+        values_list: List[Tuple],
+        keys: list,
+    ):
+        async def exec_lane(lane_idx: int, lane_values_list: List[Tuple]):
+            res = await self.exec_prepared(
+                query,
+                self.to_column_arrays(lane_values_list),
+                is_fetchall=True,
+                lane_idx=lane_idx,
+            )
+            return self.to_upsert_counts(res, len(lane_values_list))
+
+        return self.sum_upsert_counts(
+            await self.run_in_lanes(
+                exec_lane, self.partition_by_keys(values_list, keys)
+            )
+        )
+
+    async def iter_batches(
+        self,
+        query: str,
+        values: Tuple = None,
+        itersize: int = 2000,
+        cursor_name: str = "stream_cursor",
+    ) -> AsyncIterator[List[Tuple]]:
+        conn = await self.create_connection()
+        await conn.set_read_only(True)
+        try:
+            async with conn.cursor(name=cursor_name) as cur:
+                cur.itersize = itersize
+                await cur.execute(query, values)
+                while True:
+                    rows = await cur.fetchmany(itersize)
+                    if not rows:
+                        break
+                    yield rows
+        finally:
+            await conn.rollback()
+            await conn.close()
+
+    async def iter_rows(
+        self,
+        query: str,
+        values: Tuple = None,
+        itersize: int = 2000,
+        cursor_name: str = "stream_cursor",
+    ) -> AsyncIterator[Tuple]:
+        async for rows in self.iter_batches(query, values, itersize, cursor_name):
+            for row in rows:
+                yield row
+
+    async def iter_by_keyset(
+        self,
+        table_name: str,
+        columns: List[str],
+        key: str = "bvid",
+        where: str = None,
+        values: Tuple = (),
+        page_size: int = 10000,
+        start_key=None,
+    ) -> AsyncIterator[Tuple]:
+        """Same as `SQLOperator.iter_by_keyset`, on a dedicated read-only connection."""
+        if key not in columns:
+            columns = [key, *columns]
+        key_idx = columns.index(key)
+        last_key = start_key
+        conn = await self.create_connection()
+        await conn.set_read_only(True)
+        await conn.set_autocommit(True)
+        try:
+            async with conn.cursor() as cur:
+                while True:
+                    query = self.create_keyset_query(
+                        table_name,
+                        columns,
+                        key,
+                        where,
+                        is_after_key=last_key is not None,
+                    )
+                    params = tuple(values)
+                    if last_key is not None:
+                        params = (*params, last_key)
+                    await cur.execute(query, (*params, page_size))
+                    rows = await cur.fetchall()
+                    for row in rows:
+                        yield row
+                    if len(rows) < page_size:
+                        break
+                    last_key = rows[-1][key_idx]
+        finally:
+            await conn.close()
+
+    async def create_staging_table(self, lane: dict, table_name: str) -> str:
+        staging_table = f"{table_name}_staging"
+        if staging_table not in lane["staging_tables"]:
+            await lane["conn"].execute(
+                f"CREATE TEMP TABLE IF NOT EXISTS {staging_table} "
+                f"(LIKE {table_name} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS;"
+            )
+            lane["staging_tables"].add(staging_table)
+        return staging_table
+
+    async def copy_upsert(
+        self,
+        table_name: str,
+        columns: List[str],
+        values_list: List[Tuple],
+        primary_key: str = "bvid",
+        lane_idx: int = 0,
+        compare_columns: List[str] = None,
+    ) -> dict:
+        if not values_list:
+            return self.count_upsert_results([], 0)
+        lane = self.lanes[lane_idx]
+        columns_str = ", ".join(columns)
+        spool_kwargs = {
+            "table_name": table_name,
+            "columns": columns,
+            "values_list": values_list,
+            "primary_key": primary_key,
+            "compare_columns": compare_columns,
+        }
+        async with lane["lock"]:
+            if not await self.ensure_lane(lane):
+                return await self.async_spool_rows(
+                    "copy_upsert", spool_kwargs, len(values_list)
+                )
+            conn = lane["conn"]
+            try:
+                staging_table = await self.create_staging_table(lane, table_name)
+                async with conn.cursor() as cur:
+                    async with cur.copy(
+                        f"COPY {staging_table} ({columns_str}) FROM STDIN"
+                    ) as copy:
+                        for values in values_list:
+                            await copy.write_row(values)
+                    route_query = self.create_route_query(
+                        table_name, staging_table, primary_key
+                    )
+                    if route_query:
+                        await cur.execute(route_query)
+                    await cur.execute(
+                        self.create_merge_query(
+                            table_name,
+                            staging_table,
+                            columns,
+                            primary_key,
+                            compare_columns,
+                        )
+                    )
+                    counts = self.count_upsert_results(
+                        await cur.fetchall(), len(values_list)
+                    )
+                await conn.commit()
+            except self.ROW_ERRORS as e:
+                await conn.rollback()
+                lane["staging_tables"].clear()
+                logger.warn(f"× COPY INTO {table_name} failed, retry isolated: {e}")
+                counts = await self.upsert_isolated(
+                    lane, table_name, columns, values_list, primary_key, compare_columns
+                )
+            except self.CONNECTION_ERRORS as e:
+                self.on_connection_error(lane, e)
+                counts = None
+            except Exception as e:
+                await conn.rollback()
+                lane["staging_tables"].clear()
+                await self.async_log_error(f"COPY INTO {table_name}", values_list, e)
+                counts = None
+            if lane["is_broken"]:
+                counts = await self.async_spool_rows(
+                    "copy_upsert", spool_kwargs, len(values_list)
+                )
+        return counts
+
+    async def upsert_isolated(
+        self,
+        lane: dict,
+        table_name: str,
+        columns: List[str],
+        values_list: List[Tuple],
+        primary_key: str = "bvid",
+        compare_columns: List[str] = None,
+    ) -> dict:
+        query = self.create_values_upsert_query(
+            table_name, columns, primary_key, compare_columns
+        )
+        route_keys_query = self.create_route_keys_query(table_name, primary_key)
+        conn = lane["conn"]
+        try:
+            if route_keys_query:
+                id_idx = columns.index(self.get_key_columns(primary_key)[0])
+                cur = await conn.execute(
+                    route_keys_query, ([values[id_idx] for values in values_list],)
+                )
+                values_list = self.route_values(
+                    values_list, columns, primary_key, await cur.fetchall()
+                )
+            rows = self.dedup_by_primary_key(values_list, columns, primary_key)
+            res = await self.executemany_isolated(
+                conn, query, list(rows.values()), is_fetchall=True
+            )
+            await conn.commit()
+            return self.count_upsert_results(res, len(values_list))
+        except self.CONNECTION_ERRORS as e:
+            self.on_connection_error(lane, e)
+            return None
+        except Exception as e:
+            await conn.rollback()
+            await self.async_log_error(query, values_list, e)
+            return None
+
+    async def copy_upsert_by_keys(
+        self,
+        table_name: str,
+        columns: List[str],
+        values_list: List[Tuple],
+        keys: list,
+        primary_key: str = "bvid",
+        compare_columns: List[str] = None,
+    ) -> dict:
+        async def copy_lane(lane_idx: int, lane_values_list: List[Tuple]):
+            return await self.copy_upsert(
+                table_name,
+                columns,
+                lane_values_list,
+                primary_key=primary_key,
+                lane_idx=lane_idx,
+                compare_columns=compare_columns,
+            )
+
+        return self.sum_upsert_counts(
+            await self.run_in_lanes(
+                copy_lane, self.partition_by_keys(values_list, keys)
+            )
+        )
+
+    async def close(self):
+        for lane in self.lanes:
+            await lane["conn"].close()
+        self.lanes = []
+        return True
+
+
+if __name__ == "__main__":
+
+    async def main():
+        async with AsyncSQLOperator() as sql:
+            res = await sql.exec("SELECT current_database();", is_fetchall=True)
+            logger.success(res)
+
+    asyncio.run(main())
+
+    # python -m networks.async_sql
@@ -0,0 +1,100 @@
+import heapq
+import itertools
+
+from typing import Any, Hashable
+
+
+class KeyedHeap:
+    """Min-heap of items with unique keys, supporting O(log n) push, pop, remove and update.
+
+    Each heap entry is `[priority, seq, key]`. Removing or updating a key only marks
+    its old entry as removed (key set to None), which is skipped when popped (lazy deletion).
+    `seq` breaks ties of priorities in insertion order, so keys are never compared.
+    Heap is rebuilt when removed entries outnumber live entries, to bound its size.
+
+    Not thread-safe, callers should hold their own lock.
+    """
+
+    REMOVED = None
+
+    def __init__(self):
+        self.heap = []
+        self.entries = {}
+        self.items = {}
+        self.counter = itertools.count()
+        self.removed_count = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.entries
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        return self.items.get(key, default)
+
+    def keys(self) -> list:
+        return list(self.entries.keys())
+
+    def push(self, key: Hashable, priority: tuple, item: Any = None):
+        """Add key, or update its priority and item if it exists."""
+        if key in self.entries:
+            self.mark_removed(key)
+        entry = [priority, next(self.counter), key]
+        self.entries[key] = entry
+        self.items[key] = item
+        heapq.heappush(self.heap, entry)
+        self.compact_if_needed()
+
+    def mark_removed(self, key: Hashable):
+        entry = self.entries.pop(key)
+        entry[-1] = self.REMOVED
+        self.removed_count += 1
+
+    def remove(self, key: Hashable) -> Any:
+        """Remove key, and return its item (None if not exists)."""
+        if key not in self.entries:
+            return None
+        self.mark_removed(key)
+        item = self.items.pop(key)
+        self.compact_if_needed()
+        return item
+
+    def peek(self) -> tuple[Hashable, Any]:
+        while self.heap and self.heap[0][-1] is self.REMOVED:
+            heapq.heappop(self.heap)
+            self.removed_count -= 1
+        if not self.heap:
+            return None, None
+        key = self.heap[0][-1]
+        return key, self.items[key]
+
+    def pop(self) -> tuple[Hashable, Any]:
+        """Pop key and item with lowest priority, or `(None, None)` if empty."""
+        key, item = self.peek()
+        if key is None:
+            return None, None
+        heapq.heappop(self.heap)
+        del self.entries[key]
+        del self.items[key]
+        return key, item
+
+    def compact_if_needed(self):
+        """Removed entries of updated or removed keys are only dropped when popped,
+        so heap is rebuilt when they outnumber live entries."""
+        if self.removed_count > len(self.entries) + 64:
+            self.compact()
+
+    def compact(self):
+        self.heap = [entry for entry in self.heap if entry[-1] is not self.REMOVED]
+        heapq.heapify(self.heap)
+        self.removed_count = 0
+
+    def clear(self):
+        self.heap = []
+        self.entries = {}
+        self.items = {}
+        self.removed_count = 0
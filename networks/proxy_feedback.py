@@ -0,0 +1,169 @@
+import requests
+import threading
+import time
+
+from tclogger import logger
+
+from configs.envs import PROXY_APP_ENVS, PROXY_VIEW_APP_ENVS
+
+
+class ProxyFeedbackReporter:
+    """Batch per-request outcomes of proxies, and post them to `/report` of proxy app.
+
+    `record` only adds to in-memory counters, so it is cheap to call after each request,
+    including on the event loop of AsyncWorker. A background thread posts
+    `{"reports": [{server, requests, successes, latency_sum, latencies}, ...]}`
+    every `interval` seconds.
+
+    Leases of proxies held by this process (`hold`) are posted as `lease_ids` too,
+    as heartbeats, while their holders make progress (`touch`).
+    Leases not touched within `stale_seconds` (e.g. holder thread died or paused),
+    or already expired (`expired` in response), are no longer heartbeated,
+    so proxy app reclaims them, and holders should get new proxies
+    when `pop_expired` is True.
+    """
+
+    def __init__(
+        self, report_api: str, interval: float = 5.0, stale_seconds: float = 300
+    ):
+        self.report_api = report_api
+        self.interval = interval
+        self.stale_seconds = stale_seconds
+        self.lock = threading.Lock()
+        self.reports = {}
+        # lease_id -> last time its holder made progress
+        self.lease_times = {}
+        self.expired_lease_ids = set()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def record(self, proxy: str, latency: float = None, is_success: bool = True):
+        if not proxy:
+            return
+        with self.lock:
+            report = self.reports.setdefault(
+                proxy,
+                {"requests": 0, "successes": 0, "latency_sum": 0.0, "latencies": 0},
+            )
+            report["requests"] += 1
+            if is_success:
+                report["successes"] += 1
+            # requests without response (e.g. timeout) only count as failures
+            if latency is not None:
+                report["latency_sum"] += latency
+                report["latencies"] += 1
+        if not self.thread:
+            self.start()
+
+    def hold(self, lease_id: str):
+        if not lease_id:
+            return
+        with self.lock:
+            self.lease_times[lease_id] = time.monotonic()
+        if not self.thread:
+            self.start()
+
+    def touch(self, lease_id: str):
+        """Called by holder in each loop, to keep its lease heartbeated."""
+        with self.lock:
+            if lease_id in self.lease_times:
+                self.lease_times[lease_id] = time.monotonic()
+
+    def unhold(self, lease_id: str):
+        with self.lock:
+            self.lease_times.pop(lease_id, None)
+            self.expired_lease_ids.discard(lease_id)
+
+    def pop_expired(self, lease_id: str) -> bool:
+        """True if lease is expired by proxy app, so its proxy might be leased to others."""
+        if not lease_id:
+            return False
+        with self.lock:
+            if lease_id not in self.expired_lease_ids:
+                return False
+            self.expired_lease_ids.discard(lease_id)
+            return True
+
+    def mark_expired(self, lease_ids: list[str]):
+        with self.lock:
+            for lease_id in lease_ids:
+                if lease_id in self.lease_times:
+                    self.lease_times.pop(lease_id)
+                    self.expired_lease_ids.add(lease_id)
+
+    def get_alive_lease_ids(self) -> list[str]:
+        """Lease ids touched within `stale_seconds`, and stale ones are marked expired."""
+        now = time.monotonic()
+        with self.lock:
+            lease_times = list(self.lease_times.items())
+        stale_lease_ids = [
+            lease_id
+            for lease_id, lease_time in lease_times
+            if now - lease_time > self.stale_seconds
+        ]
+        if stale_lease_ids:
+            logger.warn(f"× {len(stale_lease_ids)} leases stale, stop heartbeats")
+            self.mark_expired(stale_lease_ids)
+        return [
+            lease_id
+            for lease_id, lease_time in lease_times
+            if now - lease_time <= self.stale_seconds
+        ]
+
+    def take_reports(self) -> list[dict]:
+        with self.lock:
+            reports, self.reports = self.reports, {}
+        return [{"server": server, **report} for server, report in reports.items()]
+
+    def flush(self) -> int:
+        reports = self.take_reports()
+        lease_ids = self.get_alive_lease_ids()
+        if not reports and not lease_ids:
+            return 0
+        try:
+            res = requests.post(
+                self.report_api,
+                json={"reports": reports, "lease_ids": lease_ids},
+                timeout=5,
+            )
+            res.raise_for_status()
+            expired_lease_ids = res.json().get("expired", [])
+        except Exception as e:
+            logger.warn(f"× Failed to report proxies feedback: {e}")
+            expired_lease_ids = []
+        if expired_lease_ids:
+            logger.warn(f"× {len(expired_lease_ids)} leases expired")
+            self.mark_expired(expired_lease_ids)
+        return len(reports)
+
+    def report_loop(self):
+        while not self.stop_event.wait(self.interval):
+            self.flush()
+
+    def start(self):
+        with self.lock:
+            if self.thread:
+                return
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self.report_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        self.flush()
+
+
+# LINK apps/proxy_app.py#report
+PROXY_FEEDBACK = ProxyFeedbackReporter(
+    report_api=f"http://127.0.0.1:{PROXY_APP_ENVS['port']}/report",
+    interval=PROXY_APP_ENVS.get("feedback_interval", 5),
+    stale_seconds=PROXY_APP_ENVS.get("lease_ttl", 300),
+)
+PROXY_VIEW_FEEDBACK = ProxyFeedbackReporter(
+    report_api=f"http://127.0.0.1:{PROXY_VIEW_APP_ENVS['port']}/report",
+    interval=PROXY_VIEW_APP_ENVS.get("feedback_interval", 5),
+    stale_seconds=PROXY_VIEW_APP_ENVS.get("lease_ttl", 300),
+)
@@ -8,6 +8,7 @@ from tclogger import logger, int_bits, OSEnver, Runtimer
 from typing import Literal
 
 from networks.constants import REQUESTS_HEADERS
+from networks.transport import HTTPTransport
 from configs.envs import SECRETS
 
 
@@ -51,6 +52,9 @@ class ProxyBenchmarker:
         self.retry_interval = 0.1
         self.accept_success_rate = 0.2
         self.test_timeout = 1
+        # not the shared HTTP_TRANSPORT, as each tested proxy would keep a pooled
+        # session there, so sessions are closed after each proxy is tested
+        self.transport = HTTPTransport(pool_maxsize=1)
 
     def test_proxy(self, proxy=None, good_callback=None, bad_callback=None):
         self.tested_count += 1
@@ -64,11 +68,11 @@ class ProxyBenchmarker:
         while current_proxy_retry_count < self.retry_count:
             try:
                 self.timer.start_time()
-                res = requests.get(
+                res = self.transport.get(
                     self.test_url,
-                    headers=REQUESTS_HEADERS,
-                    proxies={"http": f"http://{proxy}", "https": f"http://{proxy}"},
+                    proxy=proxy,
                     timeout=self.test_timeout,
+                    deadline=self.test_timeout * 2,
                 )
                 self.timer.end_time()
                 elapsed_time = self.timer.elapsed_time()
@@ -94,6 +98,8 @@ class ProxyBenchmarker:
             current_proxy_retry_count += 1
             time.sleep(self.retry_interval)
 
+        self.transport.close_session(proxy)
+        self.transport.stats.pop(proxy)
         current_proxy_success_rate = current_proxy_success_count / self.retry_count
 
         if current_proxy_success_rate < self.accept_success_rate:
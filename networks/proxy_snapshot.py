@@ -0,0 +1,132 @@
+import sqlite3
+import threading
+
+from datetime import datetime
+from pathlib import Path
+from tclogger import logger
+
+
+class ProxiesSnapshotter:
+    """Periodically persist proxies of ProxiesDatabase to a local SQLite file.
+
+    Each snapshot replaces all rows in one transaction, so a crash during saving
+    would leave the previous snapshot intact.
+    Rows are `(server, status, latency, success_rate, last_checked, lease_*)`,
+    where `last_checked` of bad proxies is when they were dropped, used for cooldown,
+    and `lease_*` columns are the lease of using proxies (NULL for others),
+    so leased proxies are not leased twice after restart.
+    """
+
+    COLUMNS = ["server", "status", "latency", "success_rate", "last_checked"]
+    LEASE_COLUMNS = {
+        "lease_id": "TEXT",
+        "holder": "TEXT",
+        "ttl": "REAL",
+        "leased_at": "REAL",
+        "expires_at": "REAL",
+    }
+
+    def __init__(self, db=None, snapshot_path: Path = None, interval: float = 30):
+        self.db = db
+        self.snapshot_path = snapshot_path or (
+            Path(__file__).parents[1] / "data" / "proxies" / "proxies.sqlite"
+        )
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def connect(self) -> sqlite3.Connection:
+        self.snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.snapshot_path)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS proxies ("
+            "server TEXT PRIMARY KEY, status TEXT, latency REAL, "
+            "success_rate REAL, last_checked TEXT)"
+        )
+        # snapshots saved before leases have no lease columns
+        existed_columns = [row[1] for row in conn.execute("PRAGMA table_info(proxies)")]
+        with conn:
+            for column, column_type in self.LEASE_COLUMNS.items():
+                if column not in existed_columns:
+                    conn.execute(
+                        f"ALTER TABLE proxies ADD COLUMN {column} {column_type}"
+                    )
+        return conn
+
+    def get_columns(self) -> list[str]:
+        return self.COLUMNS + list(self.LEASE_COLUMNS.keys())
+
+    def save(self) -> int:
+        if not self.db:
+            return 0
+        rows = self.db.get_rows()
+        values_list = []
+        for row in rows:
+            lease = row.get("lease") or {}
+            values_list.append(
+                (
+                    row["server"],
+                    row["status"],
+                    row["latency"],
+                    row["success_rate"],
+                    row["last_checked"].isoformat(),
+                    *[lease.get(column) for column in self.LEASE_COLUMNS],
+                )
+            )
+        columns = self.get_columns()
+        columns_str = ", ".join(columns)
+        placeholders = ", ".join(["?"] * len(columns))
+        conn = self.connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM proxies")
+                conn.executemany(
+                    f"INSERT INTO proxies ({columns_str}) VALUES ({placeholders})",
+                    values_list,
+                )
+        finally:
+            conn.close()
+        return len(values_list)
+
+    def load(self) -> list[dict]:
+        if not self.snapshot_path.exists():
+            logger.warn(f"× No proxies snapshot found: {self.snapshot_path}")
+            return []
+        columns = self.get_columns()
+        columns_str = ", ".join(columns)
+        conn = self.connect()
+        try:
+            values_list = conn.execute(f"SELECT {columns_str} FROM proxies").fetchall()
+        finally:
+            conn.close()
+        rows = []
+        for values in values_list:
+            row = dict(zip(self.COLUMNS, values))
+            row["last_checked"] = datetime.fromisoformat(row["last_checked"])
+            lease = dict(zip(self.LEASE_COLUMNS, values[len(self.COLUMNS) :]))
+            row["lease"] = lease if lease["lease_id"] else None
+            rows.append(row)
+        logger.note(f"> Load {len(rows)} proxies from snapshot:")
+        logger.file(f"  - {self.snapshot_path}")
+        return rows
+
+    def save_loop(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.save()
+            except Exception as e:
+                logger.warn(f"× Failed to save proxies snapshot: {e}")
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.save_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        self.save()
@@ -0,0 +1,153 @@
+import threading
+import time
+
+
+class ProxyRateController:
+    """AIMD rate controller of one proxy.
+
+    - Additive increase: each fast success raises rate by `increase_step`.
+    - Multiplicative decrease: failures and rate-limit responses cut rate by factors.
+    - Congestion: while smoothed success rate is below `success_rate_threshold`,
+      or smoothed latency is above `latency_target`, successes cut rate by
+      `congestion_decrease_factor` instead of raising it.
+
+    `reserve()` returns the seconds to wait before next request, like a token bucket
+    with bucket size 1, so requests of the same proxy are spaced by `1 / rate`.
+    """
+
+    # HTTP status codes and bilibili `code`s which mean "too many requests"
+    RATE_LIMIT_STATUS_CODES = [412, 429, 503]
+    RATE_LIMIT_CODES = [-412, -509, -799]
+
+    def __init__(
+        self,
+        proxy: str = None,
+        rate: float = 0.4,
+        min_rate: float = 0.05,
+        max_rate: float = 10.0,
+        increase_step: float = 0.05,
+        failure_decrease_factor: float = 0.75,
+        rate_limit_decrease_factor: float = 0.5,
+        latency_target: float = 1.5,
+        success_rate_threshold: float = 0.8,
+        congestion_decrease_factor: float = 0.9,
+        ewma_alpha: float = 0.2,
+    ):
+        self.proxy = proxy
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase_step = increase_step
+        self.failure_decrease_factor = failure_decrease_factor
+        self.rate_limit_decrease_factor = rate_limit_decrease_factor
+        self.latency_target = latency_target
+        self.success_rate_threshold = success_rate_threshold
+        self.congestion_decrease_factor = congestion_decrease_factor
+        self.ewma_alpha = ewma_alpha
+        self.lock = threading.Lock()
+        self.next_time = time.monotonic()
+        self.latency_ewma = None
+        self.success_rate_ewma = 1.0
+        self.success_count = 0
+        self.failure_count = 0
+        self.rate_limited_count = 0
+
+    def reserve(self) -> float:
+        with self.lock:
+            now = time.monotonic()
+            wait_seconds = max(self.next_time - now, 0)
+            self.next_time = max(self.next_time, now) + 1 / self.rate
+        return wait_seconds
+
+    def wait(self):
+        time.sleep(self.reserve())
+
+    def is_rate_limited(self, status_code: int = None, code: int = None) -> bool:
+        return (
+            status_code in self.RATE_LIMIT_STATUS_CODES or code in self.RATE_LIMIT_CODES
+        )
+
+    def ewma(self, old_value: float, new_value: float) -> float:
+        if old_value is None:
+            return new_value
+        return (1 - self.ewma_alpha) * old_value + self.ewma_alpha * new_value
+
+    def is_congested(self) -> bool:
+        """Should be called with lock held."""
+        if self.success_rate_ewma < self.success_rate_threshold:
+            return True
+        return self.latency_ewma is not None and self.latency_ewma > self.latency_target
+
+    def report(
+        self,
+        is_success: bool,
+        latency: float = None,
+        status_code: int = None,
+        code: int = None,
+    ):
+        with self.lock:
+            self.success_rate_ewma = self.ewma(
+                self.success_rate_ewma, 1.0 if is_success else 0.0
+            )
+            if latency is not None:
+                self.latency_ewma = self.ewma(self.latency_ewma, latency)
+
+            if self.is_rate_limited(status_code=status_code, code=code):
+                self.rate_limited_count += 1
+                self.rate *= self.rate_limit_decrease_factor
+            elif not is_success:
+                self.failure_count += 1
+                self.rate *= self.failure_decrease_factor
+            else:
+                self.success_count += 1
+                if self.is_congested():
+                    self.rate *= self.congestion_decrease_factor
+                elif latency is None or latency <= self.latency_target:
+                    self.rate += self.increase_step
+            self.rate = min(max(self.rate, self.min_rate), self.max_rate)
+
+    def get_state(self) -> dict:
+        with self.lock:
+            if self.latency_ewma is None:
+                latency_ewma = None
+            else:
+                latency_ewma = round(self.latency_ewma, 4)
+            return {
+                "rate": round(self.rate, 4),
+                "interval": round(1 / self.rate, 4),
+                "latency_ewma": latency_ewma,
+                "success_rate_ewma": round(self.success_rate_ewma, 4),
+                "success": self.success_count,
+                "failure": self.failure_count,
+                "rate_limited": self.rate_limited_count,
+            }
+
+
+class ProxyRateControllers:
+    """Registry of ProxyRateController, keyed by proxy server."""
+
+    def __init__(self, **controller_kwargs):
+        self.controller_kwargs = controller_kwargs
+        self.controllers = {}
+        self.lock = threading.Lock()
+
+    def get(self, proxy: str = None) -> ProxyRateController:
+        key = proxy or "direct"
+        with self.lock:
+            controller = self.controllers.get(key)
+            if not controller:
+                controller = ProxyRateController(proxy=proxy, **self.controller_kwargs)
+                self.controllers[key] = controller
+        return controller
+
+    def remove(self, proxy: str = None):
+        with self.lock:
+            self.controllers.pop(proxy or "direct", None)
+
+    def get_states(self) -> dict:
+        with self.lock:
+            controllers = list(self.controllers.items())
+        return {key: controller.get_state() for key, controller in controllers}
+
+
+RATE_CONTROLLERS = ProxyRateControllers()
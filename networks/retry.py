@@ -0,0 +1,195 @@
+import aiohttp
+import asyncio
+import json
+import random
+import requests
+import socket
+import time
+
+from typing import Literal
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
+
+from networks.rate_control import ProxyRateController
+from networks.transport import DeadlineExceeded
+
+
+class RetryPolicy:
+    """Classify outcome of each request attempt, and decide what to do next.
+
+    Outcome categories:
+    - "ok": HTTP 200 and bilibili `code` is 0
+    - "connect_timeout", "connect_error": proxy is unreachable
+    - "read_timeout": connected, but response is too slow (including deadline exceeded)
+    - "http_status": HTTP status code is not 200
+    - "bad_response": body is not valid json
+    - "bili_code": bilibili `code` is not 0
+    - "error": exception not from network (e.g. bugs in parsing), which is given up,
+      and requeued a few times by `WorkerParamsGenerator.give_up_page`
+
+    Decisions:
+    - "done": return the response
+    - "retry": retry on the same proxy, after jittered exponential backoff
+    - "switch_proxy": current proxy is dead or blocked, switch proxy immediately
+    - "requeue": time budget or attempts are used up, put the task back to queue
+    - "give_up": the error is permanent (e.g. video not found), do not retry
+    """
+
+    # same as rate limits of ProxyRateController (including 503), which cut its rate,
+    # so they switch proxy here, instead of retrying on the throttled proxy
+    RATE_LIMIT_STATUS_CODES = ProxyRateController.RATE_LIMIT_STATUS_CODES
+    RETRY_STATUS_CODES = [500, 502, 504]
+    # -412: request blocked; -509/-799: requests too frequent
+    SWITCH_PROXY_CODES = ProxyRateController.RATE_LIMIT_CODES
+    # -400: bad request; -404: not found; 62002: video invisible; 62004: video in review
+    GIVE_UP_CODES = [-400, -404, 62002, 62004]
+
+    def __init__(
+        self,
+        budget: float = 10.0,
+        max_attempts: int = 8,
+        same_proxy_retries: int = 2,
+        backoff_base: float = 0.2,
+        backoff_max: float = 2.0,
+    ):
+        self.budget = budget
+        self.max_attempts = max_attempts
+        self.same_proxy_retries = same_proxy_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def new_state(self) -> dict:
+        return {
+            "start_time": time.perf_counter(),
+            "attempts": 0,
+            "same_proxy_attempts": 0,
+        }
+
+    def get_remaining_seconds(self, state: dict) -> float:
+        return self.budget - (time.perf_counter() - state["start_time"])
+
+    def classify_exception(self, exception: Exception) -> str:
+        # before RequestException, as `res.json()` of requests raises its subclass
+        if isinstance(
+            exception, (json.JSONDecodeError, requests.exceptions.JSONDecodeError)
+        ):
+            return "bad_response"
+        if isinstance(exception, requests.exceptions.ConnectTimeout):
+            return "connect_timeout"
+        if isinstance(exception, (requests.exceptions.ReadTimeout, DeadlineExceeded)):
+            return "read_timeout"
+        if isinstance(exception, requests.exceptions.ConnectionError):
+            return "connect_error"
+        aiohttp_connection_timeout = getattr(aiohttp, "ConnectionTimeoutError", None)
+        if aiohttp_connection_timeout and isinstance(
+            exception, aiohttp_connection_timeout
+        ):
+            return "connect_timeout"
+        if isinstance(
+            exception,
+            (asyncio.TimeoutError, aiohttp.ServerTimeoutError, socket.timeout),
+        ):
+            return "read_timeout"
+        if isinstance(
+            exception,
+            (
+                requests.exceptions.RequestException,
+                aiohttp.ClientError,
+                Urllib3HTTPError,
+                OSError,
+            ),
+        ):
+            return "connect_error"
+        # other decoding errors of response body
+        if isinstance(exception, ValueError):
+            return "bad_response"
+        return "error"
+
+    def classify(
+        self,
+        status_code: int = None,
+        res_json: dict = None,
+        exception: Exception = None,
+    ) -> dict:
+        outcome = {
+            "category": "ok",
+            "status_code": status_code,
+            "code": None,
+            "res_json": res_json,
+            "message": "",
+        }
+        if exception is not None:
+            outcome["category"] = self.classify_exception(exception)
+            outcome["message"] = repr(exception)
+        elif status_code != 200:
+            outcome["category"] = "http_status"
+            outcome["message"] = f"HTTP {status_code}"
+        elif not isinstance(res_json, dict):
+            outcome["category"] = "bad_response"
+            outcome["message"] = "Invalid json"
+        else:
+            code = res_json.get("code", -1)
+            outcome["code"] = code
+            if code != 0:
+                outcome["category"] = "bili_code"
+                outcome["message"] = f"code={code}: {res_json.get('message', '')}"
+        return outcome
+
+    def decide(
+        self, outcome: dict, state: dict
+    ) -> Literal["done", "retry", "switch_proxy", "requeue", "give_up"]:
+        """Should be called once after each attempt, as it updates `state`."""
+        state["attempts"] += 1
+        state["same_proxy_attempts"] += 1
+        category = outcome["category"]
+        status_code = outcome["status_code"]
+        code = outcome["code"]
+
+        if category == "ok":
+            return "done"
+        if category == "bili_code" and code in self.GIVE_UP_CODES:
+            return "give_up"
+        if category == "error":
+            return "give_up"
+
+        if category in ["connect_timeout", "connect_error"]:
+            decision = "switch_proxy"
+        elif category == "http_status" and status_code in self.RATE_LIMIT_STATUS_CODES:
+            decision = "switch_proxy"
+        elif category == "bili_code" and code in self.SWITCH_PROXY_CODES:
+            decision = "switch_proxy"
+        elif state["same_proxy_attempts"] > self.same_proxy_retries:
+            decision = "switch_proxy"
+        elif category == "http_status" and status_code not in self.RETRY_STATUS_CODES:
+            decision = "switch_proxy"
+        else:
+            decision = "retry"
+
+        if (
+            state["attempts"] >= self.max_attempts
+            or self.get_remaining_seconds(state) <= 0
+        ):
+            return "requeue"
+        if decision == "switch_proxy":
+            state["same_proxy_attempts"] = 0
+        return decision
+
+    def get_backoff_seconds(self, state: dict) -> float:
+        """Full jitter: random in [0, min(max, base * 2^attempts)], within remaining budget."""
+        upper = min(self.backoff_max, self.backoff_base * 2 ** state["attempts"])
+        backoff = random.uniform(0, upper)
+        return max(min(backoff, self.get_remaining_seconds(state)), 0)
+
+    def get_failure_json(
+        self, outcome: dict, decision: str, state: dict, task_str: str = ""
+    ) -> dict:
+        """Json for a failed task, which keeps the last outcome and the decision."""
+        return {
+            "code": -1,
+            "message": (
+                f"[{decision}] after {state['attempts']} attempts: "
+                f"{outcome['category']} ({outcome['message']}): {task_str}"
+            ),
+            "retry_decision": decision,
+            "retry_category": outcome["category"],
+            "data": {"archives": [], "page": {"count": -1}},
+        }
@@ -1,54 +1,207 @@
+import concurrent.futures
+import io
 import psycopg2
 import psycopg2.extras
+import re
 import threading
+import time
+import zlib
 
 from datetime import datetime
-from pathlib import Path
-from pprint import pformat
 from tclogger import logger
-from typing import Union, Tuple, List
+from typing import Iterator, Union, Tuple, List
 
-from configs.envs import SQL_ENVS, LOG_ENVS
+from configs.envs import SQL_ENVS
+from networks.sql_queries import SQLQueriesMixin
 
 
-class SQLOperator:
-    def __init__(self):
+class SQLOperator(SQLQueriesMixin):
+    """Execute sql queries with a pool of `pool_size` connections.
+
+    Each connection is a writer lane with its own cursor and lock.
+    `exec_by_keys` partitions rows into lanes by crc32 of their primary keys,
+    so rows of the same key always go through the same lane, in key order,
+    and concurrent upserts from different lanes never lock the same rows.
+
+    `copy_upsert` bulk loads rows into a temp staging table with `COPY FROM STDIN`,
+    then merges them into target table with a single set-based upsert.
+
+    `exec_prepared` runs a query as a server-side prepared statement of each connection,
+    so Postgres parses and plans it once, instead of once per batch.
+
+    Upserts return `RETURNING (xmax = 0)` of written rows, which are counted by
+    `count_upsert_results` as inserted, updated or unchanged.
+    With `compare_columns`, conflicted rows are only updated when any of these columns
+    is changed, so unchanged rows are not rewritten into dead tuples.
+
+    Rows of the same key in one batch are merged by `partition_by_keys`.
+    When a batch fails by bad rows, it is bisected and retried in savepoints
+    (see `execute_values_isolated`), and only the bad rows are quarantined
+    into the dead-letter file, instead of losing the whole batch.
+
+    `iter_rows` and `iter_by_keyset` stream large results in constant memory,
+    instead of loading them all by `exec(..., is_fetchall=True)`.
+
+    When connection of a lane is lost, rows to write are appended to `spool`
+    (see `SQLSpool`), and the lane is reconnected at most once per `reconnect_interval`.
+    """
+
+    # errors caused by values of rows, which are worth bisecting the batch
+    ROW_ERRORS = (
+        psycopg2.DataError,
+        psycopg2.IntegrityError,
+        psycopg2.errors.CardinalityViolation,
+        ValueError,
+    )
+    CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+    # `%s` placeholders, with optional type cast, e.g. `%s::int8[]`
+    PREPARED_PARAM_PATTERN = re.compile(r"%s(::\w+(?:\[\])?)?")
+
+    def __init__(
+        self,
+        pool_size: int = 1,
+        is_connect: bool = True,
+        spool=None,
+        reconnect_interval: float = 5.0,
+    ):
         self.host = SQL_ENVS["host"]
         self.port = SQL_ENVS["port"]
         self.dbname = SQL_ENVS["dbname"]
         self.user = SQL_ENVS["user"]
         self.password = SQL_ENVS["password"]
-        self.log_file = Path(__file__).parents[1] / "logs" / LOG_ENVS["sql"]
-        self.lock = threading.Lock()
-        self.commit_batch_idx = 0
-        self.connect()
+        self.init_logs()
+        self.pool_size = max(pool_size, 1)
+        self.spool = spool
+        self.reconnect_interval = reconnect_interval
+        self.lanes = []
+        self.executor = None
+        if is_connect:
+            self.connect()
 
     def connect(self):
         logger.note(f"> Connecting to: {self.host}:{self.port} ...")
-        self.conn = psycopg2.connect(
+        self.lanes = []
+        for i in range(self.pool_size):
+            lane = {
+                "lock": threading.Lock(),
+                "commit_batch_idx": 0,
+                "is_broken": False,
+                "reconnect_time": 0.0,
+            }
+            self.connect_lane(lane)
+            self.lanes.append(lane)
+        # lane 0 is the default lane for queries without keys
+        self.lock = self.lanes[0]["lock"]
+        self.set_default_lane()
+        if self.pool_size > 1 and not self.executor:
+            self.executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.pool_size
+            )
+        logger.success(
+            f"+ Connected to [{self.dbname}] as ({self.user}): "
+            f"{self.pool_size} connections"
+        )
+
+    def create_connection(self):
+        return psycopg2.connect(
             host=self.host,
             port=self.port,
             dbname=self.dbname,
             user=self.user,
             password=self.password,
         )
-        self.cur = self.conn.cursor()
-        logger.success(f"+ Connected to [{self.dbname}] as ({self.user})")
 
-    def log_error(
-        self, query: str, values: Union[Tuple, List[Tuple]] = None, e: Exception = None
-    ):
-        error_info = {
-            "datetime": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "query": query,
-            "values": values,
-            "error": repr(e),
-        }
-        logger.err(f"× SQL Error:")
-        logger.warn(f"{error_info}")
-        error_str = pformat(error_info, sort_dicts=False)
-        with open(self.log_file, "a") as f:
-            f.write(f"{error_str}\n\n")
+    def connect_lane(self, lane: dict):
+        conn = self.create_connection()
+        lane.update(
+            {
+                "conn": conn,
+                "cur": conn.cursor(),
+                "staging_tables": set(),
+                "prepared_statements": set(),
+                "is_broken": False,
+            }
+        )
+
+    def set_default_lane(self):
+        self.conn = self.lanes[0]["conn"]
+        self.cur = self.lanes[0]["cur"]
+
+    def on_connection_error(self, lane: dict, e: Exception):
+        lane["is_broken"] = True
+        logger.warn(f"× SQL connection lost: {repr(e)[:200]}")
+
+    def ensure_lane(self, lane: dict) -> bool:
+        """Reconnect broken lane, at most once per `reconnect_interval`.
+        Should be called with lane lock held. Returns True if lane is usable."""
+        if not lane["is_broken"] and not lane["conn"].closed:
+            return True
+        if time.time() - lane["reconnect_time"] < self.reconnect_interval:
+            return False
+        lane["reconnect_time"] = time.time()
+        try:
+            lane["conn"].close()
+        except Exception:
+            pass
+        try:
+            self.connect_lane(lane)
+        except self.CONNECTION_ERRORS as e:
+            lane["is_broken"] = True
+            logger.warn(f"× SQL reconnect failed: {repr(e)[:200]}")
+            return False
+        if lane is self.lanes[0]:
+            self.set_default_lane()
+        logger.success(f"+ Reconnected to: {self.host}:{self.port}")
+        return True
+
+    def is_available(self) -> bool:
+        """Reconnect broken lanes, and check connection by lane 0."""
+        for lane in self.lanes:
+            with lane["lock"]:
+                if not self.ensure_lane(lane):
+                    return False
+        lane = self.lanes[0]
+        with lane["lock"]:
+            try:
+                lane["cur"].execute("SELECT 1;")
+                lane["conn"].commit()
+                return True
+            except self.CONNECTION_ERRORS as e:
+                self.on_connection_error(lane, e)
+                return False
+
+    def execute_values_isolated(
+        self,
+        cur,
+        query: str,
+        values_list: List[Tuple],
+        is_fetchall: bool = False,
+    ) -> list:
+        """`execute_values` in a savepoint. If it fails by bad rows,
+        roll back to savepoint, then bisect the batch and retry each half,
+        until bad rows are isolated and quarantined. Other errors are raised.
+
+        Savepoint keeps uncommitted rows of previous batches (`commit_batch_size`).
+        """
+        cur.execute("SAVEPOINT batch")
+        try:
+            # https://www.psycopg.org/docs/extras.html#psycopg2.extras.execute_values
+            res = psycopg2.extras.execute_values(
+                cur=cur, sql=query, argslist=values_list, fetch=is_fetchall
+            )
+            cur.execute("RELEASE SAVEPOINT batch")
+            return res or []
+        except self.ROW_ERRORS as e:
+            cur.execute("ROLLBACK TO SAVEPOINT batch")
+            cur.execute("RELEASE SAVEPOINT batch")
+            if len(values_list) <= 1:
+                self.quarantine_rows(query, values_list, e)
+                return []
+            mid = len(values_list) // 2
+            return self.execute_values_isolated(
+                cur, query, values_list[:mid], is_fetchall
+            ) + self.execute_values_isolated(cur, query, values_list[mid:], is_fetchall)
 
     def exec(
         self,
@@ -57,47 +210,518 @@ class SQLOperator:
         is_fetchall: bool = False,
         is_many: bool = False,
         commit_batch_size: int = 1,
+        lane_idx: int = 0,
     ):
-        with self.lock:
+        lane = self.lanes[lane_idx]
+        res = None
+        with lane["lock"]:
+            spool_kwargs = {
+                "query": query,
+                "values": values,
+                "is_fetchall": is_fetchall,
+                "is_many": True,
+            }
+            if not self.ensure_lane(lane):
+                if is_many and values:
+                    return self.spool_rows("exec", spool_kwargs, len(values))
+                return res
+            cur = lane["cur"]
             try:
                 if not is_many:
-                    self.cur.execute(query, values)
+                    cur.execute(query, values)
                     if is_fetchall:
                         try:
-                            res = self.cur.fetchall()
+                            res = cur.fetchall()
                         except Exception as e:
                             res = None
                             if "no results to fetch" not in str(e):
                                 logger.warn(e)
-                    else:
-                        res = None
                 else:
-                    # https://www.psycopg.org/docs/extras.html#psycopg2.extras.execute_values
-                    res = psycopg2.extras.execute_values(
-                        cur=self.cur, sql=query, argslist=values, fetch=is_fetchall
-                    )
-                    if is_fetchall:
-                        res = res
-                    else:
-                        res = None
+                    # fetched rows, or [] if not `is_fetchall`, so None means failed
+                    res = self.execute_values_isolated(cur, query, values, is_fetchall)
+            except self.CONNECTION_ERRORS as e:
+                self.on_connection_error(lane, e)
+                if is_many and values:
+                    return self.spool_rows("exec", spool_kwargs, len(values))
+                return res
             except Exception as e:
                 self.log_error(query, values, e)
 
             try:
                 if commit_batch_size <= 1:
-                    self.conn.commit()
+                    lane["conn"].commit()
                 else:
-                    self.commit_batch_idx += 1
-                    if self.commit_batch_idx % commit_batch_size == 0:
-                        self.conn.commit()
+                    lane["commit_batch_idx"] += 1
+                    if lane["commit_batch_idx"] % commit_batch_size == 0:
+                        lane["conn"].commit()
             except Exception as e:
                 self.log_error(query, values, e)
+                res = None
+
+        return res
+
+    def iter_batches(
+        self,
+        query: str,
+        values: Tuple = None,
+        itersize: int = 2000,
+        cursor_name: str = "stream_cursor",
+    ) -> Iterator[List[Tuple]]:
+        """Stream rows of query in batches of `itersize`, by a named server-side cursor.
+
+        Cursor runs on a dedicated read-only connection, so a long stream would not
+        hold lanes of writers. Connection is closed when generator is exhausted or closed.
+        """
+        conn = self.create_connection()
+        conn.set_session(readonly=True)
+        try:
+            with conn.cursor(name=cursor_name) as cur:
+                cur.itersize = itersize
+                cur.execute(query, values)
+                while True:
+                    rows = cur.fetchmany(itersize)
+                    if not rows:
+                        break
+                    yield rows
+        finally:
+            conn.rollback()
+            conn.close()
+
+    def iter_rows(
+        self,
+        query: str,
+        values: Tuple = None,
+        itersize: int = 2000,
+        cursor_name: str = "stream_cursor",
+    ) -> Iterator[Tuple]:
+        """Stream rows of query one by one, see `iter_batches`."""
+        for rows in self.iter_batches(query, values, itersize, cursor_name):
+            yield from rows
+
+    def iter_by_keyset(
+        self,
+        table_name: str,
+        columns: List[str],
+        key: str = "bvid",
+        where: str = None,
+        values: Tuple = (),
+        page_size: int = 10000,
+        start_key=None,
+    ) -> Iterator[Tuple]:
+        """Stream rows ordered by `key` with keyset pagination.
+
+        Each page is a short query `WHERE key > last_key ORDER BY key LIMIT page_size`,
+        which seeks by index of `key` and holds no long transaction,
+        and could be resumed from any `start_key`.
+
+        `key` should be unique and indexed. It is added as first column if not in `columns`.
+        `where` is extra condition with `%s` placeholders of `values`.
+
+        Pages are fetched on a dedicated read-only autocommit connection, like
+        `iter_batches`, so writer lanes are not held. Errors of fetching are raised,
+        instead of ending the stream early as if all rows were read.
+        """
+        if key not in columns:
+            columns = [key, *columns]
+        key_idx = columns.index(key)
+        last_key = start_key
+        conn = self.create_connection()
+        conn.set_session(readonly=True, autocommit=True)
+        try:
+            with conn.cursor() as cur:
+                while True:
+                    query = self.create_keyset_query(
+                        table_name,
+                        columns,
+                        key,
+                        where,
+                        is_after_key=last_key is not None,
+                    )
+                    params = tuple(values)
+                    if last_key is not None:
+                        params = (*params, last_key)
+                    cur.execute(query, (*params, page_size))
+                    rows = cur.fetchall()
+                    yield from rows
+                    if len(rows) < page_size:
+                        break
+                    last_key = rows[-1][key_idx]
+        finally:
+            conn.close()
+
+    def run_in_lanes(self, lane_func, lanes_values: dict) -> list:
+        """Call `lane_func(lane_idx, values_list)` of each lane, in parallel.
+        Returns results of lanes, in order of lane_idx."""
+        lane_idxs = sorted(lanes_values.keys())
+        if len(lane_idxs) <= 1 or not self.executor:
+            return [
+                lane_func(lane_idx, lanes_values[lane_idx]) for lane_idx in lane_idxs
+            ]
+        else:
+            futures = [
+                self.executor.submit(lane_func, lane_idx, lanes_values[lane_idx])
+                for lane_idx in lane_idxs
+            ]
+            return [future.result() for future in futures]
+
+    def exec_by_keys(self, query: str, values_list: List[Tuple], keys: list) -> dict:
+        """Execute many rows in lanes partitioned by keys, and lanes run in parallel.
 
+        Query should end with `RETURNING (xmax = 0)`, so written rows are counted.
+        Returns None if any lane failed.
+        """
+
+        def exec_lane(lane_idx: int, lane_values_list: List[Tuple]):
+            res = self.exec(
+                query,
+                lane_values_list,
+                is_fetchall=True,
+                is_many=True,
+                lane_idx=lane_idx,
+            )
+            return self.to_upsert_counts(res, len(lane_values_list))
+
+        return self.sum_upsert_counts(
+            self.run_in_lanes(exec_lane, self.partition_by_keys(values_list, keys))
+        )
+
+    def get_statement_name(self, query: str) -> str:
+        return f"stmt_{zlib.crc32(query.encode('utf-8')):08x}"
+
+    def to_prepared_queries(self, query: str, statement_name: str) -> tuple[str, str]:
+        """`%s` placeholders to `$n` in `PREPARE`, and keep casts in `EXECUTE`."""
+        casts = []
+
+        def to_positional(match: re.Match) -> str:
+            casts.append(match.group(1) or "")
+            return f"${len(casts)}{casts[-1]}"
+
+        prepare_query = self.PREPARED_PARAM_PATTERN.sub(to_positional, query)
+        prepare_query = f"PREPARE {statement_name} AS {prepare_query}"
+        params_str = ", ".join([f"%s{cast}" for cast in casts])
+        execute_query = f"EXECUTE {statement_name} ({params_str})"
+        return prepare_query, execute_query
+
+    def exec_prepared(
+        self,
+        query: str,
+        values: Tuple = None,
+        is_fetchall: bool = False,
+        lane_idx: int = 0,
+    ):
+        """Execute query as prepared statement, which is prepared once per lane.
+
+        Returns fetched rows if `is_fetchall` and query returns rows,
+        else number of affected rows. Returns `{"spooled": n}` if connection is lost.
+        """
+        lane = self.lanes[lane_idx]
+        statement_name = self.get_statement_name(query)
+        prepare_query, execute_query = self.to_prepared_queries(query, statement_name)
+        spool_kwargs = {"query": query, "values": values}
+        rows_count = len(values[0]) if values else 0
+        res = None
+        with lane["lock"]:
+            if not self.ensure_lane(lane):
+                return self.spool_rows("exec_prepared", spool_kwargs, rows_count)
+            cur = lane["cur"]
+            try:
+                if statement_name not in lane["prepared_statements"]:
+                    cur.execute(prepare_query)
+                    lane["prepared_statements"].add(statement_name)
+                cur.execute(execute_query, values)
+                if is_fetchall and cur.description:
+                    res = cur.fetchall()
+                else:
+                    res = cur.rowcount
+                lane["conn"].commit()
+            except self.CONNECTION_ERRORS as e:
+                self.on_connection_error(lane, e)
+                return self.spool_rows("exec_prepared", spool_kwargs, rows_count)
+            except Exception as e:
+                lane["conn"].rollback()
+                # statements might be lost with connection, so prepare again
+                lane["prepared_statements"].clear()
+                try:
+                    cur.execute("DEALLOCATE ALL")
+                    lane["conn"].commit()
+                except Exception:
+                    pass
+                self.log_error(query, values, e)
         return res
 
+    def exec_unnest_by_keys(
+        self,
+        query: str,
+        values_list: List[Tuple],
+        keys: list,
+    ):
+        """Execute unnest query (see `VideoInfoConverter.create_unnest_upsert_query`)
+        as prepared statement, with rows of each lane bound as column arrays.
+
+        Returns upsert counts of all lanes, see `count_upsert_results`.
+        """
+
+        def exec_lane(lane_idx: int, lane_values_list: List[Tuple]):
+            res = self.exec_prepared(
+                query,
+                self.to_column_arrays(lane_values_list),
+                is_fetchall=True,
+                lane_idx=lane_idx,
+            )
+            return self.to_upsert_counts(res, len(lane_values_list))
+
+        return self.sum_upsert_counts(
+            self.run_in_lanes(exec_lane, self.partition_by_keys(values_list, keys))
+        )
+
+    def to_copy_value(self, value) -> str:
+        """Format value in text format of COPY."""
+        if value is None:
+            return "\\N"
+        if isinstance(value, bool):
+            return "t" if value else "f"
+        if isinstance(value, datetime):
+            return value.isoformat()
+        value_str = str(value)
+        for old, new in [("\\", "\\\\"), ("\t", "\\t"), ("\n", "\\n"), ("\r", "\\r")]:
+            value_str = value_str.replace(old, new)
+        return value_str
+
+    def to_copy_buffer(self, values_list: List[Tuple]) -> io.StringIO:
+        buffer = io.StringIO()
+        for values in values_list:
+            line = "\t".join(self.to_copy_value(value) for value in values)
+            buffer.write(f"{line}\n")
+        buffer.seek(0)
+        return buffer
+
+    def get_table_key_columns(self, table_name: str) -> List[str]:
+        """Primary key columns of table in database, or None if not found."""
+        query = (
+            "SELECT a.attname FROM pg_index i "
+            "JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey) "
+            "WHERE i.indrelid = to_regclass(%s) AND i.indisprimary;"
+        )
+        rows = self.exec(query, (table_name,), is_fetchall=True)
+        if not rows:
+            return None
+        return [row[0] for row in rows]
+
+    def create_staging_table(self, lane: dict, table_name: str) -> str:
+        """Temp table is per connection, and emptied after each commit."""
+        staging_table = f"{table_name}_staging"
+        if staging_table not in lane["staging_tables"]:
+            lane["cur"].execute(
+                f"CREATE TEMP TABLE IF NOT EXISTS {staging_table} "
+                f"(LIKE {table_name} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS;"
+            )
+            lane["staging_tables"].add(staging_table)
+        return staging_table
+
+    def copy_upsert(
+        self,
+        table_name: str,
+        columns: List[str],
+        values_list: List[Tuple],
+        primary_key: str = "bvid",
+        lane_idx: int = 0,
+        compare_columns: List[str] = None,
+        fresh_column: str = None,
+    ) -> dict:
+        """COPY rows into staging table, then upsert into `table_name` in one statement.
+
+        Rows of the same primary key in one batch are merged (the last one wins),
+        as `ON CONFLICT DO UPDATE` could not affect one row twice.
+
+        If COPY or merge fails by bad rows, rows are upserted again by
+        `execute_values_isolated`, so that only bad rows are quarantined.
+
+        Returns upsert counts (see `count_upsert_results`), or None if failed.
+        """
+        if not values_list:
+            return self.count_upsert_results([], 0)
+        lane = self.lanes[lane_idx]
+        columns_str = ", ".join(columns)
+        spool_kwargs = {
+            "table_name": table_name,
+            "columns": columns,
+            "values_list": values_list,
+            "primary_key": primary_key,
+            "compare_columns": compare_columns,
+            "fresh_column": fresh_column,
+        }
+        with lane["lock"]:
+            if not self.ensure_lane(lane):
+                return self.spool_rows("copy_upsert", spool_kwargs, len(values_list))
+            cur = lane["cur"]
+            try:
+                staging_table = self.create_staging_table(lane, table_name)
+                buffer = self.to_copy_buffer(values_list)
+                cur.copy_expert(
+                    f"COPY {staging_table} ({columns_str}) FROM STDIN", buffer
+                )
+                route_query = self.create_route_query(
+                    table_name, staging_table, primary_key
+                )
+                if route_query:
+                    cur.execute(route_query)
+                cur.execute(
+                    self.create_merge_query(
+                        table_name,
+                        staging_table,
+                        columns,
+                        primary_key,
+                        compare_columns,
+                        fresh_column,
+                    )
+                )
+                counts = self.count_upsert_results(cur.fetchall(), len(values_list))
+                lane["conn"].commit()
+            except self.ROW_ERRORS as e:
+                lane["conn"].rollback()
+                lane["staging_tables"].clear()
+                logger.warn(f"× COPY INTO {table_name} failed, retry isolated: {e}")
+                counts = self.upsert_isolated(
+                    lane,
+                    table_name,
+                    columns,
+                    values_list,
+                    primary_key,
+                    compare_columns,
+                    fresh_column,
+                )
+            except self.CONNECTION_ERRORS as e:
+                self.on_connection_error(lane, e)
+                counts = None
+            except Exception as e:
+                lane["conn"].rollback()
+                lane["staging_tables"].clear()
+                self.log_error(f"COPY INTO {table_name}", values_list, e)
+                counts = None
+            if lane["is_broken"]:
+                counts = self.spool_rows("copy_upsert", spool_kwargs, len(values_list))
+        return counts
+
+    def copy_insert(
+        self,
+        table_name: str,
+        columns: List[str],
+        values_list: List[Tuple],
+        lane_idx: int = 0,
+    ) -> dict:
+        """Append rows by COPY directly into `table_name`, for append-only tables.
+        Returns `{"inserted": n}`, see `count_upsert_results`."""
+        if not values_list:
+            return {"inserted": 0}
+        lane = self.lanes[lane_idx]
+        columns_str = ", ".join(columns)
+        spool_kwargs = {
+            "table_name": table_name,
+            "columns": columns,
+            "values_list": values_list,
+        }
+        with lane["lock"]:
+            if not self.ensure_lane(lane):
+                return self.spool_rows("copy_insert", spool_kwargs, len(values_list))
+            cur = lane["cur"]
+            try:
+                buffer = self.to_copy_buffer(values_list)
+                cur.copy_expert(f"COPY {table_name} ({columns_str}) FROM STDIN", buffer)
+                lane["conn"].commit()
+                counts = {"inserted": len(values_list)}
+            except self.ROW_ERRORS as e:
+                lane["conn"].rollback()
+                logger.warn(f"× COPY INTO {table_name} failed, retry isolated: {e}")
+                query = (
+                    f"INSERT INTO {table_name} ({columns_str}) VALUES %s RETURNING 1"
+                )
+                res = self.execute_values_isolated(
+                    cur, query, values_list, is_fetchall=True
+                )
+                lane["conn"].commit()
+                counts = {"inserted": len(res)}
+            except self.CONNECTION_ERRORS as e:
+                self.on_connection_error(lane, e)
+                counts = self.spool_rows("copy_insert", spool_kwargs, len(values_list))
+            except Exception as e:
+                lane["conn"].rollback()
+                self.log_error(f"COPY INTO {table_name}", values_list, e)
+                counts = None
+        return counts
+
+    def upsert_isolated(
+        self,
+        lane: dict,
+        table_name: str,
+        columns: List[str],
+        values_list: List[Tuple],
+        primary_key: str = "bvid",
+        compare_columns: List[str] = None,
+        fresh_column: str = None,
+    ) -> dict:
+        """Fallback of `copy_upsert`. Should be called with lane lock held."""
+        query = self.create_values_upsert_query(
+            table_name, columns, primary_key, compare_columns, fresh_column
+        )
+        route_keys_query = self.create_route_keys_query(table_name, primary_key)
+        try:
+            if route_keys_query:
+                id_idx = columns.index(self.get_key_columns(primary_key)[0])
+                lane["cur"].execute(
+                    route_keys_query, ([values[id_idx] for values in values_list],)
+                )
+                values_list = self.route_values(
+                    values_list, columns, primary_key, lane["cur"].fetchall()
+                )
+            rows = self.dedup_by_primary_key(values_list, columns, primary_key)
+            res = self.execute_values_isolated(
+                lane["cur"], query, list(rows.values()), is_fetchall=True
+            )
+            lane["conn"].commit()
+            return self.count_upsert_results(res, len(values_list))
+        except self.CONNECTION_ERRORS as e:
+            self.on_connection_error(lane, e)
+            return None
+        except Exception as e:
+            lane["conn"].rollback()
+            self.log_error(query, values_list, e)
+            return None
+
+    def copy_upsert_by_keys(
+        self,
+        table_name: str,
+        columns: List[str],
+        values_list: List[Tuple],
+        keys: list,
+        primary_key: str = "bvid",
+        compare_columns: List[str] = None,
+        fresh_column: str = None,
+    ) -> dict:
+        """`copy_upsert` in lanes partitioned by keys, and lanes run in parallel.
+        Returns upsert counts of all lanes."""
+
+        def copy_lane(lane_idx: int, lane_values_list: List[Tuple]):
+            return self.copy_upsert(
+                table_name,
+                columns,
+                lane_values_list,
+                primary_key=primary_key,
+                lane_idx=lane_idx,
+                compare_columns=compare_columns,
+                fresh_column=fresh_column,
+            )
+
+        return self.sum_upsert_counts(
+            self.run_in_lanes(copy_lane, self.partition_by_keys(values_list, keys))
+        )
+
     def close(self):
-        self.cur.close()
-        self.conn.close()
+        for lane in self.lanes:
+            lane["cur"].close()
+            lane["conn"].close()
+        if self.executor:
+            self.executor.shutdown()
+            self.executor = None
         return True
 
     def test_connection(self):
@@ -120,4 +744,9 @@ if __name__ == "__main__":
     sql = SQLOperator()
     sql.test_connection()
 
+    bvids_count = 0
+    for row in sql.iter_by_keyset("videos", ["bvid"], key="bvid", page_size=5000):
+        bvids_count += 1
+    logger.success(f"+ Streamed bvids: {bvids_count}")
+
     # python -m networks.sql
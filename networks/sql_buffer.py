@@ -0,0 +1,304 @@
+import threading
+import time
+
+from collections import deque
+from tclogger import logger
+from typing import Callable, List, Literal, Tuple
+
+from networks.sql import SQLOperator
+
+
+class SQLWriteBuffer:
+    """Write-behind buffer of rows from all workers, flushed by a background thread.
+
+    Buffer is flushed when `max_rows` rows are buffered, or the oldest row has waited
+    for `max_delay_ms`, whichever comes first. So each flush is one grouped commit
+    (per lane of SQLOperator) for rows of many pages, instead of one commit per page.
+
+    Rows of the same key in buffer are merged (the last one wins).
+    `on_written` callbacks passed to `add_many` are called after their rows are written,
+    and `on_failed` callbacks are called instead if the write failed.
+    `add_many` blocks when `max_pending_rows` rows are waiting (backpressure).
+
+    `write_method`:
+    - "copy": `SQLOperator.copy_upsert_by_keys`
+    - "values": `INSERT ... VALUES %s` by `execute_values`
+    - "unnest": `unnest_query` as prepared statement, see `SQLOperator.exec_unnest_by_keys`
+    "values" and "unnest" are only for single-column key, as they do not route rows
+    of partitioned table, see `SQLOperator.create_route_query`.
+    - "append": `SQLOperator.copy_insert`, for append-only tables without upsert
+
+    With `compare_columns`, rows are only updated if any of these columns changed,
+    and flushed rows are counted as inserted, updated or unchanged.
+    """
+
+    def __init__(
+        self,
+        sql: SQLOperator,
+        table_name: str = "videos",
+        columns: List[str] = [],
+        primary_key: str = "bvid",
+        write_method: Literal["copy", "values", "unnest", "append"] = "copy",
+        unnest_query: str = None,
+        compare_columns: List[str] = None,
+        max_rows: int = 1000,
+        max_delay_ms: float = 1000,
+        max_pending_rows: int = 20000,
+        stats_window: int = 100,
+    ):
+        self.sql = sql
+        self.table_name = table_name
+        self.columns = columns
+        self.primary_key = primary_key
+        self.write_method = write_method
+        self.max_rows = max_rows
+        self.max_delay_ms = max_delay_ms
+        self.max_pending_rows = max(max_pending_rows, max_rows)
+        self.query = self.create_values_query()
+        self.unnest_query = unnest_query
+        self.compare_columns = compare_columns
+        if self.write_method == "unnest" and not self.unnest_query:
+            raise ValueError(f"× `unnest_query` is required by write_method=unnest")
+        # only copy routes rows to stored partitions, see `create_route_query`
+        is_composite_key = len(self.sql.get_key_columns(self.primary_key)) > 1
+        if self.write_method in ["values", "unnest"] and is_composite_key:
+            raise ValueError(
+                f"× write_method={self.write_method} could not route rows "
+                f"of composite key ({self.primary_key}), use copy instead"
+            )
+        self.condition = threading.Condition()
+        # serialize flushes, so rows of the same key are written in order
+        self.write_lock = threading.Lock()
+        self.thread = None
+        self.is_running = False
+        self.reset_buffer()
+        self.init_stats(stats_window)
+
+    def create_values_query(self) -> str:
+        columns_str = ", ".join(self.columns)
+        update_set_str = ", ".join(
+            [
+                f"{k} = EXCLUDED.{k}"
+                for k in self.columns
+                if k not in self.sql.get_key_columns(self.primary_key)
+            ]
+        )
+        return (
+            f"INSERT INTO {self.table_name} ({columns_str}) VALUES %s "
+            f"ON CONFLICT ({self.primary_key}) DO UPDATE SET {update_set_str} "
+            f"RETURNING (xmax = 0)"
+        )
+
+    def reset_buffer(self):
+        """Should be called with condition held."""
+        self.rows = {}
+        self.callbacks = []
+        self.first_row_time = None
+
+    def init_stats(self, stats_window: int = 100):
+        self.flushes_count = 0
+        self.flushed_rows_count = 0
+        self.failed_rows_count = 0
+        self.merged_duplicates_count = 0
+        self.upsert_counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+        self.flush_reasons = {"size": 0, "time": 0, "manual": 0}
+        self.flush_sizes = deque(maxlen=stats_window)
+        self.flush_latencies = deque(maxlen=stats_window)
+        self.max_flush_latency = 0.0
+
+    def start(self):
+        if self.is_running:
+            return
+        self.is_running = True
+        self.thread = threading.Thread(target=self.flush_loop, daemon=True)
+        self.thread.start()
+        logger.note(
+            f"> Write buffer started: "
+            f"max_rows={self.max_rows}, max_delay_ms={self.max_delay_ms}, "
+            f"method={self.write_method}"
+        )
+
+    def add_many(
+        self,
+        rows: List[Tuple[str, Tuple]],
+        on_written: Callable[[], None] = None,
+        on_failed: Callable[[], None] = None,
+    ):
+        """`rows` are list of (key, values). Rows of one call are flushed together."""
+        if not rows and not (on_written or on_failed):
+            # nothing to flush, and `first_row_time` of empty buffer spins flush loop
+            return
+        with self.condition:
+            while self.is_running and len(self.rows) >= self.max_pending_rows:
+                self.condition.wait()
+            for key, values in rows:
+                if key in self.rows:
+                    self.merged_duplicates_count += 1
+                self.rows[key] = values
+            if on_written or on_failed:
+                self.callbacks.append((on_written, on_failed))
+            if self.first_row_time is None:
+                # wake up flush loop to wait for `max_delay_ms` of the first row
+                self.first_row_time = time.perf_counter()
+                self.condition.notify_all()
+            elif len(self.rows) >= self.max_rows:
+                self.condition.notify_all()
+
+    def add(
+        self,
+        key: str,
+        values: Tuple,
+        on_written: Callable[[], None] = None,
+        on_failed: Callable[[], None] = None,
+    ):
+        self.add_many([(key, values)], on_written=on_written, on_failed=on_failed)
+
+    def get_flush_reason(self) -> str:
+        """Should be called with condition held. Returns None if not time to flush."""
+        if not self.rows and not self.callbacks:
+            return None
+        if len(self.rows) >= self.max_rows:
+            return "size"
+        waited_ms = (time.perf_counter() - self.first_row_time) * 1000
+        if waited_ms >= self.max_delay_ms:
+            return "time"
+        return None
+
+    def take_buffer(self) -> tuple[dict, list]:
+        """Should be called with condition held."""
+        rows, callbacks = self.rows, self.callbacks
+        self.reset_buffer()
+        self.condition.notify_all()
+        return rows, callbacks
+
+    def flush_loop(self):
+        while True:
+            with self.condition:
+                reason = self.get_flush_reason()
+                while self.is_running and not reason:
+                    if self.first_row_time is None:
+                        timeout = None
+                    else:
+                        waited_ms = (time.perf_counter() - self.first_row_time) * 1000
+                        timeout = max(self.max_delay_ms - waited_ms, 0) / 1000
+                    self.condition.wait(timeout=timeout)
+                    reason = self.get_flush_reason()
+                if not self.is_running:
+                    break
+                rows, callbacks = self.take_buffer()
+            try:
+                self.write(rows, callbacks, reason=reason)
+            except Exception as e:
+                # keep the thread alive, otherwise `add_many` would block forever
+                logger.warn(f"× Write buffer flush error: {e}")
+
+    def write_rows(self, rows: dict) -> dict:
+        """Returns upsert counts of rows, or None if write failed."""
+        keys = list(rows.keys())
+        values_list = list(rows.values())
+        if self.write_method == "copy":
+            return self.sql.copy_upsert_by_keys(
+                self.table_name,
+                self.columns,
+                values_list,
+                keys=keys,
+                primary_key=self.primary_key,
+                compare_columns=self.compare_columns,
+            )
+        elif self.write_method == "append":
+            return self.sql.copy_insert(self.table_name, self.columns, values_list)
+        elif self.write_method == "unnest":
+            return self.sql.exec_unnest_by_keys(
+                self.unnest_query, values_list, keys=keys
+            )
+        else:
+            return self.sql.exec_by_keys(self.query, values_list, keys=keys)
+
+    def write(self, rows: dict, callbacks: list, reason: str = "manual"):
+        if not rows and not callbacks:
+            return
+        with self.write_lock:
+            t1 = time.perf_counter()
+            counts = None
+            if rows:
+                try:
+                    counts = self.write_rows(rows)
+                except Exception as e:
+                    logger.warn(f"× Write buffer error: {e}")
+            is_written = not rows or counts is not None
+            dt = time.perf_counter() - t1
+            with self.condition:
+                for k, v in (counts or {}).items():
+                    self.upsert_counts[k] = self.upsert_counts.get(k, 0) + v
+                self.flushes_count += 1
+                if is_written:
+                    self.flushed_rows_count += len(rows)
+                else:
+                    self.failed_rows_count += len(rows)
+                self.flush_reasons[reason] += 1
+                self.flush_sizes.append(len(rows))
+                self.flush_latencies.append(dt)
+                self.max_flush_latency = max(self.max_flush_latency, dt)
+        if rows and is_written:
+            logger.success(f"  + Inserted: {len(rows)} rows", end=" ")
+            counts_str = f", {self.sql.get_upsert_counts_str(counts)}" if counts else ""
+            logger.file(f"({dt:.3f} s) [{reason}{counts_str}]")
+        elif rows:
+            logger.warn(f"  × Write failed: {len(rows)} rows ({dt:.3f} s) [{reason}]")
+        self.run_callbacks(callbacks, is_written=is_written)
+
+    def run_callbacks(self, callbacks: list, is_written: bool = True):
+        """Call `on_written` of callbacks if rows are written, otherwise `on_failed`."""
+        for on_written, on_failed in callbacks:
+            callback = on_written if is_written else on_failed
+            if not callback:
+                continue
+            try:
+                callback()
+            except Exception as e:
+                logger.warn(f"× Write buffer callback error: {e}")
+
+    def flush(self):
+        """Flush buffered rows now, in caller thread. Called on `/stop` and shutdown."""
+        with self.condition:
+            rows, callbacks = self.take_buffer()
+        self.write(rows, callbacks, reason="manual")
+
+    def stop(self):
+        if not self.is_running:
+            self.flush()
+            return
+        with self.condition:
+            self.is_running = False
+            self.condition.notify_all()
+        self.thread.join()
+        self.thread = None
+        self.flush()
+        logger.success(
+            f"+ Write buffer stopped: {self.flushed_rows_count} rows flushed"
+        )
+
+    def get_stats(self) -> dict:
+        with self.condition:
+            flush_sizes = list(self.flush_sizes)
+            flush_latencies = list(self.flush_latencies)
+            stats = {
+                "is_running": self.is_running,
+                "pending_rows": len(self.rows),
+                "flushes": self.flushes_count,
+                "flushed_rows": self.flushed_rows_count,
+                "failed_rows": self.failed_rows_count,
+                "merged_duplicates": self.merged_duplicates_count,
+                "upserts": dict(self.upsert_counts),
+                "flush_reasons": dict(self.flush_reasons),
+                "max_flush_latency": round(self.max_flush_latency, 4),
+            }
+        if flush_sizes:
+            stats["recent_flush_size_avg"] = round(
+                sum(flush_sizes) / len(flush_sizes), 1
+            )
+            stats["recent_flush_latency_avg"] = round(
+                sum(flush_latencies) / len(flush_latencies), 4
+            )
+            stats["recent_flush_sizes"] = flush_sizes[-10:]
+        return stats
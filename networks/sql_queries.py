@@ -0,0 +1,300 @@
+import json
+import threading
+import zlib
+
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+from pprint import pformat
+from tclogger import logger
+from typing import Union, Tuple, List
+
+from configs.envs import LOG_ENVS
+
+
+class SQLQueriesMixin:
+    """Query builders, lane partitioning, upsert counting and error logging,
+    shared by SQLOperator (psycopg2) and AsyncSQLOperator (psycopg3).
+
+    Nothing here talks to the database, so both operators reuse them as is,
+    and keep their own connections, lanes and reconnects.
+    Subclasses should call `init_logs` and set `pool_size` and `spool`.
+    """
+
+    def init_logs(self):
+        self.log_file = Path(__file__).parents[1] / "logs" / LOG_ENVS["sql"]
+        self.dead_letters_file = (
+            Path(__file__).parents[1] / "logs" / LOG_ENVS["sql_dead_letters"]
+        )
+        self.dead_letters_lock = threading.Lock()
+
+    def spool_rows(self, method: str, kwargs: dict, rows_count: int) -> dict:
+        """Append rows which could not be written to spool, to be replayed later."""
+        if not self.spool:
+            logger.warn(f"× Lost {rows_count} rows: no spool")
+            return None
+        self.spool.append(method, kwargs)
+        return {"spooled": rows_count}
+
+    def get_values_digest(self, values: Union[Tuple, List[Tuple]] = None) -> dict:
+        """Compact summary of values, instead of the whole payload."""
+        if values is None:
+            return None
+        values_str = repr(values)
+        digest = {
+            "crc32": f"{zlib.crc32(values_str.encode('utf-8')):08x}",
+            "bytes": len(values_str),
+        }
+        if isinstance(values, list):
+            digest["rows"] = len(values)
+            values_str = repr(values[0]) if values else ""
+        digest["head"] = values_str[:200]
+        return digest
+
+    def log_error(
+        self, query: str, values: Union[Tuple, List[Tuple]] = None, e: Exception = None
+    ):
+        error_info = {
+            "datetime": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "query": query,
+            "values": self.get_values_digest(values),
+            "error": repr(e),
+        }
+        logger.err(f"× SQL Error:")
+        logger.warn(f"{error_info}")
+        error_str = pformat(error_info, sort_dicts=False)
+        with open(self.log_file, "a") as f:
+            f.write(f"{error_str}\n\n")
+
+    def quarantine_rows(self, query: str, values_list: List[Tuple], e: Exception):
+        """Append bad rows to dead-letter file, one json line per row."""
+        query_digest = f"{zlib.crc32(query.encode('utf-8')):08x}"
+        now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        lines = []
+        for values in values_list:
+            letter = {
+                "datetime": now_str,
+                "query": query_digest,
+                "query_head": query[:80],
+                "error": repr(e),
+                "values": values,
+            }
+            lines.append(json.dumps(letter, ensure_ascii=False, default=str))
+        with self.dead_letters_lock:
+            with open(self.dead_letters_file, "a") as f:
+                f.write("\n".join(lines) + "\n")
+        logger.warn(
+            f"× Quarantined {len(values_list)} rows: {repr(e)[:200]} "
+            f"[query={query_digest}]"
+        )
+
+    def create_keyset_query(
+        self,
+        table_name: str,
+        columns: List[str],
+        key: str = "bvid",
+        where: str = None,
+        is_after_key: bool = False,
+    ) -> str:
+        conditions = [f"({where})"] if where else []
+        if is_after_key:
+            conditions.append(f"{key} > %s")
+        where_str = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+        return (
+            f"SELECT {', '.join(columns)} FROM {table_name} {where_str}"
+            f"ORDER BY {key} LIMIT %s"
+        )
+
+    def get_lane_idx(self, key) -> int:
+        return zlib.crc32(str(key).encode("utf-8")) % self.pool_size
+
+    def partition_by_keys(self, values_list: List[Tuple], keys: list) -> dict:
+        """lane_idx -> values_list, rows in each lane are sorted by key,
+        which makes lock order of rows deterministic.
+
+        Rows of the same key are merged (the last one wins),
+        as `ON CONFLICT DO UPDATE` could not affect one row twice in one statement."""
+        lanes_rows = defaultdict(dict)
+        for key, values in zip(keys, values_list):
+            lanes_rows[self.get_lane_idx(key)][str(key)] = values
+        return {
+            lane_idx: [values for key, values in sorted(rows.items())]
+            for lane_idx, rows in lanes_rows.items()
+        }
+
+    def count_upsert_results(self, returned_rows: list, rows_count: int) -> dict:
+        """`returned_rows` are `RETURNING (xmax = 0)`: True if inserted, False if updated.
+        Rows not returned are unchanged (skipped by `compare_columns`, or merged)."""
+        inserted = sum(1 for row in returned_rows if row[0])
+        updated = len(returned_rows) - inserted
+        unchanged = max(rows_count - inserted - updated, 0)
+        return {"inserted": inserted, "updated": updated, "unchanged": unchanged}
+
+    def sum_upsert_counts(self, counts_list: List[dict]) -> dict:
+        """Returns None if any lane failed (counts is None),
+        so callers would not treat rows of failed lanes as written."""
+        if any(counts is None for counts in counts_list):
+            return None
+        total_counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+        for counts in counts_list:
+            for k, v in counts.items():
+                total_counts[k] = total_counts.get(k, 0) + v
+        return total_counts
+
+    def get_upsert_counts_str(self, counts: dict) -> str:
+        if not counts:
+            return "failed"
+        return ", ".join([f"{k}={v}" for k, v in counts.items()])
+
+    def to_column_arrays(self, values_list: List[Tuple]) -> Tuple[list]:
+        """Rows to one list per column, as parameters of `unnest`."""
+        return tuple(list(column) for column in zip(*values_list))
+
+    def to_upsert_counts(self, res: Union[list, int], rows_count: int) -> dict:
+        """Upsert with `RETURNING` returns rows, and plain update returns rowcount."""
+        if res is None or isinstance(res, dict):
+            return res
+        if isinstance(res, list):
+            return self.count_upsert_results(res, rows_count)
+        updated = max(res, 0)
+        return {"inserted": 0, "updated": updated, "unchanged": rows_count - updated}
+
+    def get_key_columns(self, primary_key: str = "bvid") -> List[str]:
+        """Composite primary key is comma-separated, e.g. "bvid, pubdate"
+        of partitioned table, which is used as is in `ON CONFLICT (...)`."""
+        return [k.strip() for k in primary_key.split(",")]
+
+    def create_conflict_update_str(
+        self,
+        table_name: str,
+        columns: List[str],
+        primary_key: str = "bvid",
+        compare_columns: List[str] = None,
+        fresh_column: str = None,
+    ) -> str:
+        """With `fresh_column` (e.g. "insert_at"), stored rows are never overwritten
+        by older rows, e.g. rows replayed from spool after newer rows are written."""
+        key_columns = self.get_key_columns(primary_key)
+        update_set_str = ", ".join(
+            [f"{k} = EXCLUDED.{k}" for k in columns if k not in key_columns]
+        )
+        conflict_str = f"ON CONFLICT ({primary_key}) DO UPDATE SET {update_set_str}"
+        conditions = []
+        if fresh_column:
+            stored_column = f"{table_name}.{fresh_column}"
+            conditions.append(
+                f"({stored_column} IS NULL "
+                f"OR {stored_column} <= EXCLUDED.{fresh_column})"
+            )
+        if compare_columns:
+            stored_str = ", ".join([f"{table_name}.{k}" for k in compare_columns])
+            excluded_str = ", ".join([f"EXCLUDED.{k}" for k in compare_columns])
+            conditions.append(f"({stored_str}) IS DISTINCT FROM ({excluded_str})")
+        if conditions:
+            conflict_str = f"{conflict_str} WHERE {' AND '.join(conditions)}"
+        return conflict_str
+
+    def create_values_upsert_query(
+        self,
+        table_name: str,
+        columns: List[str],
+        primary_key: str = "bvid",
+        compare_columns: List[str] = None,
+        fresh_column: str = None,
+    ) -> str:
+        columns_str = ", ".join(columns)
+        conflict_str = self.create_conflict_update_str(
+            table_name, columns, primary_key, compare_columns, fresh_column
+        )
+        return (
+            f"INSERT INTO {table_name} ({columns_str}) VALUES %s "
+            f"{conflict_str} RETURNING (xmax = 0)"
+        )
+
+    def dedup_by_primary_key(
+        self, values_list: List[Tuple], columns: List[str], primary_key: str = "bvid"
+    ) -> dict:
+        """primary key -> values, the last one wins."""
+        key_idxs = [columns.index(k) for k in self.get_key_columns(primary_key)]
+        return {
+            tuple(values[idx] for idx in key_idxs): values for values in values_list
+        }
+
+    def create_route_query(
+        self, table_name: str, staging_table: str, primary_key: str = "bvid"
+    ) -> str:
+        """For composite key, e.g. "bvid, pubdate" of partitioned table, first column
+        is the identity of row, and the others route it to a partition.
+        Routing columns of rows already stored are kept in `{table_name}_keys`
+        (see `setups/create_videos_table.py`), so staged rows are routed to them,
+        and conflict with the stored row, instead of inserting a second row.
+
+        Returns None for single-column key."""
+        key_columns = self.get_key_columns(primary_key)
+        if len(key_columns) <= 1:
+            return None
+        id_column, route_columns = key_columns[0], key_columns[1:]
+        set_str = ", ".join([f"{k} = k.{k}" for k in route_columns])
+        staged_str = ", ".join([f"s.{k}" for k in route_columns])
+        stored_str = ", ".join([f"k.{k}" for k in route_columns])
+        return (
+            f"UPDATE {staging_table} s SET {set_str} FROM {table_name}_keys k "
+            f"WHERE s.{id_column} = k.{id_column} "
+            f"AND ({staged_str}) IS DISTINCT FROM ({stored_str});"
+        )
+
+    def create_route_keys_query(self, table_name: str, primary_key: str = "bvid"):
+        """Stored routing columns of identities, see `create_route_query`.
+        Returns None for single-column key."""
+        key_columns = self.get_key_columns(primary_key)
+        if len(key_columns) <= 1:
+            return None
+        return (
+            f"SELECT {', '.join(key_columns)} FROM {table_name}_keys "
+            f"WHERE {key_columns[0]} = ANY(%s);"
+        )
+
+    def route_values(
+        self,
+        values_list: List[Tuple],
+        columns: List[str],
+        primary_key: str,
+        stored_rows: List[Tuple],
+    ) -> List[Tuple]:
+        """Replace routing columns of values with `stored_rows` of `create_route_keys_query`,
+        same as `create_route_query` does in staging table."""
+        key_columns = self.get_key_columns(primary_key)
+        key_idxs = [columns.index(k) for k in key_columns]
+        stored_routes = {row[0]: row[1:] for row in stored_rows}
+        routed_values_list = []
+        for values in values_list:
+            stored_route = stored_routes.get(values[key_idxs[0]])
+            if stored_route is not None:
+                values = list(values)
+                for idx, value in zip(key_idxs[1:], stored_route):
+                    values[idx] = value
+                values = tuple(values)
+            routed_values_list.append(values)
+        return routed_values_list
+
+    def create_merge_query(
+        self,
+        table_name: str,
+        staging_table: str,
+        columns: List[str],
+        primary_key: str = "bvid",
+        compare_columns: List[str] = None,
+        fresh_column: str = None,
+    ) -> str:
+        columns_str = ", ".join(columns)
+        conflict_str = self.create_conflict_update_str(
+            table_name, columns, primary_key, compare_columns, fresh_column
+        )
+        # one row per identity, even if routing columns differ in batch
+        id_column = self.get_key_columns(primary_key)[0]
+        return (
+            f"INSERT INTO {table_name} ({columns_str}) "
+            f"SELECT DISTINCT ON ({id_column}) {columns_str} "
+            f"FROM {staging_table} ORDER BY {id_column}, ctid DESC "
+            f"{conflict_str} RETURNING (xmax = 0);"
+        )
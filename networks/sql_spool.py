@@ -0,0 +1,260 @@
+import os
+import pickle
+import struct
+import threading
+import time
+import zlib
+
+from pathlib import Path
+from tclogger import logger
+
+from networks.sql import SQLOperator
+
+
+class SQLSpool:
+    """Durable local spool of rows which could not be written while Postgres is down.
+
+    Spool is a directory of append-only segment files. Each record is:
+
+        [4 bytes: big-endian length] [zlib compressed pickle of (method, kwargs)]
+
+    where `method` and `kwargs` are the `SQLOperator` write call to replay,
+    e.g. `("copy_upsert", {"table_name": ..., "values_list": [...]})`.
+
+    Records are appended and fsynced by `SQLOperator.spool_rows`.
+    A background replayer waits until connection is back, then drains closed segments
+    in spooled order: rows of adjacent `copy_upsert` records of the same table are
+    merged and upserted in bulk, and rows older than stored ones (by `fresh_column`)
+    are skipped. A segment is deleted only after all its records are replayed,
+    or failed records are quarantined.
+    """
+
+    HEADER = struct.Struct(">I")
+    SUFFIX = ".seg"
+
+    def __init__(
+        self,
+        sql: SQLOperator,
+        spool_dir: Path = None,
+        segment_max_mb: float = 64,
+        replay_interval: float = 5.0,
+        replay_batch_rows: int = 5000,
+        fresh_column: str = "insert_at",
+    ):
+        self.sql = sql
+        self.spool_dir = spool_dir or Path(__file__).parents[1] / "data" / "spool"
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        self.segment_max_bytes = int(segment_max_mb * 1024 * 1024)
+        self.replay_interval = replay_interval
+        self.replay_batch_rows = replay_batch_rows
+        self.fresh_column = fresh_column
+        self.lock = threading.Lock()
+        self.segment_file = None
+        self.segment_path = None
+        self.segment_bytes = 0
+        self.segment_idx = 0
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.init_stats()
+
+    def init_stats(self):
+        self.spooled_records_count = 0
+        self.replayed_records_count = 0
+        self.replayed_segments_count = 0
+        self.corrupted_records_count = 0
+        self.quarantined_records_count = 0
+
+    def new_segment_path(self) -> Path:
+        self.segment_idx += 1
+        name = f"{time.time_ns()}_{self.segment_idx:06d}{self.SUFFIX}"
+        return self.spool_dir / name
+
+    def close_segment(self):
+        """Should be called with lock held."""
+        if self.segment_file:
+            self.segment_file.close()
+        self.segment_file = None
+        self.segment_path = None
+        self.segment_bytes = 0
+
+    def append(self, method: str, kwargs: dict):
+        payload = zlib.compress(pickle.dumps((method, kwargs)))
+        record = self.HEADER.pack(len(payload)) + payload
+        with self.lock:
+            if not self.segment_file:
+                self.segment_path = self.new_segment_path()
+                self.segment_file = open(self.segment_path, "ab")
+            self.segment_file.write(record)
+            self.segment_file.flush()
+            os.fsync(self.segment_file.fileno())
+            self.segment_bytes += len(record)
+            self.spooled_records_count += 1
+            if self.segment_bytes >= self.segment_max_bytes:
+                self.close_segment()
+
+    def get_segment_paths(self) -> list[Path]:
+        return sorted(self.spool_dir.glob(f"*{self.SUFFIX}"))
+
+    def read_segment(self, segment_path: Path) -> list[tuple[str, dict]]:
+        """Truncated tail record (e.g. crashed while appending) is ignored."""
+        records = []
+        with open(segment_path, "rb") as rf:
+            while True:
+                header = rf.read(self.HEADER.size)
+                if len(header) < self.HEADER.size:
+                    break
+                (length,) = self.HEADER.unpack(header)
+                payload = rf.read(length)
+                if len(payload) < length:
+                    logger.warn(f"× Truncated spool record: {segment_path.name}")
+                    break
+                try:
+                    records.append(pickle.loads(zlib.decompress(payload)))
+                except Exception as e:
+                    self.corrupted_records_count += 1
+                    logger.warn(f"× Corrupted spool record: {segment_path.name}: {e}")
+        return records
+
+    def get_copy_group_key(self, kwargs: dict) -> tuple:
+        return (
+            kwargs["table_name"],
+            tuple(kwargs["columns"]),
+            kwargs["primary_key"],
+            tuple(kwargs["compare_columns"] or []),
+        )
+
+    def group_records(self, records: list[tuple[str, dict]]) -> list[tuple[str, dict]]:
+        """Merge adjacent `copy_upsert` records with same target, in spooled order.
+        Records of other methods, or other targets, are kept as barriers between groups,
+        so rows of the same key are never written out of order."""
+        groups = []
+        group_key = None
+        for method, kwargs in records:
+            if method == "copy_upsert":
+                key = self.get_copy_group_key(kwargs)
+                if groups and group_key == key:
+                    groups[-1][1]["values_list"].extend(kwargs["values_list"])
+                    continue
+                group_key = key
+                kwargs = {**kwargs, "values_list": list(kwargs["values_list"])}
+            else:
+                group_key = None
+            groups.append((method, kwargs))
+        return groups
+
+    def replay_copy_upsert(self, kwargs: dict) -> list[tuple[str, dict]]:
+        """Upsert rows in batches. Returns records of failed batches."""
+        columns = kwargs["columns"]
+        values_list = kwargs["values_list"]
+        fresh_column = self.fresh_column if self.fresh_column in columns else None
+        # lanes are partitioned by first column of primary key
+        key_idx = columns.index(self.sql.get_key_columns(kwargs["primary_key"])[0])
+        failed_records = []
+        for i in range(0, len(values_list), self.replay_batch_rows):
+            batch = values_list[i : i + self.replay_batch_rows]
+            counts = self.sql.copy_upsert_by_keys(
+                kwargs["table_name"],
+                list(columns),
+                batch,
+                keys=[values[key_idx] for values in batch],
+                primary_key=kwargs["primary_key"],
+                compare_columns=kwargs["compare_columns"] or None,
+                fresh_column=fresh_column,
+            )
+            if counts is None:
+                failed_records.append(("copy_upsert", {**kwargs, "values_list": batch}))
+        return failed_records
+
+    def replay_records(self, records: list[tuple[str, dict]]) -> list[tuple[str, dict]]:
+        """Replay records in spooled order. Returns records which failed.
+
+        Rows of `copy_upsert` are never older than rows stored by `fresh_column`,
+        so replaying after live writes are back would not overwrite newer rows.
+        If connection is lost again, rows are spooled again, which are not failed.
+        """
+        failed_records = []
+        for method, kwargs in self.group_records(records):
+            if method == "copy_upsert":
+                failed_records.extend(self.replay_copy_upsert(kwargs))
+            elif getattr(self.sql, method)(**kwargs) is None:
+                failed_records.append((method, kwargs))
+        return failed_records
+
+    def quarantine_records(self, segment_path: Path, records: list[tuple[str, dict]]):
+        """Failed records are moved to `quarantine/`, and never replayed again."""
+        quarantine_dir = self.spool_dir / "quarantine"
+        quarantine_dir.mkdir(parents=True, exist_ok=True)
+        quarantine_path = quarantine_dir / segment_path.name
+        with open(quarantine_path, "ab") as wf:
+            for method, kwargs in records:
+                payload = zlib.compress(pickle.dumps((method, kwargs)))
+                wf.write(self.HEADER.pack(len(payload)) + payload)
+            wf.flush()
+            os.fsync(wf.fileno())
+        logger.warn(f"× Quarantined {len(records)} spool records: {quarantine_path}")
+
+    def replay(self) -> int:
+        """Replay closed segments in order. Returns number of replayed records.
+
+        If connection is lost again while replaying, failed rows are spooled again
+        into a new segment, so deleting replayed segment never loses rows.
+        Records failed by other errors are quarantined before segment is deleted.
+        """
+        if not self.get_segment_paths() or not self.sql.is_available():
+            return 0
+        with self.lock:
+            # new rows go to a new segment, so all existing segments are closed
+            self.close_segment()
+            segment_paths = self.get_segment_paths()
+        replayed_count = 0
+        for segment_path in segment_paths:
+            records = self.read_segment(segment_path)
+            logger.note(f"> Replaying spool: {segment_path.name} ({len(records)})")
+            failed_records = self.replay_records(records)
+            if failed_records:
+                self.quarantine_records(segment_path, failed_records)
+            segment_path.unlink()
+            replayed_count += len(records)
+            with self.lock:
+                self.replayed_records_count += len(records)
+                self.replayed_segments_count += 1
+                self.quarantined_records_count += len(failed_records)
+        if replayed_count:
+            logger.success(f"+ Replayed spool: {replayed_count} records")
+        return replayed_count
+
+    def replay_loop(self):
+        while not self.stop_event.wait(self.replay_interval):
+            try:
+                self.replay()
+            except Exception as e:
+                logger.warn(f"× Spool replay error: {e}")
+
+    def start(self):
+        if self.thread:
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.replay_loop, daemon=True)
+        self.thread.start()
+        logger.note(f"> Spool replayer started: {self.spool_dir}")
+
+    def stop(self):
+        if self.thread:
+            self.stop_event.set()
+            self.thread.join()
+            self.thread = None
+        with self.lock:
+            self.close_segment()
+
+    def get_stats(self) -> dict:
+        segment_paths = self.get_segment_paths()
+        with self.lock:
+            return {
+                "pending_segments": len(segment_paths),
+                "pending_bytes": sum(path.stat().st_size for path in segment_paths),
+                "spooled_records": self.spooled_records_count,
+                "replayed_records": self.replayed_records_count,
+                "replayed_segments": self.replayed_segments_count,
+                "corrupted_records": self.corrupted_records_count,
+                "quarantined_records": self.quarantined_records_count,
+            }
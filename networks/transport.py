@@ -0,0 +1,322 @@
+"""Shared HTTP transport for all fetchers.
+
+- Advanced Usage - Requests documentation
+  - https://requests.readthedocs.io/en/latest/user/advanced/#session-objects
+  - https://requests.readthedocs.io/en/latest/user/advanced/#transport-adapters
+- Client Reference - aiohttp documentation
+  - https://docs.aiohttp.org/en/stable/client_reference.html
+"""
+
+import aiohttp
+import requests
+import threading
+import time
+
+from collections import OrderedDict
+from requests.adapters import HTTPAdapter
+from tclogger import logger
+from urllib3.exceptions import ReadTimeoutError
+from urllib3.util import Timeout
+
+from networks.constants import REQUESTS_HEADERS
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """Raised when the whole request (connect + headers + body) runs out of time."""
+
+
+class TransportStats:
+    """Count requests, bytes and latency per proxy."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def default_stat(self):
+        return {
+            "requests": 0,
+            "failures": 0,
+            "wire_bytes": 0,
+            "body_bytes": 0,
+            "latency_sum": 0.0,
+            "latency_max": 0.0,
+        }
+
+    def record(
+        self,
+        proxy: str = None,
+        latency: float = 0.0,
+        wire_bytes: int = 0,
+        body_bytes: int = 0,
+        is_success: bool = True,
+    ):
+        key = proxy or "direct"
+        with self.lock:
+            stat = self.stats.setdefault(key, self.default_stat())
+            stat["requests"] += 1
+            if not is_success:
+                stat["failures"] += 1
+            stat["wire_bytes"] += wire_bytes
+            stat["body_bytes"] += body_bytes
+            stat["latency_sum"] += latency
+            stat["latency_max"] = max(stat["latency_max"], latency)
+
+    def get(self, proxy: str = None) -> dict:
+        with self.lock:
+            if proxy is None:
+                items = list(self.stats.items())
+            else:
+                items = [(proxy, self.stats.get(proxy, self.default_stat()))]
+        res = {}
+        for key, stat in items:
+            stat = dict(stat)
+            stat["latency_avg"] = round(
+                stat["latency_sum"] / max(stat["requests"], 1), 4
+            )
+            res[key] = stat
+        return res
+
+    def pop(self, proxy: str):
+        with self.lock:
+            return self.stats.pop(proxy, None)
+
+
+class HTTPTransport:
+    """Pooled requests sessions, one per proxy, with a total deadline for each request.
+
+    Deadline covers connect and headers by `total` of urllib3 Timeout,
+    and each read of body by shrinking socket timeout to the remaining time.
+    """
+
+    def __init__(
+        self,
+        pool_maxsize: int = 32,
+        max_sessions: int = 4096,
+        chunk_size: int = 16 * 1024,
+    ):
+        self.pool_maxsize = pool_maxsize
+        self.max_sessions = max_sessions
+        self.chunk_size = chunk_size
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = TransportStats()
+
+    def create_session(self, proxy: str = None) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=self.pool_maxsize, max_retries=0
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers.update(REQUESTS_HEADERS)
+        if proxy:
+            session.proxies = {"http": f"http://{proxy}", "https": f"http://{proxy}"}
+        return session
+
+    def get_session(self, proxy: str = None) -> requests.Session:
+        key = proxy or "direct"
+        with self.lock:
+            session = self.sessions.get(key)
+            if session:
+                self.sessions.move_to_end(key)
+                return session
+            session = self.create_session(proxy)
+            self.sessions[key] = session
+            # evict least recently used sessions, e.g. when benchmarking many proxies
+            while len(self.sessions) > self.max_sessions:
+                _, old_session = self.sessions.popitem(last=False)
+                old_session.close()
+        return session
+
+    def close_session(self, proxy: str = None):
+        with self.lock:
+            session = self.sessions.pop(proxy or "direct", None)
+        if session:
+            session.close()
+
+    def set_read_timeout(self, res: requests.Response, seconds: float):
+        connection = getattr(res.raw, "connection", None)
+        sock = getattr(connection, "sock", None)
+        if sock:
+            sock.settimeout(max(seconds, 0.001))
+
+    def read_content(
+        self, res: requests.Response, deadline_time: float, timeout: float
+    ) -> bytes:
+        """`read1` returns after one read of socket, so each read is bounded
+        by the remaining time, even if the body is dripping slowly."""
+        chunks = []
+        while True:
+            remaining = deadline_time - time.perf_counter()
+            if remaining <= 0:
+                res.close()
+                raise DeadlineExceeded(f"Deadline exceeded when reading: {res.url}")
+            self.set_read_timeout(res, min(timeout, remaining))
+            try:
+                chunk = res.raw.read1(self.chunk_size, decode_content=True)
+                if not chunk:
+                    break
+            except ReadTimeoutError as e:
+                res.close()
+                if time.perf_counter() >= deadline_time:
+                    raise DeadlineExceeded(f"Deadline exceeded when reading: {res.url}")
+                raise requests.exceptions.ReadTimeout(e)
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        proxy: str = None,
+        params: dict = None,
+        headers: dict = None,
+        json: dict = None,
+        timeout: float = 2.5,
+        deadline: float = None,
+    ) -> requests.Response:
+        """`timeout` limits connect and each read, `deadline` limits the whole request."""
+        if deadline is None:
+            deadline = timeout * 2
+        start_time = time.perf_counter()
+        deadline_time = start_time + deadline
+        session = self.get_session(proxy)
+        try:
+            res = session.request(
+                method,
+                url,
+                params=params,
+                headers=headers,
+                json=json,
+                timeout=Timeout(
+                    connect=min(timeout, deadline),
+                    read=min(timeout, deadline),
+                    total=deadline,
+                ),
+                stream=True,
+            )
+            content = self.read_content(res, deadline_time, timeout)
+            res._content = content
+            res._content_consumed = True
+            wire_bytes = res.raw.tell()
+            res.close()
+        except Exception as e:
+            latency = time.perf_counter() - start_time
+            self.stats.record(proxy=proxy, latency=latency, is_success=False)
+            raise e
+
+        latency = time.perf_counter() - start_time
+        self.stats.record(
+            proxy=proxy,
+            latency=latency,
+            wire_bytes=wire_bytes,
+            body_bytes=len(content),
+            is_success=res.status_code == 200,
+        )
+        return res
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+
+class AsyncHTTPTransport:
+    """aiohttp counterpart of HTTPTransport, used by AsyncWorker.
+
+    aiohttp keeps a keep-alive pool per (host, proxy) inside one connector,
+    so a single session is shared by all coroutines.
+    """
+
+    def __init__(self, max_connections: int = 1000, stats: TransportStats = None):
+        self.max_connections = max_connections
+        self.stats = stats or TransportStats()
+        self.session = None
+
+    async def open(self):
+        connector = aiohttp.TCPConnector(
+            limit=self.max_connections, limit_per_host=0, ttl_dns_cache=300
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector, headers=REQUESTS_HEADERS
+        )
+        return self
+
+    async def close(self):
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def request_json(
+        self,
+        method: str,
+        url: str,
+        proxy: str = None,
+        params: dict = None,
+        json: dict = None,
+        timeout: float = 2.5,
+        deadline: float = None,
+    ) -> tuple[int, dict]:
+        """Return (status_code, json_dict), and `json_dict` is None if status is not 200."""
+        if deadline is None:
+            deadline = timeout * 2
+        client_timeout = aiohttp.ClientTimeout(
+            total=deadline, sock_connect=timeout, sock_read=timeout
+        )
+        if proxy:
+            proxy_url = f"http://{proxy}"
+        else:
+            proxy_url = None
+        start_time = time.perf_counter()
+        try:
+            async with self.session.request(
+                method,
+                url,
+                params=params,
+                json=json,
+                proxy=proxy_url,
+                timeout=client_timeout,
+            ) as res:
+                body = await res.read()
+                status = res.status
+                wire_bytes = int(res.headers.get("Content-Length", len(body)))
+                if status == 200:
+                    res_json = await res.json(content_type=None)
+                else:
+                    res_json = None
+        except Exception as e:
+            latency = time.perf_counter() - start_time
+            self.stats.record(proxy=proxy, latency=latency, is_success=False)
+            raise e
+
+        latency = time.perf_counter() - start_time
+        self.stats.record(
+            proxy=proxy,
+            latency=latency,
+            wire_bytes=wire_bytes,
+            body_bytes=len(body),
+            is_success=status == 200,
+        )
+        return status, res_json
+
+
+HTTP_TRANSPORT = HTTPTransport()
+
+
+if __name__ == "__main__":
+    from networks.constants import GET_VIDEO_PAGE_API
+
+    res = HTTP_TRANSPORT.get(
+        GET_VIDEO_PAGE_API, params={"rid": 95, "pn": 1, "ps": 50}, timeout=5
+    )
+    logger.note(f"> [{res.status_code}] {res.headers.get('Content-Encoding')}")
+    logger.mesg(HTTP_TRANSPORT.stats.get())
+
+    # python -m networks.transport
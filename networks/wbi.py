@@ -16,6 +16,7 @@ from tclogger import logger
 
 from configs.envs import COOKIES
 from networks.constants import REQUESTS_HEADERS
+from networks.transport import HTTP_TRANSPORT
 
 
 class ParamsWBISigner:
@@ -32,7 +33,7 @@ class ParamsWBISigner:
         self.init_headers()
 
     def init_headers(self):
-        self.headers = REQUESTS_HEADERS
+        self.headers = REQUESTS_HEADERS.copy()
         new_headers = {
             "Referer": "https://space.bilibili.com/",
             # "Cookie": COOKIES,
@@ -49,7 +50,7 @@ class ParamsWBISigner:
     def get_wbi_keys(self) -> tuple[str, str]:
         """get latest img_key and sub_key"""
         nav_url = "https://api.bilibili.com/x/web-interface/nav"
-        resp = requests.get(nav_url, headers=self.headers)
+        resp = HTTP_TRANSPORT.get(nav_url, headers=self.headers, timeout=10)
         resp.raise_for_status()
         json_content = resp.json()
         wbi_img = json_content["data"]["wbi_img"]
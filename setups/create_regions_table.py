@@ -76,24 +76,13 @@ def insert_regions_info_table_rows(
 ):
     sql = SQLOperator()
     regions_info_dict = create_regions_info_dict()
-    columns_str = ", ".join(SQL_COLUMNS.keys())
-
-    update_on_conflict_str = f" ON CONFLICT ({primary_key}) DO UPDATE SET "
-    update_set_columns = [k for k in SQL_COLUMNS.keys() if k != primary_key]
-    update_set_columns_str = ", ".join(
-        [f"{k} = EXCLUDED.{k}" for k in update_set_columns]
-    )
-    update_set_str = f"{update_on_conflict_str}{update_set_columns_str}"
-
-    sql_query = f"INSERT INTO {table_name} ({columns_str}) VALUES %s {update_set_str}"
-    # sql_query = f"INSERT INTO {table_name} ({columns_str}) VALUES %s"
-    # logger.mesg(sql_query)
+    columns = list(SQL_COLUMNS.keys())
 
     sql_values = [tuple(row.values()) for row in regions_info_dict]
     # logger.file(sql_values)
 
     logger.note(f"Inserting {len(sql_values)} rows into table: {table_name}")
-    res = sql.exec(sql_query, sql_values, is_many=True)
+    res = sql.copy_upsert(table_name, columns, sql_values, primary_key=primary_key)
     logger.mesg(res)
 
 
@@ -0,0 +1,80 @@
+from datetime import datetime, timezone
+from tclogger import logger
+
+from networks.sql import SQLOperator
+from setups.create_videos_table import create_month_partitions
+from workers.stats_history import VideoStatsHistory
+
+
+def create_stats_history_table(table_name: str = VideoStatsHistory.TABLE_NAME):
+    """Narrow append-only table, partitioned by month of `crawl_at`.
+
+    Counts are int4 (`view` is int8), as they are far fewer than 2^31.
+    No primary key, so rows are appended by COPY without conflict checks.
+    """
+    stats_str = ",\n    ".join(
+        [
+            f"{k} {'int8' if k == 'view' else 'int4'}"
+            for k in VideoStatsHistory.STATS_COLUMNS
+        ]
+    )
+    cmd_create_table = f"""CREATE TABLE IF NOT EXISTS {table_name} (
+    aid int8 NOT NULL,
+    crawl_at timestamptz NOT NULL,
+    {stats_str}
+    ) PARTITION BY RANGE (crawl_at);"""
+    cmd_create_index = (
+        f"CREATE INDEX IF NOT EXISTS {table_name}_aid_crawl_at_idx "
+        f"ON {table_name} (aid, crawl_at);"
+    )
+
+    logger.note(f"Creating table: {table_name}")
+    logger.mesg(f"{cmd_create_table}")
+
+    sql = SQLOperator()
+    sql.exec(cmd_create_table)
+    sql.exec(cmd_create_index)
+
+
+def create_stats_daily_table(table_name: str = VideoStatsHistory.DAILY_TABLE_NAME):
+    """Last stats of each aid per day, rolled up from old raw rows."""
+    stats_str = ",\n    ".join(
+        [
+            f"{k} {'int8' if k == 'view' else 'int4'}"
+            for k in VideoStatsHistory.STATS_COLUMNS
+        ]
+    )
+    cmd_create_table = f"""CREATE TABLE IF NOT EXISTS {table_name} (
+    aid int8 NOT NULL,
+    day date NOT NULL,
+    {stats_str},
+    PRIMARY KEY (aid, day)
+    );"""
+
+    logger.note(f"Creating table: {table_name}")
+    logger.mesg(f"{cmd_create_table}")
+
+    sql = SQLOperator()
+    sql.exec(cmd_create_table)
+
+
+def create_stats_history_partitions(table_name: str = VideoStatsHistory.TABLE_NAME):
+    """Partitions from this month to a few months ahead, should be re-run regularly.
+
+    No default partition, as it would keep rows out of month partitions from rollup,
+    and rows of default partition created by earlier versions are moved out of it.
+    """
+    create_month_partitions(
+        table_name,
+        start=datetime.now(timezone.utc),
+        partition_column="crawl_at",
+        is_default=False,
+    )
+
+
+if __name__ == "__main__":
+    create_stats_history_table()
+    create_stats_history_partitions()
+    create_stats_daily_table()
+
+    # python -m setups.create_stats_history_table
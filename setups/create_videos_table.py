@@ -1,29 +1,58 @@
+import argparse
+
+from datetime import datetime, timezone
 from tclogger import logger
 from transforms.video_row import VideoInfoConverter
-from transforms.dtypes import DataTyper
 from networks.sql import SQLOperator
 
+# first videos of bilibili are published in 2009-06
+FIRST_PUBDATE_MONTH = datetime(2009, 6, 1, tzinfo=timezone.utc)
+
+
+def get_next_month(month: datetime) -> datetime:
+    if month.month == 12:
+        return month.replace(year=month.year + 1, month=1)
+    return month.replace(month=month.month + 1)
+
+
+def get_month_starts(start: datetime, end: datetime) -> list[datetime]:
+    """Start of each month in [start, end], aligned to the first day of month."""
+    month = start.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    months = []
+    while month <= end:
+        months.append(month)
+        month = get_next_month(month)
+    return months
+
 
-def create_video_info_table(table_name: str = "videos"):
-    """This script would only run once, to create sql table with required columns."""
+def create_video_info_table(table_name: str = "videos", is_partitioned: bool = False):
+    """This script would only run once, to create sql table with required columns.
 
-    py_columns = VideoInfoConverter.COLUMNS
-    columns_sql_map = VideoInfoConverter.COLUMNS_SQL_MAP
-    columns_rename_map = VideoInfoConverter.COLUMNS_RENAME_MAP
-    columns_to_ignore = VideoInfoConverter.COLUMNS_TO_IGNORE
+    Default table has primary key `(bvid)`, same as `videos_primary_key` in `configs/envs.json`.
 
-    typer = DataTyper()
-    sql_columns = {k: typer.py_dtype_to_sql_dtype(v) for k, v in py_columns.items()}
-    sql_columns = {k: columns_sql_map.get(k, v) for k, v in sql_columns.items()}
-    sql_columns = {columns_rename_map.get(k, k): v for k, v in sql_columns.items()}
-    sql_columns = {k: v for k, v in sql_columns.items() if k not in columns_to_ignore}
+    Partitioned table is partitioned by month of `pubdate`, and as primary key
+    of partitioned table must include partition key, it is `(bvid, pubdate)`.
+    So upserts into it should use `ON CONFLICT (bvid, pubdate)`,
+    and `videos_primary_key` should be set to `bvid, pubdate`.
+    Uniqueness of `bvid` is enforced by `create_videos_keys_table`.
+    """
+
+    sql_columns = VideoInfoConverter().get_sql_column_types()
 
     ws = " " * 4
     table_str = f",\n{ws}".join([f"{k} {v}" for k, v in sql_columns.items()])
 
+    if is_partitioned:
+        primary_key_str = "PRIMARY KEY (bvid, pubdate)"
+        partition_str = " PARTITION BY RANGE (pubdate)"
+    else:
+        primary_key_str = "PRIMARY KEY (bvid)"
+        partition_str = ""
+
     cmd_create_table = f"""CREATE TABLE {table_name} (
-    {table_str}
-    );"""
+    {table_str},
+    {primary_key_str}
+    ){partition_str};"""
 
     logger.note(f"Creating table: {table_name} with {len(sql_columns)} columns:")
     logger.mesg(f"{cmd_create_table}")
@@ -33,6 +62,261 @@ def create_video_info_table(table_name: str = "videos"):
     logger.mesg(res)
 
 
+def create_videos_keys_table(table_name: str = "videos"):
+    """Lookup table `{table_name}_keys (bvid, pubdate)` of partitioned table.
+
+    - Primary key `(bvid)` of it rejects a second row of the same bvid in any partition,
+      which is filled by an AFTER INSERT trigger on `table_name`.
+    - `SQLOperator.create_route_query` routes upserted rows to pubdate of stored row,
+      so a changed pubdate from api updates the stored row, instead of inserting a new one.
+      The first seen pubdate is kept as partition key of the video.
+    """
+    keys_table = f"{table_name}_keys"
+    column_types = VideoInfoConverter().get_sql_column_types()
+    cmd_create_table = f"""CREATE TABLE IF NOT EXISTS {keys_table} (
+    bvid {column_types["bvid"]} PRIMARY KEY,
+    pubdate {column_types["pubdate"]} NOT NULL
+    );"""
+    cmd_create_function = f"""CREATE OR REPLACE FUNCTION {keys_table}_insert()
+    RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO {keys_table} (bvid, pubdate) VALUES (NEW.bvid, NEW.pubdate);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;"""
+    cmd_create_trigger = (
+        f"CREATE OR REPLACE TRIGGER {keys_table}_insert_trigger "
+        f"AFTER INSERT ON {table_name} "
+        f"FOR EACH ROW EXECUTE FUNCTION {keys_table}_insert();"
+    )
+
+    logger.note(f"Creating table: {keys_table}")
+    logger.mesg(f"{cmd_create_table}")
+
+    sql = SQLOperator()
+    sql.exec(cmd_create_table)
+    sql.exec(cmd_create_function)
+    sql.exec(cmd_create_trigger)
+
+
+def is_table_exists(sql: SQLOperator, table_name: str) -> bool:
+    res = sql.exec("SELECT to_regclass(%s);", (table_name,), is_fetchall=True)
+    return bool(res and res[0][0])
+
+
+def create_month_partitions(
+    table_name: str = "videos",
+    start: datetime = FIRST_PUBDATE_MONTH,
+    end: datetime = None,
+    months_ahead: int = 3,
+    partition_column: str = "pubdate",
+    is_default: bool = True,
+):
+    """Create one partition per month of `partition_column`, and a default partition.
+    Existing partitions are skipped, so it could be re-run to add partitions ahead.
+
+    Postgres rejects a new partition whose range has rows in default partition,
+    so rows in range are moved out of default partition when creating it.
+    If `is_default` is False, an existing default partition is emptied and dropped.
+    """
+    sql = SQLOperator()
+    default_name = f"{table_name}_default"
+    has_default = is_table_exists(sql, default_name)
+    end = end or datetime.now(timezone.utc)
+    if has_default and not is_default:
+        res = sql.exec(
+            f"SELECT MIN({partition_column}), MAX({partition_column}) "
+            f"FROM {default_name};",
+            is_fetchall=True,
+        )
+        min_value, max_value = res[0] if res else (None, None)
+        start = min(start, min_value or start)
+        end = max(end, max_value or end)
+
+    months = get_month_starts(start, end)
+    for i in range(months_ahead):
+        months.append(get_next_month(months[-1]))
+
+    logger.note(f"Creating partitions: {table_name} ({len(months)} months)")
+    for month in months:
+        partition_name = f"{table_name}_p{month.strftime('%Y%m')}"
+        if is_table_exists(sql, partition_name):
+            continue
+        next_month = get_next_month(month)
+        range_str = f"FROM ('{month.isoformat()}') TO ('{next_month.isoformat()}')"
+        if has_default:
+            # create, move rows and attach in one transaction
+            cmd_create_partition = (
+                f"CREATE TABLE {partition_name} (LIKE {table_name} "
+                f"INCLUDING DEFAULTS INCLUDING CONSTRAINTS); "
+                f"WITH moved AS (DELETE FROM {default_name} "
+                f"WHERE {partition_column} >= '{month.isoformat()}' "
+                f"AND {partition_column} < '{next_month.isoformat()}' RETURNING *) "
+                f"INSERT INTO {partition_name} SELECT * FROM moved; "
+                f"ALTER TABLE {table_name} ATTACH PARTITION {partition_name} "
+                f"FOR VALUES {range_str};"
+            )
+        else:
+            cmd_create_partition = (
+                f"CREATE TABLE IF NOT EXISTS {partition_name} "
+                f"PARTITION OF {table_name} FOR VALUES {range_str};"
+            )
+        sql.exec(cmd_create_partition)
+
+    if is_default:
+        # rows out of ranges above, e.g. wrong pubdates from api
+        sql.exec(
+            f"CREATE TABLE IF NOT EXISTS {default_name} "
+            f"PARTITION OF {table_name} DEFAULT;"
+        )
+    elif has_default:
+        res = sql.exec(f"SELECT COUNT(*) FROM {default_name};", is_fetchall=True)
+        if res and res[0][0] == 0:
+            sql.exec(f"DROP TABLE {default_name};")
+            logger.mesg(f"  - Dropped default partition: {default_name}")
+        else:
+            logger.warn(f"× Default partition is not empty: {default_name}")
+    logger.success(f"+ Created partitions: {months[0]:%Y-%m} ~ {months[-1]:%Y-%m}")
+
+
+def create_videos_indexes(table_name: str = "videos"):
+    """Indexes on partitioned table are created on each partition.
+    - (tid, pubdate DESC): newest pubdate of each region, used by incremental crawl
+    - (mid): videos of owner
+    - (pubdate): time range queries on non-partitioned table
+    """
+    indexes = {
+        f"{table_name}_tid_pubdate_idx": "(tid, pubdate DESC)",
+        f"{table_name}_mid_idx": "(mid)",
+        f"{table_name}_pubdate_idx": "(pubdate)",
+    }
+    sql = SQLOperator()
+    for index_name, index_columns in indexes.items():
+        cmd_create_index = (
+            f"CREATE INDEX IF NOT EXISTS {index_name} ON {table_name} {index_columns};"
+        )
+        logger.note(f"Creating index: {index_name}")
+        logger.mesg(f"{cmd_create_index}")
+        res = sql.exec(cmd_create_index)
+        logger.mesg(res)
+
+
+def migrate_to_partitioned_table(table_name: str = "videos"):
+    """Migrate existing non-partitioned table to partitioned table:
+
+    1. rename `videos` (and its indexes) to `videos_legacy`
+    2. create partitioned `videos`, with partitions covering pubdates of legacy rows
+       since first video, and outliers go to default partition
+    3. copy rows month by month, each month in one transaction, abort on failure
+    4. create secondary indexes after rows are loaded, which is faster
+
+    Rows without `pubdate` could not be in primary key, so they are skipped and counted.
+    `videos_legacy` is kept for checking, and could be dropped manually.
+    Workers should be stopped during migration.
+    """
+    legacy_table = f"{table_name}_legacy"
+    sql = SQLOperator()
+
+    logger.note(f"> Renaming: {table_name} -> {legacy_table}")
+    index_names = sql.exec(
+        "SELECT indexname FROM pg_indexes "
+        "WHERE schemaname = current_schema() AND tablename = %s;",
+        (table_name,),
+        is_fetchall=True,
+    )
+    sql.exec(f"ALTER TABLE {table_name} RENAME TO {legacy_table};")
+    for (index_name,) in index_names or []:
+        new_index_name = index_name.replace(table_name, legacy_table, 1)
+        sql.exec(f"ALTER INDEX {index_name} RENAME TO {new_index_name};")
+
+    res = sql.exec(
+        f"SELECT MIN(pubdate), MAX(pubdate), COUNT(*) FROM {legacy_table};",
+        is_fetchall=True,
+    )
+    min_pubdate, max_pubdate, legacy_count = res[0]
+    # wrong pubdates before first video (e.g. 0) or far in future go to default partition
+    min_pubdate = max(min_pubdate or FIRST_PUBDATE_MONTH, FIRST_PUBDATE_MONTH)
+    now = datetime.now(timezone.utc)
+    max_pubdate = min(max_pubdate or now, now)
+
+    create_video_info_table(table_name, is_partitioned=True)
+    # before copying rows, so keys of migrated rows are filled by trigger
+    create_videos_keys_table(table_name)
+    create_month_partitions(table_name, start=min_pubdate, end=max_pubdate)
+
+    columns_str = ", ".join(VideoInfoConverter().get_sql_columns())
+    cmd_migrate = (
+        f"INSERT INTO {table_name} ({columns_str}) "
+        f"SELECT {columns_str} FROM {legacy_table} "
+        f"WHERE pubdate >= %s AND pubdate < %s ON CONFLICT DO NOTHING;"
+    )
+    months = get_month_starts(min_pubdate, max_pubdate)
+    ranges = [(f"< {months[0]:%Y-%m}", "-infinity", months[0])]
+    ranges += [(f"{month:%Y-%m}", month, get_next_month(month)) for month in months]
+    ranges.append((f"> {months[-1]:%Y-%m}", get_next_month(months[-1]), "infinity"))
+    # `sql.exec` logs and swallows errors, so moves run on a connection which raises
+    conn = sql.create_connection()
+    try:
+        for range_str, range_start, range_end in ranges:
+            # each range in one transaction, which is rolled back on error
+            with conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(cmd_migrate, (range_start, range_end))
+                    migrated_rows_count = cursor.rowcount
+            logger.mesg(f"  + Migrated: {range_str} ({migrated_rows_count} rows)")
+    except Exception as e:
+        logger.err(f"× Migration aborted at: {range_str}: {e}")
+        logger.note(f"> Rows are kept in `{legacy_table}`")
+        raise
+    finally:
+        conn.close()
+
+    create_videos_indexes(table_name)
+
+    res = sql.exec(f"SELECT COUNT(*) FROM {table_name};", is_fetchall=True)
+    migrated_count = res[0][0]
+    res = sql.exec(
+        f"SELECT COUNT(*) FROM {legacy_table} WHERE pubdate IS NULL;",
+        is_fetchall=True,
+    )
+    skipped_count = res[0][0]
+    logger.success(
+        f"+ Migrated: {migrated_count}/{legacy_count} rows "
+        f"(skipped {skipped_count} rows without pubdate)"
+    )
+    logger.note(
+        f"> Set `videos_primary_key` to `bvid, pubdate` in configs/envs.json, "
+        f"and drop `{legacy_table}` after checking"
+    )
+
+
 if __name__ == "__main__":
-    create_video_info_table()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-p",
+        "--partitioned",
+        action="store_true",
+        help="Create table partitioned by month of pubdate",
+    )
+    parser.add_argument(
+        "-m", "--migrate", action="store_true", help="Migrate to partitioned table"
+    )
+    args = parser.parse_args()
+
+    if args.migrate:
+        migrate_to_partitioned_table()
+    elif args.partitioned:
+        create_video_info_table(is_partitioned=True)
+        create_videos_keys_table()
+        create_month_partitions()
+        create_videos_indexes()
+        logger.note(
+            f"> Set `videos_primary_key` to `bvid, pubdate` in configs/envs.json"
+        )
+    else:
+        create_video_info_table()
+        create_videos_indexes()
+
     # python -m setups.create_videos_table
+    # python -m setups.create_videos_table --partitioned
+    # python -m setups.create_videos_table --migrate
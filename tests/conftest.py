@@ -0,0 +1,6 @@
+import sys
+
+from pathlib import Path
+
+# tests import modules from repo root, e.g. `networks.retry`
+sys.path.insert(0, str(Path(__file__).parents[1]))
@@ -0,0 +1,183 @@
+import asyncio
+import pytest
+import requests
+
+from functools import partial
+
+from networks.proxy_feedback import ProxyFeedbackReporter
+from networks.rate_control import ProxyRateControllers
+from networks.retry import RetryPolicy
+from workers import worker
+from workers.async_worker import AsyncWorker, AsyncWorkersEngine
+from workers.region_planner import RegionPlanner
+from workers.seen_aids import SeenAidsIndex
+from workers.worker import WorkerParamsGenerator
+
+OK_JSON = {"code": 0, "data": {"archives": [], "page": {"count": 0}}}
+
+
+class FakeTransport:
+    """Returns or raises `responses` in order, and records proxies of requests."""
+
+    def __init__(self, responses: list):
+        self.responses = list(responses)
+        self.proxies = []
+
+    async def request_json(self, method: str, url: str, proxy: str = None, **kwargs):
+        self.proxies.append(proxy)
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+class FakeAsyncSQL:
+    """Records upserted keys, and fails all writes if `is_failed`."""
+
+    def __init__(self, is_failed: bool = False):
+        self.is_failed = is_failed
+        self.upserted_keys = []
+
+    async def copy_upsert_by_keys(
+        self, table_name, columns, values_list, keys, **kwargs
+    ):
+        if self.is_failed:
+            return None
+        self.upserted_keys.extend(keys)
+        return {"inserted": len(values_list), "updated": 0}
+
+    def get_upsert_counts_str(self, counts: dict) -> str:
+        return str(counts)
+
+
+@pytest.fixture
+def generator(tmp_path, monkeypatch) -> WorkerParamsGenerator:
+    monkeypatch.setattr(
+        worker,
+        "RegionPlanner",
+        partial(
+            RegionPlanner,
+            seed_path=tmp_path / "regions_count.json",
+            marks_path=tmp_path / "regions_pubdate_marks.json",
+        ),
+    )
+    generator = WorkerParamsGenerator(region_tids=[1])
+    generator.log_file = tmp_path / "worker.log"
+    generator.planner.update_count(1, 100)
+    return generator
+
+
+def new_worker(
+    generator: WorkerParamsGenerator,
+    responses: list = [],
+    proxies: list = [],
+    async_sql: FakeAsyncSQL = None,
+    max_attempts: int = 8,
+) -> AsyncWorker:
+    async_worker = AsyncWorker(
+        wid=0, generator=generator, sql=None, lock=None, proxy="http://proxy-0"
+    )
+    async_worker.active = True
+    async_worker.retry_policy = RetryPolicy(
+        budget=10, max_attempts=max_attempts, backoff_base=0
+    )
+    async_worker.rate_controllers = ProxyRateControllers(rate=1000, max_rate=1000)
+    async_worker.proxy_feedback = ProxyFeedbackReporter(report_api="")
+    # do not start report thread in tests
+    async_worker.proxy_feedback.thread = object()
+    async_worker.seen_aids = SeenAidsIndex(capacity=64, shards_num=4)
+    async_worker.async_sql = async_sql
+    async_worker.transport = FakeTransport(responses)
+
+    next_proxies = list(proxies)
+
+    async def async_switch_proxy():
+        async_worker.proxy = next_proxies.pop(0) if next_proxies else None
+
+    async_worker.async_switch_proxy = async_switch_proxy
+    return async_worker
+
+
+def test_get_page_retries_on_same_proxy(generator):
+    async_worker = new_worker(generator, responses=[(502, None), (200, OK_JSON)])
+    res_json = asyncio.run(async_worker.async_get_page(tid=1, pn=1))
+    assert res_json == OK_JSON
+    assert async_worker.transport.proxies == ["http://proxy-0", "http://proxy-0"]
+
+
+def test_get_page_switches_proxy_when_rate_limited(generator):
+    async_worker = new_worker(
+        generator,
+        responses=[(412, None), (200, OK_JSON)],
+        proxies=["http://proxy-1"],
+    )
+    res_json = asyncio.run(async_worker.async_get_page(tid=1, pn=1))
+    assert res_json == OK_JSON
+    assert async_worker.transport.proxies == ["http://proxy-0", "http://proxy-1"]
+    state = async_worker.rate_controllers.get("http://proxy-0").get_state()
+    assert state["rate_limited"] == 1
+
+
+def test_get_page_requeues_when_attempts_used_up(generator):
+    async_worker = new_worker(
+        generator, responses=[(502, None), (502, None)], max_attempts=2
+    )
+    res_json = asyncio.run(async_worker.async_get_page(tid=1, pn=1))
+    assert res_json["retry_decision"] == "requeue"
+    assert res_json["data"]["page"]["num"] == 1
+
+
+def test_get_page_requeues_without_proxy(generator):
+    async_worker = new_worker(
+        generator, responses=[requests.exceptions.ConnectTimeout()]
+    )
+    res_json = asyncio.run(async_worker.async_get_page(tid=1, pn=1))
+    assert res_json["retry_decision"] == "requeue"
+    assert res_json["retry_category"] == "connect_timeout"
+    assert async_worker.proxy is None
+
+
+def test_get_page_gives_up_on_unexpected_error(generator):
+    async_worker = new_worker(generator, responses=[KeyError("data")])
+    res_json = asyncio.run(async_worker.async_get_page(tid=1, pn=1))
+    assert res_json["retry_decision"] == "give_up"
+    assert res_json["retry_category"] == "error"
+
+
+def use_fake_rows(async_worker: AsyncWorker):
+    async_worker.get_rows_from_archives = lambda archives: (
+        [("BV1", ("BV1",))],
+        [(1, 123)],
+    )
+
+
+def test_insert_rows_completes_page_when_written(generator):
+    async_sql = FakeAsyncSQL()
+    async_worker = new_worker(generator, async_sql=async_sql)
+    use_fake_rows(async_worker)
+    assert generator.next() == (1, 1)
+    asyncio.run(async_worker.async_insert_rows([{}], tid=1, pn=1))
+    assert async_sql.upserted_keys == ["BV1"]
+    assert generator.inflight == set()
+    assert async_worker.seen_aids.is_unchanged(1, 123)
+
+
+def test_insert_rows_requeues_page_when_failed(generator):
+    async_worker = new_worker(generator, async_sql=FakeAsyncSQL(is_failed=True))
+    use_fake_rows(async_worker)
+    assert generator.next() == (1, 1)
+    asyncio.run(async_worker.async_insert_rows([{}], tid=1, pn=1))
+    assert list(generator.queue) == [(1, 1)]
+    assert generator.inflight == set()
+    assert not async_worker.seen_aids.is_unchanged(1, 123)
+
+
+def test_engine_runs_until_workers_exit(generator):
+    async_workers = [new_worker(generator) for _ in range(3)]
+    for async_worker in async_workers:
+        async_worker.is_exited = True
+    engine = AsyncWorkersEngine(max_connections=4)
+    engine.run(async_workers)
+    for async_worker in async_workers:
+        assert async_worker.loop is engine.loop
+        assert async_worker.event.is_set()
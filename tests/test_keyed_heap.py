@@ -0,0 +1,98 @@
+import time
+
+from apps.proxy_app import ProxiesDatabase
+from networks.keyed_heap import KeyedHeap
+
+
+def test_keyed_heap_push_pop_update_remove():
+    heap = KeyedHeap()
+    heap.push("a", (3,), "item_a")
+    heap.push("b", (1,), "item_b")
+    heap.push("c", (2,), "item_c")
+    # update priority of existing key
+    heap.push("a", (0,), "item_a2")
+    assert len(heap) == 3
+    assert heap.remove("c") == "item_c"
+    assert heap.remove("c") is None
+    assert heap.pop() == ("a", "item_a2")
+    assert heap.pop() == ("b", "item_b")
+    assert heap.pop() == (None, None)
+
+
+def test_keyed_heap_ties_in_insertion_order():
+    heap = KeyedHeap()
+    for key in ["x", "y", "z"]:
+        heap.push(key, (1,))
+    assert [heap.pop()[0] for _ in range(3)] == ["x", "y", "z"]
+
+
+def test_keyed_heap_compact():
+    heap = KeyedHeap()
+    for i in range(200):
+        heap.push(i, (i,))
+    for i in range(150):
+        heap.remove(i)
+    assert len(heap.heap) < 200
+    assert heap.pop()[0] == 150
+
+
+def new_db(lease_ttl: float = 300) -> ProxiesDatabase:
+    db = ProxiesDatabase(lease_ttl=lease_ttl)
+    db.add_good_proxy("http://slow", latency=2.0, success_rate=0.9)
+    db.add_good_proxy("http://fast", latency=0.5, success_rate=0.9)
+    db.add_good_proxy("http://flaky", latency=0.1, success_rate=0.5)
+    return db
+
+
+def test_lease_best_proxy():
+    db = new_db()
+    res = db.pop_best_proxy(holder="worker-1")
+    assert res["server"] == "http://fast"
+    assert res["lease_id"]
+    assert db.get_using_proxies_list() == ["http://fast"]
+    assert "http://fast" not in db.get_good_proxies_list()
+    assert db.pop_best_proxy()["server"] == "http://slow"
+    assert db.pop_best_proxy()["server"] == "http://flaky"
+    assert db.pop_best_proxy()["status"] == "error"
+
+
+def test_report_reorders_and_renews_lease():
+    db = new_db()
+    db.report_proxy("http://fast", requests=20, successes=0)
+    assert db.pop_best_proxy()["server"] == "http://slow"
+
+    res = db.pop_best_proxy()
+    lease = db.leases[res["lease_id"]]
+    expires_at = lease["expires_at"]
+    time.sleep(0.01)
+    assert db.report_proxy(res["server"], requests=1, successes=1)
+    assert lease["expires_at"] > expires_at
+    assert not db.report_proxy("http://unknown", requests=1, successes=1)
+
+
+def test_reap_expired_leases():
+    db = new_db(lease_ttl=60)
+    expired = db.pop_best_proxy(ttl=0.01)
+    alive = db.pop_best_proxy()
+    time.sleep(0.02)
+    assert db.reap_expired_leases() == [expired["server"]]
+    assert db.get_using_proxies_list() == [alive["server"]]
+    assert expired["server"] in db.get_good_proxies_list()
+    heartbeat = db.heartbeat_leases([expired["lease_id"], alive["lease_id"]])
+    assert heartbeat == {
+        "renewed": [alive["lease_id"]],
+        "expired": [expired["lease_id"]],
+    }
+    assert db.reap_expired_leases() == []
+
+
+def test_keyed_heap_compact_on_updates():
+    heap = KeyedHeap()
+    for i in range(10):
+        heap.push(i, (i,))
+    for round_idx in range(100):
+        for i in range(10):
+            heap.push(i, (round_idx, i))
+    assert len(heap) == 10
+    assert len(heap.heap) <= 2 * len(heap) + 64 + 1
+    assert heap.pop()[0] == 0
@@ -0,0 +1,38 @@
+from networks.proxy_feedback import ProxyFeedbackReporter
+
+
+def new_reporter(**kwargs) -> ProxyFeedbackReporter:
+    reporter = ProxyFeedbackReporter(report_api="http://127.0.0.1:1/report", **kwargs)
+    # do not start report thread in tests
+    reporter.thread = object()
+    return reporter
+
+
+def test_stale_leases_are_not_heartbeated():
+    reporter = new_reporter(stale_seconds=60)
+    reporter.hold("alive")
+    reporter.hold("stale")
+    reporter.lease_times["stale"] -= 120
+    assert reporter.get_alive_lease_ids() == ["alive"]
+    assert reporter.pop_expired("stale")
+    assert not reporter.pop_expired("alive")
+
+
+def test_touch_keeps_lease_alive():
+    reporter = new_reporter(stale_seconds=60)
+    reporter.hold("lease")
+    reporter.lease_times["lease"] -= 120
+    reporter.touch("lease")
+    assert reporter.get_alive_lease_ids() == ["lease"]
+
+
+def test_unhold_and_mark_expired():
+    reporter = new_reporter()
+    reporter.hold("a")
+    reporter.hold("b")
+    reporter.mark_expired(["a", "unknown"])
+    assert reporter.get_alive_lease_ids() == ["b"]
+    assert reporter.pop_expired("a")
+    assert not reporter.pop_expired("unknown")
+    reporter.unhold("b")
+    assert reporter.get_alive_lease_ids() == []
@@ -0,0 +1,76 @@
+import asyncio
+import json
+import pytest
+import requests
+
+from networks.retry import RetryPolicy
+from networks.transport import DeadlineExceeded
+
+
+@pytest.fixture
+def policy() -> RetryPolicy:
+    return RetryPolicy(budget=10, max_attempts=4, same_proxy_retries=2)
+
+
+@pytest.mark.parametrize(
+    "exception, category",
+    [
+        (requests.exceptions.ConnectTimeout(), "connect_timeout"),
+        (requests.exceptions.ReadTimeout(), "read_timeout"),
+        (DeadlineExceeded(), "read_timeout"),
+        (asyncio.TimeoutError(), "read_timeout"),
+        (requests.exceptions.ConnectionError(), "connect_error"),
+        (requests.exceptions.ChunkedEncodingError(), "connect_error"),
+        (ConnectionResetError(), "connect_error"),
+        (json.JSONDecodeError("Expecting value", "", 0), "bad_response"),
+        (requests.exceptions.JSONDecodeError("Expecting value", "", 0), "bad_response"),
+        (KeyError("data"), "error"),
+        (TypeError(), "error"),
+    ],
+)
+def test_classify_exception(policy, exception, category):
+    assert policy.classify(exception=exception)["category"] == category
+
+
+def test_classify_response(policy):
+    assert policy.classify(200, {"code": 0})["category"] == "ok"
+    assert policy.classify(412, None)["category"] == "http_status"
+    assert policy.classify(200, None)["category"] == "bad_response"
+    outcome = policy.classify(200, {"code": -404, "message": "not found"})
+    assert outcome["category"] == "bili_code"
+    assert outcome["code"] == -404
+
+
+def test_decide_done_and_give_up(policy):
+    state = policy.new_state()
+    assert policy.decide(policy.classify(200, {"code": 0}), state) == "done"
+    outcome = policy.classify(200, {"code": -404})
+    assert policy.decide(outcome, policy.new_state()) == "give_up"
+    outcome = policy.classify(exception=KeyError("data"))
+    assert policy.decide(outcome, policy.new_state()) == "give_up"
+
+
+def test_decide_switch_proxy(policy):
+    for outcome in [
+        policy.classify(exception=requests.exceptions.ConnectTimeout()),
+        policy.classify(429, None),
+        policy.classify(503, None),
+        policy.classify(200, {"code": -412}),
+    ]:
+        state = policy.new_state()
+        assert policy.decide(outcome, state) == "switch_proxy"
+        assert state["same_proxy_attempts"] == 0
+
+
+def test_decide_retry_then_switch_then_requeue(policy):
+    state = policy.new_state()
+    outcome = policy.classify(502, None)
+    decisions = [policy.decide(outcome, state) for _ in range(4)]
+    assert decisions == ["retry", "retry", "switch_proxy", "requeue"]
+
+
+def test_decide_requeue_when_budget_used_up():
+    policy = RetryPolicy(budget=0)
+    outcome = policy.classify(503, None)
+    assert policy.decide(outcome, policy.new_state()) == "requeue"
+    assert policy.get_backoff_seconds(policy.new_state()) == 0
@@ -0,0 +1,76 @@
+import pytest
+
+from networks.sql_buffer import SQLWriteBuffer
+from networks.sql_queries import SQLQueriesMixin
+
+
+class FakeSQL(SQLQueriesMixin):
+    """Records copied rows, and fails all writes if `is_failed`."""
+
+    def __init__(self, is_failed: bool = False):
+        self.is_failed = is_failed
+        self.written_keys = []
+
+    def copy_upsert_by_keys(self, table_name, columns, values_list, keys, **kwargs):
+        if self.is_failed:
+            return None
+        self.written_keys.extend(keys)
+        return {"inserted": len(values_list), "updated": 0}
+
+
+def new_buffer(sql: FakeSQL, **kwargs) -> SQLWriteBuffer:
+    return SQLWriteBuffer(sql=sql, columns=["bvid", "title"], **kwargs)
+
+
+def test_empty_add_does_not_start_delay():
+    buffer = new_buffer(FakeSQL())
+    buffer.add_many([])
+    assert buffer.first_row_time is None
+    assert buffer.get_flush_reason() is None
+
+
+def test_flush_merges_keys_and_runs_callbacks():
+    sql = FakeSQL()
+    buffer = new_buffer(sql)
+    written = []
+    buffer.add_many(
+        [("BV1", ("BV1", "a")), ("BV2", ("BV2", "b"))],
+        on_written=lambda: written.append(1),
+    )
+    buffer.add("BV1", ("BV1", "a2"), on_written=lambda: written.append(2))
+    assert buffer.get_flush_reason() is None
+    buffer.flush()
+    assert sql.written_keys == ["BV1", "BV2"]
+    assert written == [1, 2]
+    assert buffer.get_stats()["merged_duplicates"] == 1
+
+
+def test_flush_reason_size():
+    buffer = new_buffer(FakeSQL(), max_rows=2)
+    buffer.add_many([("BV1", ("BV1", "a")), ("BV2", ("BV2", "b"))])
+    assert buffer.get_flush_reason() == "size"
+
+
+def test_failed_flush_runs_failed_callbacks():
+    buffer = new_buffer(FakeSQL(is_failed=True))
+    failed = []
+    buffer.add_many(
+        [("BV1", ("BV1", "a"))],
+        on_written=lambda: failed.append("written"),
+        on_failed=lambda: failed.append("failed"),
+    )
+    buffer.flush()
+    assert failed == ["failed"]
+
+
+def test_values_and_unnest_refuse_composite_key():
+    for write_method in ["values", "unnest"]:
+        with pytest.raises(ValueError):
+            new_buffer(
+                FakeSQL(),
+                primary_key="bvid, pubdate",
+                write_method=write_method,
+                unnest_query="SELECT 1",
+            )
+    buffer = new_buffer(FakeSQL(), primary_key="bvid, pubdate")
+    assert buffer.write_method == "copy"
@@ -0,0 +1,25 @@
+from networks.sql_queries import SQLQueriesMixin
+
+
+def test_route_query_only_for_composite_key():
+    queries = SQLQueriesMixin()
+    assert queries.create_route_query("videos", "videos_staging", "bvid") is None
+    assert queries.create_route_keys_query("videos", "bvid") is None
+    assert "videos_keys" in queries.create_route_query(
+        "videos", "videos_staging", "bvid, pubdate"
+    )
+    assert queries.create_route_keys_query("videos", "bvid, pubdate") == (
+        "SELECT bvid, pubdate FROM videos_keys WHERE bvid = ANY(%s);"
+    )
+
+
+def test_route_values_to_stored_pubdate():
+    queries = SQLQueriesMixin()
+    values_list = [("BV1", 200, "a"), ("BV2", 300, "b")]
+    routed = queries.route_values(
+        values_list,
+        columns=["bvid", "pubdate", "title"],
+        primary_key="bvid, pubdate",
+        stored_rows=[("BV1", 100)],
+    )
+    assert routed == [("BV1", 100, "a"), ("BV2", 300, "b")]
@@ -0,0 +1,117 @@
+import pytest
+
+from networks.sql_queries import SQLQueriesMixin
+from networks.sql_spool import SQLSpool
+
+COLUMNS = ["bvid", "title", "insert_at"]
+
+
+class FakeSQL(SQLQueriesMixin):
+    """Records upserted batches, and fails batches containing `failed_keys`."""
+
+    def __init__(self, failed_keys: list = []):
+        self.failed_keys = set(failed_keys)
+        self.upserted_batches = []
+
+    def is_available(self) -> bool:
+        return True
+
+    def copy_upsert_by_keys(self, table_name, columns, values_list, keys, **kwargs):
+        if self.failed_keys & set(keys):
+            return None
+        self.upserted_batches.append((table_name, kwargs["fresh_column"], keys))
+        return {"inserted": len(values_list), "updated": 0}
+
+
+def new_kwargs(table_name: str, values_list: list) -> dict:
+    return {
+        "table_name": table_name,
+        "columns": COLUMNS,
+        "values_list": values_list,
+        "primary_key": "bvid",
+        "compare_columns": None,
+    }
+
+
+@pytest.fixture
+def records() -> list:
+    return [
+        ("copy_upsert", new_kwargs("videos", [("BV1", "a", 1), ("BV2", "b", 1)])),
+        ("copy_upsert", new_kwargs("videos", [("BV1", "a2", 2)])),
+        ("copy_upsert", new_kwargs("videos_other", [("BV3", "c", 1)])),
+        ("copy_upsert", new_kwargs("videos", [("BV4", "d", 1)])),
+    ]
+
+
+def test_segment_round_trip(tmp_path, records):
+    spool = SQLSpool(FakeSQL(), spool_dir=tmp_path)
+    for method, kwargs in records:
+        spool.append(method, kwargs)
+    spool.stop()
+    segment_paths = spool.get_segment_paths()
+    assert len(segment_paths) == 1
+    assert spool.read_segment(segment_paths[0]) == records
+    assert spool.get_stats()["spooled_records"] == len(records)
+
+
+def test_segment_truncated_tail_is_ignored(tmp_path, records):
+    spool = SQLSpool(FakeSQL(), spool_dir=tmp_path)
+    for method, kwargs in records:
+        spool.append(method, kwargs)
+    spool.stop()
+    segment_path = spool.get_segment_paths()[0]
+    segment_bytes = segment_path.read_bytes()
+    segment_path.write_bytes(segment_bytes[:-3])
+    assert spool.read_segment(segment_path) == records[:-1]
+
+
+def test_segment_rotation(tmp_path, records):
+    spool = SQLSpool(FakeSQL(), spool_dir=tmp_path, segment_max_mb=1e-6)
+    for method, kwargs in records:
+        spool.append(method, kwargs)
+    assert len(spool.get_segment_paths()) == len(records)
+
+
+def test_group_records_merges_adjacent_only(tmp_path, records):
+    spool = SQLSpool(FakeSQL(), spool_dir=tmp_path)
+    groups = spool.group_records(records)
+    assert [kwargs["table_name"] for method, kwargs in groups] == [
+        "videos",
+        "videos_other",
+        "videos",
+    ]
+    assert len(groups[0][1]["values_list"]) == 3
+    # merging does not change spooled records
+    assert len(records[0][1]["values_list"]) == 2
+
+
+def test_replay_in_order(tmp_path, records):
+    sql = FakeSQL()
+    spool = SQLSpool(sql, spool_dir=tmp_path)
+    for method, kwargs in records:
+        spool.append(method, kwargs)
+    assert spool.replay() == len(records)
+    assert sql.upserted_batches == [
+        ("videos", "insert_at", ["BV1", "BV2", "BV1"]),
+        ("videos_other", "insert_at", ["BV3"]),
+        ("videos", "insert_at", ["BV4"]),
+    ]
+    assert spool.get_segment_paths() == []
+    assert spool.get_stats()["replayed_segments"] == 1
+
+
+def test_replay_quarantines_failed_batches(tmp_path, records):
+    sql = FakeSQL(failed_keys=["BV3"])
+    spool = SQLSpool(sql, spool_dir=tmp_path)
+    for method, kwargs in records:
+        spool.append(method, kwargs)
+    spool.replay()
+    assert [keys for _, _, keys in sql.upserted_batches] == [
+        ["BV1", "BV2", "BV1"],
+        ["BV4"],
+    ]
+    assert spool.get_segment_paths() == []
+    quarantine_paths = list((tmp_path / "quarantine").glob(f"*{SQLSpool.SUFFIX}"))
+    assert len(quarantine_paths) == 1
+    assert spool.read_segment(quarantine_paths[0]) == [records[2]]
+    assert spool.get_stats()["quarantined_records"] == 1
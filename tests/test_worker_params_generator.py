@@ -0,0 +1,159 @@
+import json
+import pytest
+
+from functools import partial
+
+from workers import worker
+from workers.region_planner import RegionPlanner
+from workers.worker import WorkerParamsGenerator
+
+
+@pytest.fixture
+def new_generator(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        worker,
+        "RegionPlanner",
+        partial(
+            RegionPlanner,
+            seed_path=tmp_path / "regions_count.json",
+            marks_path=tmp_path / "regions_pubdate_marks.json",
+        ),
+    )
+
+    def new_generator(region_tids: list[int], counts: dict = {}):
+        generator = WorkerParamsGenerator(region_tids=region_tids)
+        generator.log_file = tmp_path / "worker.log"
+        for tid, count in counts.items():
+            generator.planner.update_count(tid, count)
+        return generator
+
+    return new_generator
+
+
+def drain(generator: WorkerParamsGenerator) -> list[tuple[int, int]]:
+    params = []
+    while True:
+        tid, pn = generator.next()
+        if tid == -1:
+            return params
+        params.append((tid, pn))
+
+
+def test_pages_are_issued_up_to_last_pn(new_generator):
+    generator = new_generator([1, 2], counts={1: 100, 2: 60})
+    params = drain(generator)
+    assert sorted(params) == [(1, 1), (1, 2), (2, 1), (2, 2)]
+    assert generator.inflight == set(params)
+    assert not generator.is_terminated()
+
+
+def test_terminates_after_regions_exhausted(new_generator):
+    generator = new_generator([1, 2], counts={1: 50, 2: 50})
+    for tid, pn in drain(generator):
+        generator.complete_page(tid, pn)
+        generator.flag_current_region_exhausted(exhausted_tid=tid, pn=pn)
+    assert generator.exhausted_tids == [1, 2]
+    assert generator.inflight == set()
+    assert generator.is_terminated()
+
+
+def test_probe_page_issued_once_until_count_known(new_generator):
+    generator = new_generator([1])
+    assert drain(generator) == [(1, 1)]
+    generator.planner.update_count(1, 120)
+    generator.complete_page(1, 1)
+    assert drain(generator) == [(1, 2), (1, 3)]
+
+
+def test_requeued_pages_are_served_first(new_generator):
+    generator = new_generator([1], counts={1: 150})
+    assert generator.next() == (1, 1)
+    generator.append_queue(1, 1)
+    assert generator.next() == (1, 1)
+    assert generator.next() == (1, 2)
+
+
+def test_give_up_probe_page_exhausts_region(new_generator):
+    generator = new_generator([1])
+    max_attempts = WorkerParamsGenerator.MAX_GIVE_UP_ATTEMPTS
+    for i in range(max_attempts):
+        assert generator.next() == (1, 1)
+        generator.give_up_page(1, 1)
+        if i < max_attempts - 1:
+            assert not generator.is_terminated()
+    assert generator.exhausted_tids == [1]
+    assert generator.is_terminated()
+
+
+def test_give_up_middle_page_is_requeued_then_recorded(new_generator):
+    generator = new_generator([1], counts={1: 150})
+    assert drain(generator) == [(1, 1), (1, 2), (1, 3)]
+    for i in range(WorkerParamsGenerator.MAX_GIVE_UP_ATTEMPTS - 1):
+        generator.give_up_page(1, 2)
+        assert generator.next() == (1, 2)
+    generator.give_up_page(1, 2)
+    assert (1, 2) not in generator.inflight
+    assert generator.next() == (-1, -1)
+    assert generator.exhausted_tids == []
+    assert generator.given_up_pages == [(1, 2)]
+    assert "tid=1, pn=2" in generator.log_file.read_text()
+
+
+def test_given_up_pages_are_requeued_on_resume(new_generator):
+    generator = new_generator([1], counts={1: 150})
+    drain(generator)
+    for i in range(WorkerParamsGenerator.MAX_GIVE_UP_ATTEMPTS):
+        generator.give_up_page(1, 2)
+        generator.next()
+    state = generator.get_state()
+    resumed = new_generator([1])
+    resumed.load_state(state)
+    assert resumed.given_up_pages == []
+    assert list(resumed.queue)[-1] == (1, 2)
+
+
+def test_give_up_attempts_are_kept_on_resume(new_generator):
+    generator = new_generator([1], counts={1: 150})
+    drain(generator)
+    generator.give_up_page(1, 3)
+    state = json.loads(json.dumps(generator.get_state()))
+    resumed = new_generator([1])
+    resumed.load_state(state)
+    assert resumed.give_up_attempts == {(1, 3): 1}
+    assert set(resumed.queue) == {(1, 1), (1, 2), (1, 3)}
+
+
+def test_mark_saved_after_all_pages_completed(new_generator):
+    generator = new_generator([1], counts={1: 100})
+    generator.planner.record_pubdates(1, [{"pubdate": 1000}])
+    assert drain(generator) == [(1, 1), (1, 2)]
+    # tail page is flagged before its rows are written
+    generator.flag_current_region_exhausted(exhausted_tid=1, pn=2)
+    generator.complete_page(1, 2)
+    assert generator.planner.load_marks() == {}
+    generator.complete_page(1, 1)
+    assert generator.planner.load_marks() == {1: 1000}
+
+
+def test_mark_not_saved_for_region_with_given_up_page(new_generator):
+    generator = new_generator([1], counts={1: 150})
+    generator.planner.record_pubdates(1, [{"pubdate": 1000}])
+    drain(generator)
+    for i in range(WorkerParamsGenerator.MAX_GIVE_UP_ATTEMPTS):
+        generator.give_up_page(1, 2)
+        generator.next()
+    generator.flag_current_region_exhausted(exhausted_tid=1, pn=3)
+    generator.complete_page(1, 1)
+    generator.complete_page(1, 3)
+    assert generator.planner.load_marks() == {}
+
+
+def test_mark_not_saved_for_region_cut_by_end_pn(new_generator):
+    generator = new_generator([1], counts={1: 500})
+    generator.planner.set_end_pn(1, 2)
+    generator.planner.record_pubdates(1, [{"pubdate": 1000}])
+    assert drain(generator) == [(1, 1), (1, 2)]
+    generator.flag_current_region_exhausted(exhausted_tid=1, pn=2)
+    generator.complete_page(1, 1)
+    generator.complete_page(1, 2)
+    assert generator.planner.load_marks() == {}
@@ -4,6 +4,7 @@ import requests
 from datetime import datetime
 from tclogger import logger
 
+from transforms.dtypes import DataTyper
 from networks.constants import REQUESTS_HEADERS, GET_VIDEO_PAGE_API
 
 
@@ -113,21 +114,156 @@ class VideoInfoConverter:
 
     def __init__(self):
         self.rename_columns()
-        self.update_set_str = None
+        # cached sql queries, as they only depend on table and columns
+        self.sql_queries = {}
 
     def rename_columns(self):
         self.COLUMNS = {
             self.COLUMNS_RENAME_MAP.get(k, k): v for k, v in self.COLUMNS.items()
         }
 
-    def create_update_set_str(self, sql_row: dict, primary_key: str = "bvid"):
-        update_on_conflict_str = f" ON CONFLICT ({primary_key}) DO UPDATE SET "
-        update_set_columns = [k for k in sql_row.keys() if k != primary_key]
+    def get_sql_columns(self) -> list[str]:
+        """Column names of sql row, in the same order of values from `serialize_sql_row`."""
+        return [k for k in self.COLUMNS.keys() if k not in self.COLUMNS_TO_IGNORE]
+
+    def get_sql_column_types(self) -> dict[str, str]:
+        """sql column -> sql dtype, same as columns of table created by `setups`."""
+        typer = DataTyper()
+        origin_columns = {
+            self.COLUMNS_RENAME_MAP.get(k, k): k
+            for k in VideoInfoConverter.COLUMNS.keys()
+        }
+        column_types = {}
+        for k in self.get_sql_columns():
+            origin_k = origin_columns.get(k, k)
+            column_types[k] = self.COLUMNS_SQL_MAP.get(
+                origin_k, typer.py_dtype_to_sql_dtype(self.COLUMNS[k])
+            )
+        return column_types
+
+    def get_stats_columns(self) -> list[str]:
+        """Stats columns of sql row, used to refresh stats of existing videos."""
+        stats_columns = [
+            self.COLUMNS_RENAME_MAP.get(k, k) for k in self.STATS_COLUMNS.keys()
+        ]
+        return [k for k in self.get_sql_columns() if k in stats_columns]
+
+    def get_tracked_columns(self) -> list[str]:
+        """Columns compared on conflict, rows are only updated if any of them changed.
+        So `insert_at` alone would not rewrite an existing row."""
+        tracked_columns = [
+            *self.get_stats_columns(),
+            "title",
+            "description",
+            "pubdate",
+            "duration",
+            "video_parts",
+            "tid",
+            "tname",
+            "pic",
+            "name",
+        ]
+        return [k for k in self.get_sql_columns() if k in tracked_columns]
+
+    def create_update_set_str(
+        self,
+        columns: list[str],
+        primary_key: str = "bvid",
+        table_name: str = "videos",
+        compare_columns: list[str] = None,
+    ) -> str:
+        # composite primary key is comma-separated, e.g. "bvid, pubdate"
+        key_columns = [k.strip() for k in primary_key.split(",")]
+        update_set_columns = [k for k in columns if k not in key_columns]
         update_set_columns_str = ", ".join(
             [f"{k} = EXCLUDED.{k}" for k in update_set_columns]
         )
-        self.update_set_str = f"{update_on_conflict_str}{update_set_columns_str}"
-        return self.update_set_str
+        update_set_str = (
+            f"ON CONFLICT ({primary_key}) DO UPDATE SET {update_set_columns_str}"
+        )
+        if compare_columns:
+            stored_str = ", ".join([f"{table_name}.{k}" for k in compare_columns])
+            excluded_str = ", ".join([f"EXCLUDED.{k}" for k in compare_columns])
+            update_set_str = f"{update_set_str} WHERE ({stored_str}) IS DISTINCT FROM ({excluded_str})"
+        return update_set_str
+
+    def create_unnest_upsert_query(
+        self,
+        table_name: str = "videos",
+        primary_key: str = "bvid",
+        update_columns: list[str] = None,
+        compare_columns: list[str] = None,
+    ) -> str:
+        """Multi-row upsert, with one array parameter per column:
+
+            INSERT INTO videos (aid, bvid, ...)
+            SELECT * FROM unnest(%s::int8[], %s::text[], ...)
+            ON CONFLICT (bvid) DO UPDATE SET ...
+            RETURNING (xmax = 0)
+
+        Its text only depends on columns, not on number of rows,
+        so it could be prepared once per connection and re-used for every batch.
+        See `SQLOperator.exec_unnest_by_keys`.
+
+        `update_columns`: columns to update on conflict, e.g. `get_stats_columns()`.
+        Default is all columns.
+
+        `compare_columns`: only update conflicted rows if any of these columns changed,
+        e.g. `get_tracked_columns()`. Unchanged rows are not returned.
+
+        Keys of rows in one batch should be unique,
+        as `ON CONFLICT DO UPDATE` could not affect one row twice.
+        """
+        update_columns = update_columns or self.get_sql_columns()
+        compare_columns = compare_columns or []
+        cache_key = (
+            "unnest_upsert",
+            table_name,
+            primary_key,
+            tuple(update_columns),
+            tuple(compare_columns),
+        )
+        if cache_key not in self.sql_queries:
+            column_types = self.get_sql_column_types()
+            columns_str = ", ".join(column_types.keys())
+            arrays_str = ", ".join([f"%s::{v}[]" for v in column_types.values()])
+            update_set_str = self.create_update_set_str(
+                update_columns, primary_key, table_name, compare_columns
+            )
+            self.sql_queries[cache_key] = (
+                f"INSERT INTO {table_name} ({columns_str}) "
+                f"SELECT * FROM unnest({arrays_str}) {update_set_str} "
+                f"RETURNING (xmax = 0)"
+            )
+        return self.sql_queries[cache_key]
+
+    def create_unnest_update_query(
+        self,
+        columns: list[str],
+        table_name: str = "videos",
+        primary_key: str = "bvid",
+    ) -> str:
+        """Update only `columns` of existing rows, e.g. refresh stats:
+
+            UPDATE videos AS t SET view = u.view, ...
+            FROM unnest(%s::text[], %s::int8[], ...) AS u (bvid, view, ...)
+            WHERE t.bvid = u.bvid
+
+        Values of each row should be ordered as `[primary_key, *columns]`,
+        see `to_sql_values`.
+        """
+        cache_key = ("unnest_update", table_name, primary_key, tuple(columns))
+        if cache_key not in self.sql_queries:
+            column_types = self.get_sql_column_types()
+            columns = [primary_key, *[k for k in columns if k != primary_key]]
+            arrays_str = ", ".join([f"%s::{column_types[k]}[]" for k in columns])
+            set_str = ", ".join([f"{k} = u.{k}" for k in columns[1:]])
+            self.sql_queries[cache_key] = (
+                f"UPDATE {table_name} AS t SET {set_str} "
+                f"FROM unnest({arrays_str}) AS u ({', '.join(columns)}) "
+                f"WHERE t.{primary_key} = u.{primary_key}"
+            )
+        return self.sql_queries[cache_key]
 
     def flatten(self, video_info: dict):
         new_video_info = {}
@@ -199,6 +335,13 @@ class VideoInfoConverter:
         new_sql_values = tuple(new_sql_values)
         return new_sql_values
 
+    def to_sql_values(
+        self, sql_row: dict, columns: list[str], primary_key: str = "bvid"
+    ) -> tuple:
+        """Serialize only `[primary_key, *columns]` of sql row, for partial updates."""
+        columns = [primary_key, *[k for k in columns if k != primary_key]]
+        return self.serialize_sql_row({k: sql_row.get(k) for k in columns})
+
     def to_sql_query_and_values(
         self,
         video_info: dict,
@@ -213,21 +356,27 @@ class VideoInfoConverter:
         - https://www.psycopg.org/docs/usage.html#adapt-date
         """
         sql_row = self.to_sql_row(video_info)
-        values_placeholders = ", ".join(["%s"] * len(sql_row))
-
-        if not is_many:
-            sql_query = f"INSERT INTO {table_name} VALUES ({values_placeholders})"
-        else:
-            sql_query = f"INSERT INTO {table_name} VALUES %s"
-
-        if update_on_conflict:
-            if not self.update_set_str:
-                self.create_update_set_str(sql_row, primary_key)
-
-            sql_query = f"{sql_query} {self.update_set_str}"
+        cache_key = ("insert", table_name, is_many, update_on_conflict, primary_key)
+        if cache_key not in self.sql_queries:
+            columns = list(sql_row.keys())
+            columns_str = ", ".join(columns)
+            if not is_many:
+                values_placeholders = ", ".join(["%s"] * len(columns))
+                sql_query = (
+                    f"INSERT INTO {table_name} ({columns_str}) "
+                    f"VALUES ({values_placeholders})"
+                )
+            else:
+                sql_query = f"INSERT INTO {table_name} ({columns_str}) VALUES %s"
+            if update_on_conflict:
+                update_set_str = self.create_update_set_str(
+                    columns, primary_key, table_name
+                )
+                sql_query = f"{sql_query} {update_set_str}"
+            self.sql_queries[cache_key] = sql_query
 
         sql_values = self.serialize_sql_row(sql_row)
-        return sql_query, sql_values
+        return self.sql_queries[cache_key], sql_values
 
 
 if __name__ == "__main__":
@@ -0,0 +1,344 @@
+import asyncio
+
+import time
+
+from tclogger import logger
+
+from networks.async_sql import AsyncSQLOperator
+from networks.constants import GET_VIDEO_PAGE_API, REGION_INFOS
+from networks.transport import AsyncHTTPTransport, HTTP_TRANSPORT
+from workers.worker import Worker, VIDEOS_PRIMARY_KEY
+
+
+class AsyncWorker(Worker):
+    """Coroutine version of Worker, which shares the same generator -> get_page -> insert_rows loop.
+
+    All AsyncWorkers run on a single event loop (see AsyncWorkersEngine),
+    so thousands of pages could be in flight without one OS thread per worker.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.loop = None
+        self.event = None
+        self.async_sql = None
+
+    def bind(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        transport: AsyncHTTPTransport,
+        lock: asyncio.Lock,
+        async_sql: AsyncSQLOperator = None,
+    ):
+        self.loop = loop
+        self.transport = transport
+        self.lock = lock
+        self.async_sql = async_sql
+        self.event = asyncio.Event()
+        if self.active:
+            self.event.set()
+
+    async def async_get_proxy(self):
+        # LINK apps/proxy_app.py#get_proxy
+        try:
+            async with self.transport.session.get(
+                self.get_proxy_api, params={"holder": f"worker-{self.wid}"}
+            ) as res:
+                if res.status == 200:
+                    res_json = await res.json(content_type=None)
+                    proxy = res_json.get("server")
+                    lease_id = res_json.get("lease_id")
+                else:
+                    proxy = None
+        except Exception as e:
+            proxy = None
+
+        if proxy:
+            self.hold_lease(lease_id)
+            if not self.proxy:
+                logger.file(f"> New worker {self.wid} with proxy: [{proxy}]")
+            else:
+                logger.file(f"> Worker {self.wid} with new proxy: [{proxy}]")
+            self.activate()
+        else:
+            logger.warn(f"× Failed to create new worker: No usable proxy")
+            self.deactivate()
+
+        self.proxy = proxy
+
+    async def async_drop_proxy(self):
+        # LINK apps/proxy_app.py#drop_proxy
+        try:
+            async with self.transport.session.post(
+                self.drop_proxy_api, json={"server": self.proxy}
+            ) as res:
+                await res.read()
+        except Exception as e:
+            pass
+        self.rate_controllers.remove(self.proxy)
+        self.hold_lease(None)
+
+    async def async_switch_proxy(self):
+        await self.async_drop_proxy()
+        await self.async_get_proxy()
+
+    async def async_renew_expired_proxy(self):
+        if not self.proxy_feedback.pop_expired(self.lease_id):
+            return
+        logger.warn(f"× Lease expired of worker {self.wid}: [{self.proxy}]")
+        self.hold_lease(None)
+        await self.async_get_proxy()
+
+    # LINK workers/worker.py#get_page
+    async def async_get_page(self, tid: int, pn: int, ps: int = 50):
+        url = GET_VIDEO_PAGE_API
+        params = {"rid": tid, "pn": pn, "ps": ps}
+
+        retry_state = self.retry_policy.new_state()
+        while True:
+            rate_controller = self.rate_controllers.get(self.proxy)
+            await asyncio.sleep(rate_controller.reserve())
+            t1 = time.perf_counter()
+            try:
+                status, res_json = await self.transport.request_json(
+                    "GET",
+                    url,
+                    proxy=self.proxy,
+                    params=params,
+                    timeout=self.timeout,
+                    deadline=self.deadline,
+                )
+                outcome = self.retry_policy.classify(
+                    status_code=status, res_json=res_json
+                )
+            except Exception as e:
+                outcome = self.retry_policy.classify(exception=e)
+            latency = time.perf_counter() - t1
+
+            rate_controller.report(
+                is_success=outcome["category"] == "ok",
+                latency=latency if outcome["status_code"] else None,
+                status_code=outcome["status_code"],
+                code=outcome["code"],
+            )
+            self.proxy_feedback.record(
+                self.proxy,
+                latency=latency if outcome["status_code"] else None,
+                is_success=outcome["category"] == "ok",
+            )
+            decision = self.retry_policy.decide(outcome, retry_state)
+            if decision == "done":
+                return outcome["res_json"]
+            elif decision == "retry":
+                await asyncio.sleep(self.retry_policy.get_backoff_seconds(retry_state))
+            elif decision == "switch_proxy":
+                await self.async_switch_proxy()
+                if not self.proxy:
+                    decision = "requeue"
+                    break
+            else:
+                break
+
+        task_str = f"tid={tid}, pn={pn}"
+        res_json = self.retry_policy.get_failure_json(
+            outcome, decision=decision, state=retry_state, task_str=task_str
+        )
+        res_json["data"]["page"].update({"num": pn, "size": ps})
+        return res_json
+
+    async def async_insert_rows(
+        self,
+        archives: list,
+        current_count: int = -1,
+        total_count: int = -1,
+        tid: int = -1,
+        pn: int = -1,
+    ):
+        if self.async_sql and not (self.pipeline or self.write_buffer):
+            # write on the event loop, without blocking other workers
+            if self.stats_history:
+                await asyncio.to_thread(self.stats_history.add_archives, archives)
+            rows, aid_digests = self.get_rows_from_archives(archives)
+            if rows:
+                counts = await self.async_sql.copy_upsert_by_keys(
+                    "videos",
+                    self.converter.get_sql_columns(),
+                    [values for key, values in rows],
+                    keys=[key for key, values in rows],
+                    primary_key=VIDEOS_PRIMARY_KEY,
+                    compare_columns=self.converter.get_tracked_columns(),
+                )
+                if counts is None:
+                    self.on_page_write_failed(tid=tid, pn=pn)
+                    return
+                counts_str = self.async_sql.get_upsert_counts_str(counts)
+                logger.success(f"  + Inserted: {len(rows)} rows", end=" ")
+                logger.file(f"[{counts_str}]")
+            # might save mark of region, which writes file
+            await asyncio.to_thread(
+                self.on_page_written,
+                tid=tid,
+                pn=pn,
+                aid_digests=aid_digests,
+                current_count=current_count,
+                total_count=total_count,
+            )
+            return
+        # SQLOperator and pipeline.put_page are blocking, so run in the default executor
+        await asyncio.to_thread(
+            self.insert_rows,
+            archives,
+            current_count=current_count,
+            total_count=total_count,
+            tid=tid,
+            pn=pn,
+        )
+
+    async def async_resolve_network_error(
+        self, res_json: dict, tid: int, pn: int, task_str: str = ""
+    ):
+        res_code = res_json.get("code", -1)
+        logger.warn(f"  × BAD: {task_str} [code={res_code}]")
+        logger.warn(f"    {res_json.get('message', '')}")
+        if res_json.get("retry_decision") == "give_up":
+            # might flag region exhausted, which writes log and marks files
+            await asyncio.to_thread(
+                self.generator.give_up_page, tid, pn, task_str=task_str
+            )
+            return
+        if self.proxy:
+            await self.async_switch_proxy()
+        self.generator.append_queue(tid, pn)
+
+    def toggle_event(self, is_set: bool):
+        # activate/deactivate could be called from app threads, outside the loop
+        if not self.loop:
+            return
+        func = self.event.set if is_set else self.event.clear
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self.loop:
+            func()
+        else:
+            self.loop.call_soon_threadsafe(func)
+
+    def activate(self):
+        self.active = True
+        self.toggle_event(True)
+
+    def deactivate(self):
+        self.active = False
+        self.toggle_event(False)
+        logger.mesg(f"> Deactivate worker {self.wid}")
+
+    async def async_run(self):
+        if not self.proxy:
+            async with self.lock:
+                await self.async_get_proxy()
+
+        while True:
+            await self.event.wait()
+
+            if self.is_exited:
+                self.hold_lease(None)
+                logger.file(f"> Worker {self.wid} exited")
+                return
+
+            if self.generator.is_terminated():
+                self.deactivate()
+                logger.file("=" * 20 + f" [Terminated] ({self.wid: >2}) " + "=" * 20)
+                continue
+
+            self.proxy_feedback.touch(self.lease_id)
+            await self.async_renew_expired_proxy()
+            if not self.active:
+                continue
+
+            tid, pn = self.generator.next()
+            if tid == -1:
+                # active regions wait for probe or tail pages, or retries
+                await asyncio.sleep(self.interval)
+                continue
+
+            region_name = REGION_INFOS.get(tid, {}).get("region_name", "Unknown")
+            task_str = f"region={region_name}, tid={tid}, pn={pn}, wid={self.wid: >2}"
+            logger.note(f"> GET: {task_str}")
+
+            ps = 50
+            res_json = await self.async_get_page(tid=tid, pn=pn, ps=ps)
+            res_condition = self.response_categorizer.categorize(
+                res_json, tid=tid, pn=pn
+            )
+
+            if res_condition in ["normal", "end_of_region"]:
+                archives, current_count, total_count = self.get_archives_from_response(
+                    res_json=res_json, pn=pn, ps=ps, task_str=task_str
+                )
+                if res_condition == "end_of_region":
+                    await asyncio.to_thread(
+                        self.generator.flag_current_region_exhausted,
+                        exhausted_tid=tid,
+                        task_str=task_str,
+                        pn=pn,
+                    )
+                await self.async_insert_rows(
+                    archives,
+                    current_count=current_count,
+                    total_count=total_count,
+                    tid=tid,
+                    pn=pn,
+                )
+            elif res_condition == "network_error":
+                await self.async_resolve_network_error(
+                    res_json=res_json, tid=tid, pn=pn, task_str=task_str
+                )
+            else:
+                res_code = res_json.get("code", -1)
+                logger.warn(f"  ? Unknown condition: {task_str} [code={res_code}]")
+
+
+class AsyncWorkersEngine:
+    """Run AsyncWorkers as coroutines on one event loop with a shared AsyncHTTPTransport.
+
+    If `sql_pool_size` > 0, workers without pipeline or write buffer write rows
+    with a shared AsyncSQLOperator on the same loop, which spools rows to `spool`
+    while Postgres is down.
+    """
+
+    def __init__(self, max_connections: int = 1000, sql_pool_size: int = 0, spool=None):
+        self.max_connections = max_connections
+        self.sql_pool_size = sql_pool_size
+        self.spool = spool
+        self.loop = None
+
+    async def run_workers(self, workers: list[AsyncWorker]):
+        self.loop = asyncio.get_running_loop()
+        async_sql = None
+        if self.sql_pool_size > 0:
+            async_sql = AsyncSQLOperator(pool_size=self.sql_pool_size, spool=self.spool)
+            await async_sql.connect()
+        try:
+            async with AsyncHTTPTransport(
+                max_connections=self.max_connections, stats=HTTP_TRANSPORT.stats
+            ) as transport:
+                lock = asyncio.Lock()
+                for worker in workers:
+                    worker.bind(
+                        loop=self.loop,
+                        transport=transport,
+                        lock=lock,
+                        async_sql=async_sql,
+                    )
+                logger.note(
+                    f"> Running {len(workers)} async workers "
+                    f"(max_connections={self.max_connections})"
+                )
+                await asyncio.gather(*[worker.async_run() for worker in workers])
+        finally:
+            if async_sql:
+                await async_sql.close()
+
+    def run(self, workers: list[AsyncWorker]):
+        asyncio.run(self.run_workers(workers))
@@ -0,0 +1,81 @@
+import json
+import os
+import threading
+
+from datetime import datetime
+from pathlib import Path
+from tclogger import logger
+
+from workers.worker import WorkerParamsGenerator
+
+
+class GeneratorCheckpointer:
+    """Periodically persist WorkerParamsGenerator state to a local json file.
+
+    The file is written to a temp file and then renamed, so a crash during saving
+    would never leave a broken checkpoint.
+    """
+
+    def __init__(
+        self,
+        generator: WorkerParamsGenerator = None,
+        checkpoint_path: Path = None,
+        interval: float = 30,
+    ):
+        self.generator = generator
+        self.checkpoint_path = checkpoint_path or (
+            Path(__file__).parents[1] / "data" / "checkpoints" / "worker_generator.json"
+        )
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def save(self) -> dict:
+        if not self.generator:
+            return {}
+        state = self.generator.get_state()
+        state["saved_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.checkpoint_path.with_suffix(".json.tmp")
+        with open(temp_path, "w", encoding="utf-8") as wf:
+            json.dump(state, wf, ensure_ascii=False)
+        os.replace(temp_path, self.checkpoint_path)
+        return state
+
+    def load(self) -> dict:
+        if not self.checkpoint_path.exists():
+            logger.warn(f"× No checkpoint found: {self.checkpoint_path}")
+            return None
+        with open(self.checkpoint_path, "r", encoding="utf-8") as rf:
+            state = json.load(rf)
+        logger.note(f"> Load checkpoint saved at [{state.get('saved_at')}]:")
+        logger.file(f"  - {self.checkpoint_path}")
+        return state
+
+    def load_generator(self) -> WorkerParamsGenerator:
+        state = self.load()
+        if state is None:
+            return None
+        self.generator = WorkerParamsGenerator.from_state(state)
+        return self.generator
+
+    def save_loop(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.save()
+            except Exception as e:
+                logger.warn(f"× Failed to save checkpoint: {e}")
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.save_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        self.save()
@@ -0,0 +1,220 @@
+import queue
+import threading
+import time
+
+from collections import Counter
+from functools import partial
+from tclogger import logger
+
+from networks.sql_buffer import SQLWriteBuffer
+from transforms.video_row import VideoInfoConverter
+from workers.seen_aids import SEEN_AIDS
+
+
+class VideoRowsPipeline:
+    """Staged pipeline: fetchers -> [pages_queue] -> converters -> [rows_queue] -> writers.
+
+    Both queues are bounded, so when writers fall behind, converters block on `rows_queue`,
+    then fetchers block on `pages_queue` in `put_page`, instead of piling pages up in memory.
+    Writers move rows from all workers into SQLWriteBuffer, which flushes them in large
+    batches with grouped commits, and pages are completed after their rows are flushed.
+    Converters drop rows which are unchanged since last written (see SeenAidsIndex).
+    """
+
+    STOP = None
+
+    def __init__(
+        self,
+        write_buffer: SQLWriteBuffer,
+        generator=None,
+        converters_num: int = 2,
+        writers_num: int = 1,
+        pages_queue_size: int = 200,
+        rows_queue_size: int = 5000,
+        primary_key: str = "bvid",
+    ):
+        self.write_buffer = write_buffer
+        self.generator = generator
+        self.converters_num = converters_num
+        self.writers_num = writers_num
+        self.primary_key = primary_key
+        self.pages_queue = queue.Queue(maxsize=pages_queue_size)
+        self.rows_queue = queue.Queue(maxsize=rows_queue_size)
+        self.converter_threads = []
+        self.writer_threads = []
+        # (tid, pn) -> rows not written yet, pages are completed when all rows written
+        self.pending_pages = {}
+        self.seen_aids = SEEN_AIDS
+        self.lock = threading.Lock()
+        self.is_running = False
+        self.init_stats()
+
+    def init_stats(self):
+        self.put_pages_count = 0
+        self.blocked_seconds = 0.0
+        self.written_rows_count = 0
+
+    def start(self):
+        if self.is_running:
+            return
+        self.is_running = True
+        for i in range(self.converters_num):
+            thread = threading.Thread(target=self.convert_loop, daemon=True)
+            thread.start()
+            self.converter_threads.append(thread)
+        for i in range(self.writers_num):
+            thread = threading.Thread(target=self.write_loop, daemon=True)
+            thread.start()
+            self.writer_threads.append(thread)
+        logger.note(
+            f"> Pipeline started: "
+            f"{self.converters_num} converters, {self.writers_num} writers"
+        )
+
+    def put_page(
+        self,
+        archives: list,
+        tid: int = -1,
+        pn: int = -1,
+        current_count: int = -1,
+        total_count: int = -1,
+    ):
+        """Called by fetchers. Blocks when `pages_queue` is full (backpressure)."""
+        item = {
+            "tid": tid,
+            "pn": pn,
+            "archives": archives,
+            "current_count": current_count,
+            "total_count": total_count,
+        }
+        if archives:
+            with self.lock:
+                self.pending_pages[(tid, pn)] = len(archives)
+        elif self.generator:
+            self.generator.complete_page(tid, pn)
+        t1 = time.perf_counter()
+        self.pages_queue.put(item)
+        dt = time.perf_counter() - t1
+        with self.lock:
+            self.put_pages_count += 1
+            self.blocked_seconds += dt
+
+    def complete_rows(self, batch_pages: Counter) -> list:
+        completed_pages = []
+        with self.lock:
+            for page, rows_count in batch_pages.items():
+                # page is already requeued if any of its rows failed
+                if page not in self.pending_pages:
+                    continue
+                remain_count = self.pending_pages[page] - rows_count
+                if remain_count <= 0:
+                    self.pending_pages.pop(page, None)
+                    completed_pages.append(page)
+                else:
+                    self.pending_pages[page] = remain_count
+        if self.generator:
+            for tid, pn in completed_pages:
+                self.generator.complete_page(tid, pn)
+        return completed_pages
+
+    def convert_loop(self):
+        converter = VideoInfoConverter()
+        tracked_columns = converter.get_tracked_columns()
+        while True:
+            item = self.pages_queue.get()
+            if item is self.STOP:
+                self.pages_queue.task_done()
+                break
+            page = (item["tid"], item["pn"])
+            unchanged_count = 0
+            for archive in item["archives"]:
+                aid = archive.get("aid")
+                sql_row = converter.to_sql_row(archive)
+                digest = self.seen_aids.get_digest(sql_row, columns=tracked_columns)
+                if self.seen_aids.is_unchanged(aid, digest):
+                    unchanged_count += 1
+                    continue
+                sql_values = converter.serialize_sql_row(sql_row)
+                row = {
+                    "key": archive.get(self.primary_key),
+                    "aid": aid,
+                    "digest": digest,
+                    "page": page,
+                    "values": sql_values,
+                    "current_count": item["current_count"],
+                    "total_count": item["total_count"],
+                }
+                self.rows_queue.put(row)
+            if unchanged_count:
+                self.complete_rows(Counter({page: unchanged_count}))
+            self.pages_queue.task_done()
+
+    def on_row_written(self, row: dict):
+        self.seen_aids.add(row["aid"], row["digest"])
+        with self.lock:
+            self.written_rows_count += 1
+        completed_pages = self.complete_rows(Counter({row["page"]: 1}))
+        if self.generator:
+            self.generator.add_inserted_videos_num(1)
+            if completed_pages:
+                eta_str = self.generator.get_estimated_remaining_time_str(
+                    current_count=row["current_count"],
+                    total_count=row["total_count"],
+                )
+                tid, pn = row["page"]
+                logger.mesg(f"  + Written: tid={tid}, pn={pn} [ETA={eta_str}]")
+
+    def on_row_failed(self, row: dict):
+        """Requeue page of failed row, so the whole page is crawled and written again."""
+        with self.lock:
+            is_pending = self.pending_pages.pop(row["page"], None) is not None
+        if is_pending and self.generator:
+            tid, pn = row["page"]
+            logger.warn(f"  × Write failed, requeue: tid={tid}, pn={pn}")
+            self.generator.append_queue(tid, pn)
+
+    def write_loop(self):
+        while True:
+            row = self.rows_queue.get()
+            if row is self.STOP:
+                self.rows_queue.task_done()
+                break
+            self.write_buffer.add(
+                row["key"],
+                row["values"],
+                on_written=partial(self.on_row_written, row),
+                on_failed=partial(self.on_row_failed, row),
+            )
+            self.rows_queue.task_done()
+
+    def stop(self):
+        """Drain queues, flush remaining rows and stop all threads."""
+        if not self.is_running:
+            return
+        logger.note(f"> Stopping pipeline ...")
+        for thread in self.converter_threads:
+            self.pages_queue.put(self.STOP)
+        for thread in self.converter_threads:
+            thread.join()
+        for thread in self.writer_threads:
+            self.rows_queue.put(self.STOP)
+        for thread in self.writer_threads:
+            thread.join()
+        self.write_buffer.flush()
+        self.converter_threads = []
+        self.writer_threads = []
+        self.is_running = False
+        logger.success(f"+ Pipeline stopped: {self.written_rows_count} rows written")
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                "is_running": self.is_running,
+                "pages_queue": self.pages_queue.qsize(),
+                "rows_queue": self.rows_queue.qsize(),
+                "put_pages": self.put_pages_count,
+                "blocked_seconds": round(self.blocked_seconds, 3),
+                "written_rows": self.written_rows_count,
+                "pending_pages": len(self.pending_pages),
+                "seen_aids": self.seen_aids.get_stats(),
+            }
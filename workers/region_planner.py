@@ -0,0 +1,197 @@
+import json
+import os
+import threading
+
+from math import ceil
+from pathlib import Path
+from tclogger import logger
+
+
+class RegionPlanner:
+    """Per-region page plan, shared by generator and all workers.
+
+    Videos count of each region is seeded from regions_count.json (written by
+    `workers/scanner.py`), and overridden by `page.count` learned from responses.
+    So pns past the last page are never issued, and the end of region is verified
+    by the tail page itself, rather than by requesting empty pages.
+
+    In incremental mode, newlist pages are newest-first, so a region also ends at
+    the first page whose archives are all older than its `since_pubdate`.
+    """
+
+    def __init__(self, ps: int = 50, seed_path: Path = None, marks_path: Path = None):
+        self.ps = ps
+        region_root = Path(__file__).parents[1] / "data" / "region"
+        self.seed_path = seed_path or (region_root / "regions_count.json")
+        self.marks_path = marks_path or (region_root / "regions_pubdate_marks.json")
+        self.lock = threading.Lock()
+        # held across load, merge and write of marks file, so concurrent saves keep all marks
+        self.marks_lock = threading.Lock()
+        # tid -> videos count, learned from `page.count`
+        self.counts = {}
+        # tid -> max pn to issue, set by user
+        self.end_pns = {}
+        # tid -> videos count, from regions_count.json
+        self.seed_counts = self.load_seed_counts()
+        # tid -> pubdate timestamp, pages older than it are not crawled
+        self.since_pubdates = {}
+        # tid -> newest pubdate seen in responses, saved as high-water mark
+        self.newest_pubdates = {}
+
+    def load_seed_counts(self) -> dict:
+        if not self.seed_path.exists():
+            return {}
+        try:
+            with open(self.seed_path, "r", encoding="utf-8") as rf:
+                regions_dict = json.load(rf)
+        except Exception as e:
+            logger.warn(f"× Failed to load regions count: {e}")
+            return {}
+
+        seed_counts = {}
+        for parent_dict in regions_dict.values():
+            for region_dict in parent_dict.get("children", {}).values():
+                tid = region_dict.get("tid")
+                count = region_dict.get("videos_count")
+                if tid is not None and count is not None and count >= 0:
+                    seed_counts[tid] = count
+        return seed_counts
+
+    def update_count(self, tid: int, count: int):
+        if count < 0:
+            return
+        with self.lock:
+            self.counts[tid] = count
+
+    def set_end_pn(self, tid: int, end_pn: int):
+        with self.lock:
+            self.end_pns[tid] = end_pn
+
+    def get_count(self, tid: int) -> int:
+        """Learned count first, then seeded count. None if neither is known."""
+        with self.lock:
+            if tid in self.counts:
+                return self.counts[tid]
+            return self.seed_counts.get(tid)
+
+    def get_last_pn(self, tid: int) -> int:
+        count = self.get_count(tid)
+        with self.lock:
+            end_pn = self.end_pns.get(tid)
+        if count is None:
+            return end_pn
+        last_pn = max(ceil(count / self.ps), 1)
+        if end_pn is not None:
+            last_pn = min(last_pn, end_pn)
+        return last_pn
+
+    def can_issue(self, tid: int, pn: int, issued: int = 0) -> bool:
+        """Regions with unknown count only issue one probe page, until its response."""
+        if self.get_count(tid) is None:
+            return issued == 0
+        return pn <= self.get_last_pn(tid)
+
+    def is_cut_by_end_pn(self, tid: int, pn: int) -> bool:
+        """True if region ends at `pn` only by end pn set by user, before its last page."""
+        with self.lock:
+            end_pn = self.end_pns.get(tid)
+        if end_pn is None or pn < end_pn:
+            return False
+        count = self.get_count(tid)
+        return count is None or end_pn < max(ceil(count / self.ps), 1)
+
+    def is_tail(self, tid: int, pn: int) -> bool:
+        last_pn = self.get_last_pn(tid)
+        return last_pn is not None and pn >= last_pn
+
+    def record_pubdates(self, tid: int, archives: list):
+        pubdates = [archive.get("pubdate", 0) for archive in archives]
+        if not pubdates:
+            return
+        with self.lock:
+            self.newest_pubdates[tid] = max(
+                max(pubdates), self.newest_pubdates.get(tid, 0)
+            )
+
+    def is_older_than_since(self, tid: int, archives: list) -> bool:
+        with self.lock:
+            since_pubdate = self.since_pubdates.get(tid)
+        if since_pubdate is None or not archives:
+            return False
+        return all(archive.get("pubdate", 0) < since_pubdate for archive in archives)
+
+    def load_marks(self) -> dict:
+        """Stored high-water marks: tid -> newest pubdate of last finished crawl."""
+        if not self.marks_path.exists():
+            return {}
+        with open(self.marks_path, "r", encoding="utf-8") as rf:
+            return {int(k): v for k, v in json.load(rf).items()}
+
+    def save_mark(self, tid: int):
+        """Should be called once the region is finished, and all its pages are written,
+        see `WorkerParamsGenerator.save_mark_if_completed`."""
+        with self.lock:
+            newest_pubdate = self.newest_pubdates.get(tid)
+        if newest_pubdate is None:
+            return
+        with self.marks_lock:
+            marks = self.load_marks()
+            marks[tid] = max(newest_pubdate, marks.get(tid, 0))
+            self.marks_path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = self.marks_path.with_suffix(".json.tmp")
+            with open(temp_path, "w", encoding="utf-8") as wf:
+                json.dump(marks, wf, indent=4)
+            os.replace(temp_path, self.marks_path)
+
+    def get_sql_marks(self, sql, tids: list[int], table_name: str = "videos") -> dict:
+        """Newest pubdate of each tid in sql table. Index on (tid, pubdate) helps."""
+        query = (
+            f"SELECT tid, EXTRACT(EPOCH FROM MAX(pubdate))::bigint "
+            f"FROM {table_name} WHERE tid = ANY(%s) GROUP BY tid;"
+        )
+        rows = sql.exec(query, (list(tids),), is_fetchall=True) or []
+        return {tid: pubdate for tid, pubdate in rows if pubdate is not None}
+
+    def set_since_pubdates(
+        self, tids: list[int], sql=None, overlap_seconds: int = 21600
+    ) -> dict:
+        """Since pubdate = newest pubdate in sql (or stored mark) - overlap_seconds.
+
+        Regions without any mark are crawled fully.
+        """
+        with self.marks_lock:
+            marks = self.load_marks()
+        if sql:
+            marks.update(self.get_sql_marks(sql, tids))
+        with self.lock:
+            for tid in tids:
+                if tid in marks:
+                    self.since_pubdates[tid] = marks[tid] - overlap_seconds
+            since_pubdates = dict(self.since_pubdates)
+        logger.note(f"> Incremental mode: {len(since_pubdates)}/{len(tids)} regions")
+        return since_pubdates
+
+    def get_state(self) -> dict:
+        with self.lock:
+            return {
+                "counts": dict(self.counts),
+                "end_pns": dict(self.end_pns),
+                "since_pubdates": dict(self.since_pubdates),
+                "newest_pubdates": dict(self.newest_pubdates),
+            }
+
+    def load_state(
+        self,
+        counts: dict,
+        end_pns: dict,
+        since_pubdates: dict = {},
+        newest_pubdates: dict = {},
+    ):
+        def int_keys(d: dict) -> dict:
+            return {int(k): v for k, v in d.items()}
+
+        with self.lock:
+            self.counts = int_keys(counts)
+            self.end_pns = int_keys(end_pns)
+            self.since_pubdates = int_keys(since_pubdates)
+            self.newest_pubdates = int_keys(newest_pubdates)
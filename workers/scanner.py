@@ -9,12 +9,14 @@ from typing import Literal
 
 from configs.envs import PROXY_APP_ENVS
 from networks.constants import (
-    REQUESTS_HEADERS,
     GET_VIDEO_PAGE_API,
     REGION_CODES,
     REGION_GROUPS,
     REGION_INFOS,
 )
+from networks.proxy_feedback import PROXY_FEEDBACK
+from networks.retry import RetryPolicy
+from networks.transport import HTTP_TRANSPORT
 from transforms.regions import (
     get_region_tids_from_parent_codes,
     get_region_tids_from_groups,
@@ -29,7 +31,9 @@ class Scanner:
         self.drop_proxy_api = f"{self.proxy_endpoint}/drop_proxy"
         self.proxy = None
         self.retry_count = 10
+        self.retry_policy = RetryPolicy(budget=15, max_attempts=self.retry_count)
         self.timeout = 2.5
+        self.deadline = 5
         self.interval = 2
         self.tid_queue = []
         self.save_json_path = (
@@ -66,45 +70,49 @@ class Scanner:
 
     def get_page_of_tid(self, tid: int):
         # LINK workers/worker.py#get_page
-        proxy = self.proxy
-
-        if proxy:
-            proxies = {"http": f"http://{proxy}", "https": f"http://{proxy}"}
-        else:
-            proxies = None
-
         url = GET_VIDEO_PAGE_API
 
         params = {"rid": tid, "pn": 1, "ps": 1}
-        res_json = None
-        retry_count = 0
-        while retry_count < self.retry_count:
+        retry_state = self.retry_policy.new_state()
+        while True:
+            t1 = time.perf_counter()
             try:
-                res = requests.get(
+                res = HTTP_TRANSPORT.get(
                     url,
-                    headers=REQUESTS_HEADERS,
+                    proxy=self.proxy,
                     params=params,
-                    proxies=proxies,
                     timeout=self.timeout,
+                    deadline=self.deadline,
+                )
+                status_code = res.status_code
+                res_json = res.json() if status_code == 200 else None
+                outcome = self.retry_policy.classify(
+                    status_code=status_code, res_json=res_json
                 )
-                if res.status_code == 200:
-                    res_json = res.json()
-                    break
-                else:
-                    retry_count += 1
             except Exception as e:
-                retry_count += 1
-
-        if not res_json:
-            res_json = {
-                "code": -1,
-                "message": f"Failed to get page after {self.retry_count} retries: tid={tid}",
-                "data": {
-                    "archives": [],
-                    "page": {"count": -1, "num": 1, "size": 1},
-                },
-            }
+                outcome = self.retry_policy.classify(exception=e)
+            latency = time.perf_counter() - t1
+            PROXY_FEEDBACK.record(
+                self.proxy,
+                latency=latency if outcome["status_code"] else None,
+                is_success=outcome["category"] == "ok",
+            )
+
+            decision = self.retry_policy.decide(outcome, retry_state)
+            if decision == "done":
+                return outcome["res_json"]
+            elif decision == "retry":
+                time.sleep(self.retry_policy.get_backoff_seconds(retry_state))
+            elif decision == "switch_proxy":
+                self.drop_proxy()
+                self.get_proxy()
+            else:
+                break
 
+        res_json = self.retry_policy.get_failure_json(
+            outcome, decision=decision, state=retry_state, task_str=f"tid={tid}"
+        )
+        res_json["data"]["page"].update({"num": 1, "size": 1})
         return res_json
 
     def categorize_response(self, res_dict: dict) -> Literal["network_error", "normal"]:
@@ -118,6 +126,8 @@ class Scanner:
         res_code = res_json.get("code", -1)
         logger.warn(f"  × BAD: {task_str} [code={res_code}]")
         logger.warn(f"    {res_json.get('message', '')}")
+        if res_json.get("retry_decision") == "give_up":
+            return
         self.drop_proxy()
         self.get_proxy()
         self.tid_queue.insert(0, tid)
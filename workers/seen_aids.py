@@ -0,0 +1,107 @@
+import numpy as np
+import threading
+import zlib
+
+
+class SeenAidsIndex:
+    """In-process index of recently written aids, with a crc32 digest of each row.
+
+    Rows whose aid was already written with the same digest are unchanged,
+    so they could be dropped before reaching SQLOperator, saving WAL and index churn
+    of `ON CONFLICT DO UPDATE`.
+
+    Index is sharded by aid to reduce lock contention.
+    Each shard is a direct-mapped table of fixed-width numpy arrays
+    (int64 aid + uint32 digest, 12 bytes per slot), so 1M aids take ~12 MB,
+    instead of ~100 MB of dicts. An aid overwrites the slot it hashes to,
+    so colliding aids evict each other, which only costs a rewrite of the row.
+    """
+
+    EMPTY = -1
+    # Fibonacci hashing, so consecutive aids spread over slots
+    HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+
+    def __init__(self, capacity: int = 1000000, shards_num: int = 64):
+        self.capacity = capacity
+        self.shards_num = shards_num
+        self.shard_capacity = max(capacity // shards_num, 1)
+        self.shard_aids = [
+            np.full(self.shard_capacity, self.EMPTY, dtype=np.int64)
+            for _ in range(shards_num)
+        ]
+        self.shard_digests = [
+            np.zeros(self.shard_capacity, dtype=np.uint32) for _ in range(shards_num)
+        ]
+        self.locks = [threading.Lock() for _ in range(shards_num)]
+        self.sizes = [0] * shards_num
+        self.skipped_counts = [0] * shards_num
+
+    def get_shard_idx(self, aid: int) -> int:
+        return aid % self.shards_num
+
+    def get_slot_idx(self, aid: int) -> int:
+        hashed = ((aid // self.shards_num) * self.HASH_MULTIPLIER) & 0xFFFFFFFFFFFFFFFF
+        return (hashed >> 32) % self.shard_capacity
+
+    def get_digest(self, row: dict, columns: list[str] = None) -> int:
+        """crc32 of values of `columns` in row (all keys if None).
+        Columns not compared on conflict (e.g. `insert_at`) should be excluded."""
+        if columns is None:
+            columns = sorted(row.keys())
+        row_str = repr([row.get(column) for column in columns])
+        return zlib.crc32(row_str.encode("utf-8"))
+
+    def is_unchanged(self, aid: int, digest: int) -> bool:
+        if aid is None:
+            return False
+        idx = self.get_shard_idx(aid)
+        slot_idx = self.get_slot_idx(aid)
+        with self.locks[idx]:
+            is_unchanged = (
+                self.shard_aids[idx][slot_idx] == aid
+                and self.shard_digests[idx][slot_idx] == digest
+            )
+            if is_unchanged:
+                self.skipped_counts[idx] += 1
+        return bool(is_unchanged)
+
+    def add(self, aid: int, digest: int):
+        """Should be called after the row is written."""
+        if aid is None:
+            return
+        idx = self.get_shard_idx(aid)
+        slot_idx = self.get_slot_idx(aid)
+        with self.locks[idx]:
+            if self.shard_aids[idx][slot_idx] == self.EMPTY:
+                self.sizes[idx] += 1
+            self.shard_aids[idx][slot_idx] = aid
+            self.shard_digests[idx][slot_idx] = digest
+
+    def add_many(self, aid_digests: list[tuple[int, int]]):
+        for aid, digest in aid_digests:
+            self.add(aid, digest)
+
+    def clear(self):
+        for idx in range(self.shards_num):
+            with self.locks[idx]:
+                self.shard_aids[idx].fill(self.EMPTY)
+                self.shard_digests[idx].fill(0)
+                self.sizes[idx] = 0
+
+    def get_stats(self) -> dict:
+        size = 0
+        skipped_count = 0
+        for idx in range(self.shards_num):
+            with self.locks[idx]:
+                size += self.sizes[idx]
+                skipped_count += self.skipped_counts[idx]
+        return {
+            "size": size,
+            "capacity": self.capacity,
+            "skipped_unchanged": skipped_count,
+        }
+
+
+SEEN_AIDS = SeenAidsIndex()
+# digests of stats only, see `VideoStatsHistory`
+SEEN_STATS = SeenAidsIndex()
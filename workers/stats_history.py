@@ -0,0 +1,137 @@
+from datetime import datetime, timedelta
+from functools import partial
+from tclogger import logger
+
+from networks.sql import SQLOperator
+from networks.sql_buffer import SQLWriteBuffer
+from workers.seen_aids import SEEN_STATS, SeenAidsIndex
+
+
+class VideoStatsHistory:
+    """Append-only history of video stats, fed by workers with archives of each page.
+
+    Each row is `(aid, crawl_at, view, danmaku, ...)`, written into `video_stats_history`,
+    which is partitioned by month of `crawl_at` (see `setups/create_stats_history_table.py`).
+    A row is only written when stats of the aid changed since last written (by `SEEN_STATS`).
+    Rows are buffered by SQLWriteBuffer (`write_method="append"`), merged by aid in a flush.
+
+    `rollup` downsamples raw rows of old months into `video_stats_daily`,
+    which keeps the last stats of each aid per day, and drops raw partitions.
+    """
+
+    TABLE_NAME = "video_stats_history"
+    DAILY_TABLE_NAME = "video_stats_daily"
+    # key in `stat` of archive -> column
+    STATS_KEYS = {
+        "view": "view",
+        "danmaku": "danmaku",
+        "reply": "reply",
+        "favorite": "favorite",
+        "coin": "coin",
+        "share": "share",
+        "like": "thumb_up",
+    }
+    STATS_COLUMNS = list(STATS_KEYS.values())
+    COLUMNS = ["aid", "crawl_at", *STATS_COLUMNS]
+
+    def __init__(
+        self,
+        write_buffer: SQLWriteBuffer = None,
+        seen_stats: SeenAidsIndex = SEEN_STATS,
+    ):
+        self.write_buffer = write_buffer
+        self.seen_stats = seen_stats
+
+    def get_rows_from_archives(self, archives: list) -> tuple[list, list]:
+        """Returns rows [(aid, values)] with changed stats, and [(aid, digest)]."""
+        crawl_at = datetime.now().astimezone()
+        rows = []
+        aid_digests = []
+        for archive in archives:
+            aid = archive.get("aid")
+            stat = archive.get("stat")
+            if aid is None or not stat:
+                continue
+            stats = {k: stat.get(k) for k in self.STATS_KEYS.keys()}
+            digest = self.seen_stats.get_digest(stats)
+            if self.seen_stats.is_unchanged(aid, digest):
+                continue
+            rows.append((aid, (aid, crawl_at, *stats.values())))
+            aid_digests.append((aid, digest))
+        return rows, aid_digests
+
+    def add_archives(self, archives: list):
+        rows, aid_digests = self.get_rows_from_archives(archives)
+        if not rows:
+            return
+        self.write_buffer.add_many(
+            rows, on_written=partial(self.seen_stats.add_many, aid_digests)
+        )
+
+    def get_partitions(self, sql: SQLOperator) -> list[str]:
+        query = (
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = %s;"
+        )
+        rows = sql.exec(query, (self.TABLE_NAME,), is_fetchall=True) or []
+        return sorted(row[0] for row in rows)
+
+    def create_rollup_query(self, partition: str) -> str:
+        stats_str = ", ".join(self.STATS_COLUMNS)
+        update_set_str = ", ".join([f"{k} = EXCLUDED.{k}" for k in self.STATS_COLUMNS])
+        # insert and drop in one transaction, so partition is dropped only if rolled up
+        return (
+            f"INSERT INTO {self.DAILY_TABLE_NAME} (aid, day, {stats_str}) "
+            f"SELECT DISTINCT ON (aid, crawl_at::date) aid, crawl_at::date, {stats_str} "
+            f"FROM {partition} ORDER BY aid, crawl_at::date, crawl_at DESC "
+            f"ON CONFLICT (aid, day) DO UPDATE SET {update_set_str}; "
+            f"DROP TABLE {partition};"
+        )
+
+    def rollup_partition(self, sql: SQLOperator, partition: str) -> bool:
+        """Run rollup query on a dedicated connection, which raises on errors.
+        Returns True only if the transaction is committed."""
+        query = self.create_rollup_query(partition)
+        conn = sql.create_connection()
+        try:
+            with conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(query)
+            return True
+        except Exception as e:
+            sql.log_error(query, e=e)
+            return False
+        finally:
+            conn.close()
+
+    def rollup(self, sql: SQLOperator, keep_raw_days: int = 90) -> list[str]:
+        """Roll up month partitions which ended before `keep_raw_days` ago.
+        Default partition is not rolled up. Returns rolled up partitions."""
+        cutoff_month = (datetime.now() - timedelta(days=keep_raw_days)).strftime("%Y%m")
+        rolled_partitions = []
+        for partition in self.get_partitions(sql):
+            month_str = partition.rsplit("_p", 1)[-1]
+            if not month_str.isdigit() or month_str >= cutoff_month:
+                continue
+            logger.note(f"> Rolling up: {partition} -> {self.DAILY_TABLE_NAME}")
+            if self.rollup_partition(sql, partition):
+                rolled_partitions.append(partition)
+            else:
+                logger.warn(f"× Failed to roll up: {partition}, kept raw rows")
+        logger.success(f"+ Rolled up {len(rolled_partitions)} partitions")
+        return rolled_partitions
+
+
+if __name__ == "__main__":
+    from configs.envs import WORKER_APP_ENVS
+    from setups.create_stats_history_table import create_stats_history_partitions
+
+    # run daily: add partitions ahead, and roll up old partitions
+    create_stats_history_partitions()
+    sql = SQLOperator()
+    keep_raw_days = WORKER_APP_ENVS.get("stats_history", {}).get("keep_raw_days", 90)
+    VideoStatsHistory().rollup(sql, keep_raw_days=keep_raw_days)
+
+    # python -m workers.stats_history
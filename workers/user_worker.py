@@ -12,6 +12,7 @@ from termcolor import colored
 from tqdm import tqdm
 
 from configs.envs import LOG_ENVS, COOKIES, BILI_DATA_ROOT
+from networks.transport import HTTP_TRANSPORT
 from networks.wbi import ParamsWBISigner
 from workers.video_downloader import VideoDownloader
 from workers.video_details_fetcher import VideoDetailsFetcher
@@ -27,6 +28,7 @@ class UserWorker:
         self.video_pages_json = self.save_root / "video_pages.json"
         self.video_details_josn = self.save_root / "video_details.json"
         self.video_page_request_interval = 0.5
+        self.video_page_request_timeout = 10
 
     def get_json_filename(self, pn: int = 1, ps: int = 30):
         return f"videos_pn_{pn}_ps_{ps}.json"
@@ -70,7 +72,12 @@ class UserWorker:
 
         res_dict = None
         try:
-            res = requests.get(self.url, headers=headers, params=signed_params)
+            res = HTTP_TRANSPORT.get(
+                self.url,
+                headers=headers,
+                params=signed_params,
+                timeout=self.video_page_request_timeout,
+            )
             res_dict = res.json()
             if save_json:
                 logger.note(f"> Save videos info to json: {video_params_str}")
@@ -1,11 +1,15 @@
 import json
 import requests
+import time
 
 from tclogger import logger
 
 from configs.envs import PROXY_VIEW_APP_ENVS, COOKIES, BILI_DATA_ROOT
 from networks.wbi import ParamsWBISigner
 from networks.constants import REQUESTS_HEADERS
+from networks.proxy_feedback import PROXY_VIEW_FEEDBACK
+from networks.retry import RetryPolicy
+from networks.transport import HTTP_TRANSPORT
 from transforms.times import get_now_ts_str
 
 
@@ -14,7 +18,7 @@ class VideoDetailsFetcher:
 
     def __init__(self):
         self.api = "https://api.bilibili.com/x/web-interface/view"
-        self.headers = REQUESTS_HEADERS
+        self.headers = REQUESTS_HEADERS.copy()
         self.headers["Cookie"] = COOKIES
 
         self.proxy_endpoint = f"http://127.0.0.1:{PROXY_VIEW_APP_ENVS['port']}"
@@ -25,9 +29,12 @@ class VideoDetailsFetcher:
         self.proxy = None
         self.is_proxy_usable = False
 
-        self.retry_interval = 0.5
         self.retry_count = 5
         self.requests_timeout = 1
+        self.requests_deadline = 3
+        self.retry_policy = RetryPolicy(
+            budget=self.requests_deadline * 2, max_attempts=self.retry_count
+        )
 
     def get_proxy(self):
         # LINK apps/proxy_app.py#get_proxy
@@ -50,13 +57,6 @@ class VideoDetailsFetcher:
             logger.warn(f"  × Failed to get proxy when fetch video: [{self.bvid}]")
 
         self.proxy = proxy
-        if self.proxy:
-            self.requests_proxies = {
-                "http": f"http://{self.proxy}",
-                "https": f"http://{self.proxy}",
-            }
-        else:
-            self.requests_proxies = None
 
     def drop_proxy(self):
         # LINK apps/proxy_app.py#drop_proxy
@@ -65,7 +65,6 @@ class VideoDetailsFetcher:
         except Exception as e:
             pass
         self.proxy = None
-        self.requests_proxies = None
 
     def restore_proxy(self):
         # LINK apps/proxy_app.py#restore_proxy
@@ -74,7 +73,6 @@ class VideoDetailsFetcher:
         except Exception as e:
             pass
         self.proxy = None
-        self.requests_proxies = None
 
     def create_save_path(self):
         self.save_path = (
@@ -156,37 +154,57 @@ class VideoDetailsFetcher:
 
         params = {"bvid": self.bvid}
 
+        res = None
         is_completed = False
         while not is_completed:
-            retry_count = 0
             if not self.proxy or not self.is_proxy_usable:
                 self.get_proxy()
-            while retry_count < self.retry_count:
+            retry_state = self.retry_policy.new_state()
+            while True:
+                t1 = time.perf_counter()
                 try:
-                    res = requests.get(
+                    res = HTTP_TRANSPORT.get(
                         self.api,
+                        proxy=self.proxy,
                         params=params,
-                        headers=REQUESTS_HEADERS,
-                        proxies=self.requests_proxies,
+                        headers=self.headers,
                         timeout=self.requests_timeout,
+                        deadline=self.requests_deadline,
+                    )
+                    status_code = res.status_code
+                    res_json = res.json() if status_code == 200 else None
+                    outcome = self.retry_policy.classify(
+                        status_code=status_code, res_json=res_json
                     )
-                    retry_count = 0
-                    is_completed = True
-
-                    break
                 except Exception as e:
-                    retry_count += 1
+                    outcome = self.retry_policy.classify(exception=e)
+                latency = time.perf_counter() - t1
+                PROXY_VIEW_FEEDBACK.record(
+                    self.proxy,
+                    latency=latency if outcome["status_code"] else None,
+                    is_success=outcome["category"] == "ok",
+                )
+                decision = self.retry_policy.decide(outcome, retry_state)
+                if decision == "retry":
+                    time.sleep(self.retry_policy.get_backoff_seconds(retry_state))
+                else:
+                    break
 
-            if not is_completed:
-                self.drop_proxy()
-                self.is_proxy_usable = False
-            else:
+            if decision in ["done", "give_up"]:
+                is_completed = True
+                if decision == "give_up":
+                    logger.warn(f"  × Video not available: [{self.bvid}]")
+                    logger.warn(f"    {outcome['message']}")
+                    res = None
                 if restore_proxy_after_fetch:
                     self.restore_proxy()
                     self.is_proxy_usable = False
                 else:
                     self.is_proxy_usable = True
-                break
+            else:
+                # switch_proxy or requeue: retry with another proxy
+                self.drop_proxy()
+                self.is_proxy_usable = False
 
         self.save_result(res, mid=mid)
 
@@ -1,24 +1,55 @@
+import itertools
 import requests
 import threading
 import time
 
+from collections import deque
 from datetime import datetime, timedelta
+from functools import partial
+from math import ceil
 from pathlib import Path
-from tclogger import logger, Runtimer
+from tclogger import logger
 from typing import Literal
 
-from configs.envs import PROXY_APP_ENVS, LOG_ENVS
-from networks.constants import REQUESTS_HEADERS, GET_VIDEO_PAGE_API, REGION_CODES
+from configs.envs import PROXY_APP_ENVS, LOG_ENVS, WORKER_APP_ENVS
+from networks.constants import GET_VIDEO_PAGE_API, REGION_CODES
+from networks.proxy_feedback import PROXY_FEEDBACK
+from networks.rate_control import RATE_CONTROLLERS
+from networks.retry import RetryPolicy
 from networks.sql import SQLOperator
+from networks.sql_buffer import SQLWriteBuffer
+from networks.transport import HTTP_TRANSPORT
 from transforms.video_row import VideoInfoConverter
+from workers.region_planner import RegionPlanner
+from workers.seen_aids import SEEN_AIDS
 from transforms.regions import (
     get_region_tids_from_parent_codes,
     get_region_tids_from_groups,
 )
 from networks.constants import REGION_INFOS
 
+# "bvid, pubdate" for partitioned videos table, see `setups/create_videos_table.py`
+VIDEOS_PRIMARY_KEY = WORKER_APP_ENVS.get("videos_primary_key", "bvid")
+
 
 class WorkerParamsGenerator:
+    """Generate (tid, pn) params for workers.
+
+    Several regions are crawled at once, and each region gets pages in proportion
+    to its weight (pages count from `page.count`), by stride scheduling:
+    the active region with the smallest `issued_pages / weight` is picked next.
+    So small regions do not finish with most workers firing past their ends,
+    and total crawl time follows the aggregate throughput of all regions.
+
+    Page counts and last pns of regions are planned by RegionPlanner.
+
+    Probe and tail pages decide the end of region, so if they are given up,
+    they are requeued up to `MAX_GIVE_UP_ATTEMPTS` times,
+    then the region is flagged exhausted, so the crawl always terminates.
+    """
+
+    MAX_GIVE_UP_ATTEMPTS = 3
+
     def __init__(
         self,
         region_groups: list[str] = [],
@@ -29,6 +60,8 @@ class WorkerParamsGenerator:
         end_tid: int = -1,
         end_pn: int = -1,
         log_mids: list[int] = [],
+        max_active_regions: int = 16,
+        ps: int = 50,
     ):
         self.lock = threading.Lock()
         self.region_groups = region_groups
@@ -39,14 +72,28 @@ class WorkerParamsGenerator:
         self.end_tid = end_tid
         self.end_pn = end_pn
         self.log_mids = log_mids
+        self.max_active_regions = max_active_regions
+        self.ps = ps
         self.log_file = Path(__file__).parents[1] / "logs" / LOG_ENVS["worker"]
         self.inserted_videos_num = 0
         self.start_time = datetime.now()
+        self.planner = RegionPlanner(ps=ps)
         self.init_tids()
 
     def init_tids(self):
-        self.queue = []
+        # retry lane for failed pages, which are served before new pages
+        self.queue = deque()
+        # pages issued by `next()`, but not completed or requeued yet
+        self.inflight = set()
+        # (tid, pn) -> give up times of probe and tail pages
+        self.give_up_attempts = {}
+        # (tid, pn) of non-tail pages given up, requeued on resume
+        self.given_up_pages = []
         self.exhausted_tids = []
+        # finished regions, whose marks are saved once all their pages are completed
+        self.mark_pending_tids = set()
+        # regions with given up pages, whose marks are never saved
+        self.unmarked_tids = set()
 
         if self.region_tids:
             self.tids = self.region_tids
@@ -61,39 +108,84 @@ class WorkerParamsGenerator:
         logger.success(self.tids)
 
         if self.start_tid != -1 and self.start_tid in self.tids:
-            self.tid_idx = self.tids.index(self.start_tid)
+            start_tid_idx = self.tids.index(self.start_tid)
         else:
-            self.tid_idx = 0
-        if self.start_pn != -1:
-            self.pn = self.start_pn
-        else:
-            self.pn = 0
-        self.tid = self.get_tid()
-
+            start_tid_idx = 0
         if self.end_tid in self.tids:
-            self.end_tid_idx = self.tids.index(self.end_tid)
-        else:
-            self.end_tid_idx = len(self.tids)
-
-        self.queue.append((self.tid, self.pn))
-        self.is_current_region_exhausted = False
-        logger.note(f"> Start: tid={self.tid}, pn={self.pn}")
-
-    def get_tid(self):
-        if self.tid_idx < len(self.tids):
-            return self.tids[self.tid_idx]
+            end_tid_idx = self.tids.index(self.end_tid)
         else:
-            return -1
+            end_tid_idx = len(self.tids) - 1
+
+        # tids waiting to be activated
+        self.pending_tids = deque(self.tids[start_tid_idx : end_tid_idx + 1])
+        # tid -> last issued pn, for active regions
+        self.region_pns = {}
+        # tid -> issued pages count, for stride scheduling
+        self.region_issued = {}
+
+        if self.pending_tids and self.start_pn != -1:
+            self.region_pns[self.pending_tids[0]] = self.start_pn - 1
+        if self.end_tid in self.tids and self.end_pn != -1:
+            self.planner.set_end_pn(self.end_tid, self.end_pn)
+
+        self.activate_regions()
+        logger.note(f"> Start: tids={list(self.region_issued.keys())}")
+
+    def activate_regions(self):
+        """Fill active regions from pending tids. Should be called with lock held."""
+        while self.pending_tids and len(self.region_issued) < self.max_active_regions:
+            tid = self.pending_tids.popleft()
+            self.region_pns.setdefault(tid, 0)
+            self.region_issued[tid] = 0
+
+    def deactivate_region(self, tid: int):
+        """Should be called with lock held."""
+        self.region_issued.pop(tid, None)
+        self.region_pns.pop(tid, None)
+        self.activate_regions()
+
+    def get_region_weight(self, tid: int) -> float:
+        """Weight is pages count of region. Unknown regions use mean weight of known ones."""
+        count = self.planner.get_count(tid)
+        if count is not None:
+            return max(ceil(count / self.ps), 1)
+        known_weights = []
+        for t in self.region_issued:
+            count = self.planner.get_count(t)
+            if count is not None:
+                known_weights.append(max(ceil(count / self.ps), 1))
+        if known_weights:
+            return sum(known_weights) / len(known_weights)
+        return 1
+
+    def pick_region(self) -> int:
+        """Should be called with lock held.
+
+        Regions with all pages issued are skipped, until their tail pages are verified.
+        """
+        best_tid = -1
+        best_pass = None
+        for tid, issued in self.region_issued.items():
+            if not self.planner.can_issue(tid, self.region_pns[tid] + 1, issued):
+                continue
+            region_pass = issued / self.get_region_weight(tid)
+            if best_pass is None or region_pass < best_pass:
+                best_tid = tid
+                best_pass = region_pass
+        return best_tid
 
     def log_to_file(
         self,
         log_type: Literal["end_of_region", "others"] = "end_of_region",
         log_str: str = "",
+        tid: int = -1,
+        pn: int = -1,
     ):
+        """Do not call this with lock held, as it writes file."""
         time_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         if log_type == "end_of_region":
-            region_name = REGION_INFOS.get(self.tid, {}).get("region_name", "Unknown")
-            log_str = f"× [{time_str}] [End of Region]: region={region_name}, tid={self.tid}, pn={self.pn}"
+            region_name = REGION_INFOS.get(tid, {}).get("region_name", "Unknown")
+            log_str = f"× [{time_str}] [End of Region]: region={region_name}, tid={tid}, pn={pn}"
         else:
             log_str = f"? [{time_str}] {log_str}"
         with open(self.log_file, "a") as f:
@@ -122,73 +214,225 @@ class WorkerParamsGenerator:
         estimated_remaining_time_str = f"{hours:02}:{minutes:02}:{seconds:02}"
         return estimated_remaining_time_str
 
-    def flag_current_region_exhausted(self, exhausted_tid: int, task_str: str = ""):
+    def flag_current_region_exhausted(
+        self,
+        exhausted_tid: int,
+        task_str: str = "",
+        pn: int = -1,
+        is_finished: bool = True,
+    ):
+        """`is_finished` is False if region is given up, then its mark is not saved.
+
+        Mark of finished region is saved once all its pages are completed,
+        as the tail page is flagged before its rows are written.
+        """
+        is_finished = is_finished and not self.planner.is_cut_by_end_pn(
+            exhausted_tid, pn
+        )
+        with self.lock:
+            if exhausted_tid in self.exhausted_tids:
+                return
+            self.exhausted_tids.append(exhausted_tid)
+            self.deactivate_region(exhausted_tid)
+            if is_finished and exhausted_tid not in self.unmarked_tids:
+                self.mark_pending_tids.add(exhausted_tid)
+        logger.mesg(f"  ! End: {task_str}")
+        self.log_to_file(log_type="end_of_region", tid=exhausted_tid, pn=pn)
+        self.save_mark_if_completed(exhausted_tid)
+
+    def save_mark_if_completed(self, tid: int):
         with self.lock:
-            if exhausted_tid not in self.exhausted_tids:
-                logger.mesg(f"  ! End: {task_str}")
-                self.exhausted_tids.append(exhausted_tid)
-                self.is_current_region_exhausted = True
-                self.log_to_file(log_type="end_of_region")
+            if tid not in self.mark_pending_tids:
+                return
+            pages = itertools.chain(self.inflight, self.queue)
+            if any(page_tid == tid for page_tid, page_pn in pages):
+                return
+            self.mark_pending_tids.discard(tid)
+        self.planner.save_mark(tid)
 
     def is_terminated(self):
         with self.lock:
-            if self.queue:
-                return False
-            if self.tid == -1 and self.pn == -1:
-                return True
-            if self.tid_idx >= self.end_tid_idx and self.pn >= self.end_pn:
-                return True
-            return False
+            return not (self.queue or self.region_issued or self.pending_tids)
 
     def append_queue(self, tid: int, pn: int):
         with self.lock:
+            self.inflight.discard((tid, pn))
             self.queue.append((tid, pn))
 
+    def complete_page(self, tid: int, pn: int):
+        """Called when rows of the page are written, or the page is end of region."""
+        with self.lock:
+            self.inflight.discard((tid, pn))
+        self.save_mark_if_completed(tid)
+
+    def give_up_page(self, tid: int, pn: int, task_str: str = ""):
+        """Called when the page failed permanently (`retry_decision` is give_up).
+
+        Page is requeued until it is given up `MAX_GIVE_UP_ATTEMPTS` times.
+        Then probe or tail page flags its region exhausted, and other pages are
+        recorded in `given_up_pages`, which are saved in checkpoint and requeued on resume.
+        """
+        is_probe = self.planner.get_count(tid) is None
+        is_tail = self.planner.is_tail(tid, pn)
+        with self.lock:
+            self.inflight.discard((tid, pn))
+            attempts = self.give_up_attempts.get((tid, pn), 0) + 1
+            self.give_up_attempts[(tid, pn)] = attempts
+            if attempts < self.MAX_GIVE_UP_ATTEMPTS:
+                self.queue.append((tid, pn))
+                return
+            if not (is_probe or is_tail):
+                self.given_up_pages.append((tid, pn))
+            # rows of given up page are missing, so mark of region is not saved
+            self.unmarked_tids.add(tid)
+            self.mark_pending_tids.discard(tid)
+        if is_probe or is_tail:
+            logger.warn(f"  × Give up region after {attempts} attempts: {task_str}")
+            self.flag_current_region_exhausted(
+                exhausted_tid=tid, task_str=task_str, pn=pn, is_finished=False
+            )
+        else:
+            logger.warn(f"  × Give up page after {attempts} attempts: {task_str}")
+            self.log_to_file(
+                log_type="others", log_str=f"[Give up]: tid={tid}, pn={pn}"
+            )
+
     def next(self):
         with self.lock:
             if self.queue:
-                return self.queue.pop(0)
-            if self.tid == -1 and self.pn == -1:
+                tid, pn = self.queue.popleft()
+                self.inflight.add((tid, pn))
+                return tid, pn
+            tid = self.pick_region()
+            if tid == -1:
                 return (-1, -1)
-            if self.is_current_region_exhausted:
-                self.tid_idx += 1
-                if self.tid_idx < len(self.tids):
-                    self.tid = self.get_tid()
-                    self.pn = 1
-                else:
-                    self.tid = -1
-                    self.pn = -1
-                self.is_current_region_exhausted = False
-            else:
-                self.pn += 1
-            return self.tid, self.pn
+            pn = self.region_pns[tid] + 1
+            self.region_pns[tid] = pn
+            self.region_issued[tid] += 1
+            self.inflight.add((tid, pn))
+            return tid, pn
+
+    def get_params(self) -> dict:
+        return {
+            "region_groups": self.region_groups,
+            "region_codes": self.region_codes,
+            "region_tids": self.region_tids,
+            "start_tid": self.start_tid,
+            "start_pn": self.start_pn,
+            "end_tid": self.end_tid,
+            "end_pn": self.end_pn,
+            "log_mids": self.log_mids,
+            "max_active_regions": self.max_active_regions,
+            "ps": self.ps,
+        }
+
+    def get_state(self) -> dict:
+        """Snapshot of full crawl state, which could be dumped to json."""
+        planner_state = self.planner.get_state()
+        with self.lock:
+            state = {
+                "params": self.get_params(),
+                "tids": list(self.tids),
+                "pending_tids": list(self.pending_tids),
+                "region_pns": dict(self.region_pns),
+                "region_issued": dict(self.region_issued),
+                "region_counts": planner_state["counts"],
+                "region_end_pns": planner_state["end_pns"],
+                "region_since_pubdates": planner_state["since_pubdates"],
+                "region_newest_pubdates": planner_state["newest_pubdates"],
+                "queue": [list(item) for item in self.queue],
+                "inflight": [list(item) for item in sorted(self.inflight)],
+                "exhausted_tids": list(self.exhausted_tids),
+                "given_up_pages": [list(item) for item in self.given_up_pages],
+                "mark_pending_tids": sorted(self.mark_pending_tids),
+                "unmarked_tids": sorted(self.unmarked_tids),
+                "give_up_attempts": [
+                    [tid, pn, attempts]
+                    for (tid, pn), attempts in self.give_up_attempts.items()
+                ],
+                "inserted_videos_num": self.inserted_videos_num,
+                "elapsed_seconds": (datetime.now() - self.start_time).total_seconds(),
+            }
+        return state
 
+    def load_state(self, state: dict):
+        """Restore crawl state. Pages in flight or given up when saved
+        are put back to retry lane."""
 
-class ResponseCategorizer:
-    def __init__(self, region_end_retry_count: int = 5):
-        self.region_end_retry_idx = 0
-        self.region_end_retry_count = region_end_retry_count
-        self.current_region_videos_count = 0
-        self.lock = threading.Lock()
+        def int_keys(d: dict) -> dict:
+            return {int(k): v for k, v in d.items()}
 
-    def update_videos_count(self, count: int):
         with self.lock:
-            self.current_region_videos_count = count
+            self.tids = state["tids"]
+            self.pending_tids = deque(state["pending_tids"])
+            self.region_pns = int_keys(state["region_pns"])
+            self.region_issued = int_keys(state["region_issued"])
+            self.queue = deque(
+                tuple(item)
+                for item in state["inflight"]
+                + state["queue"]
+                + state.get("given_up_pages", [])
+            )
+            self.give_up_attempts = {
+                (tid, pn): attempts
+                for tid, pn, attempts in state.get("give_up_attempts", [])
+            }
+            # requeued given up pages get attempts again
+            for tid, pn in state.get("given_up_pages", []):
+                self.give_up_attempts.pop((tid, pn), None)
+            self.given_up_pages = []
+            self.inflight = set()
+            self.exhausted_tids = state["exhausted_tids"]
+            self.mark_pending_tids = set(state.get("mark_pending_tids", []))
+            self.unmarked_tids = set(state.get("unmarked_tids", []))
+            self.inserted_videos_num = state["inserted_videos_num"]
+            self.start_time = datetime.now() - timedelta(
+                seconds=state["elapsed_seconds"]
+            )
+        self.planner.load_state(
+            counts=state["region_counts"],
+            end_pns=state["region_end_pns"],
+            since_pubdates=state.get("region_since_pubdates", {}),
+            newest_pubdates=state.get("region_newest_pubdates", {}),
+        )
+        logger.note(
+            f"> Resume: tids={list(self.region_issued.keys())}, "
+            f"{len(self.queue)} pages in retry lane"
+        )
+
+    @classmethod
+    def from_state(cls, state: dict) -> "WorkerParamsGenerator":
+        generator = cls(**state["params"])
+        generator.load_state(state)
+        return generator
+
+
+class ResponseCategorizer:
+    """Categorize page responses with the shared RegionPlanner.
+
+    The tail page (last pn from `page.count`) is the end of region,
+    so no requests are spent on empty pages past the end.
+    In incremental mode, a page older than region's since pubdate is also the end.
+    """
+
+    def __init__(self, planner: RegionPlanner):
+        self.planner = planner
 
     def categorize(
-        self, res_dict: dict, pn: int, ps: int = 50
+        self, res_dict: dict, tid: int, pn: int
     ) -> Literal["network_error", "end_of_region", "normal"]:
         code = res_dict.get("code", -1)
         if code != 0:
             return "network_error"
 
         archives = res_dict.get("data", {}).get("archives", [])
-        if len(archives) == 0 and pn * ps > self.current_region_videos_count:
-            with self.lock:
-                self.region_end_retry_idx += 1
-                if self.region_end_retry_idx >= self.region_end_retry_count:
-                    self.region_end_retry_idx = 0
-                    return "end_of_region"
+        videos_count = res_dict.get("data", {}).get("page", {}).get("count", -1)
+        self.planner.update_count(tid, videos_count)
+        self.planner.record_pubdates(tid, archives)
+        if self.planner.is_tail(tid, pn):
+            return "end_of_region"
+        if self.planner.is_older_than_since(tid, archives):
+            return "end_of_region"
 
         return "normal"
 
@@ -199,24 +443,40 @@ class Worker:
         generator: WorkerParamsGenerator,
         sql: SQLOperator,
         lock: threading.Lock,
+        pipeline=None,
+        write_buffer: SQLWriteBuffer = None,
+        stats_history=None,
         wid: int = -1,
         proxy: str = None,
         interval: float = 2.5,
-        retry_count: int = 15,
+        retry_count: int = 8,
+        retry_budget: float = 10,
         timeout: float = 2.5,
+        deadline: float = 5,
     ):
         self.wid = wid
         self.generator = generator
         self.lock = lock
         self.proxy = proxy
+        self.lease_id = None
         self.active = False
+        self.is_exited = False
         self.condition = threading.Condition()
         self.interval = interval
         self.retry_count = retry_count
+        self.retry_policy = RetryPolicy(budget=retry_budget, max_attempts=retry_count)
         self.timeout = timeout
-        self.response_categorizer = ResponseCategorizer()
+        self.deadline = deadline
+        self.transport = HTTP_TRANSPORT
+        self.rate_controllers = RATE_CONTROLLERS
+        self.proxy_feedback = PROXY_FEEDBACK
+        self.seen_aids = SEEN_AIDS
+        self.response_categorizer = ResponseCategorizer(planner=generator.planner)
         self.converter = VideoInfoConverter()
         self.sql = sql
+        self.pipeline = pipeline
+        self.write_buffer = write_buffer
+        self.stats_history = stats_history
         self.log_file = Path(__file__).parents[1] / "logs" / LOG_ENVS["worker"]
         self.proxy_endpoint = f"http://127.0.0.1:{PROXY_APP_ENVS['port']}"
         self.get_proxy_api = f"{self.proxy_endpoint}/get_proxy"
@@ -225,15 +485,19 @@ class Worker:
     def get_proxy(self):
         # LINK apps/proxy_app.py#get_proxy
         try:
-            res = requests.get(self.get_proxy_api)
+            res = requests.get(
+                self.get_proxy_api, params={"holder": f"worker-{self.wid}"}
+            )
             if res.status_code == 200:
                 proxy = res.json().get("server")
+                lease_id = res.json().get("lease_id")
             else:
                 proxy = None
         except Exception as e:
             proxy = None
 
         if proxy:
+            self.hold_lease(lease_id)
             if not self.proxy:
                 logger.file(f"> New worker {self.wid} with proxy: [{proxy}]")
             else:
@@ -251,49 +515,86 @@ class Worker:
             requests.post(self.drop_proxy_api, json={"server": self.proxy})
         except Exception as e:
             pass
+        self.rate_controllers.remove(self.proxy)
+        self.hold_lease(None)
 
-    # ANCHOR[id=get_page]
-    def get_page(self, tid: int, pn: int, ps: int = 50):
-        proxy = self.proxy
+    def hold_lease(self, lease_id: str = None):
+        """Heartbeat lease of current proxy by PROXY_FEEDBACK, and stop that of old one."""
+        self.proxy_feedback.unhold(self.lease_id)
+        self.lease_id = lease_id
+        self.proxy_feedback.hold(lease_id)
 
-        if proxy:
-            proxies = {"http": f"http://{proxy}", "https": f"http://{proxy}"}
-        else:
-            proxies = None
+    def switch_proxy(self):
+        self.drop_proxy()
+        self.get_proxy()
+
+    def renew_expired_proxy(self):
+        """Proxy of expired lease is reclaimed by proxy app, and might be leased to
+        another worker, so release it without dropping, and get a new one."""
+        if not self.proxy_feedback.pop_expired(self.lease_id):
+            return
+        logger.warn(f"× Lease expired of worker {self.wid}: [{self.proxy}]")
+        self.hold_lease(None)
+        self.get_proxy()
 
+    # ANCHOR[id=get_page]
+    def get_page(self, tid: int, pn: int, ps: int = 50):
         url = GET_VIDEO_PAGE_API
 
         params = {"rid": tid, "pn": pn, "ps": ps}
 
-        res_json = None
-        retry_count = 0
-        while retry_count < self.retry_count:
+        retry_state = self.retry_policy.new_state()
+        while True:
+            # pace requests by the adaptive rate of current proxy
+            rate_controller = self.rate_controllers.get(self.proxy)
+            time.sleep(rate_controller.reserve())
+            t1 = time.perf_counter()
             try:
-                res = requests.get(
+                res = self.transport.get(
                     url,
-                    headers=REQUESTS_HEADERS,
+                    proxy=self.proxy,
                     params=params,
-                    proxies=proxies,
                     timeout=self.timeout,
+                    deadline=self.deadline,
+                )
+                status_code = res.status_code
+                res_json = res.json() if status_code == 200 else None
+                outcome = self.retry_policy.classify(
+                    status_code=status_code, res_json=res_json
                 )
-                if res.status_code == 200:
-                    res_json = res.json()
-                    break
-                else:
-                    retry_count += 1
             except Exception as e:
-                retry_count += 1
-
-        if not res_json:
-            res_json = {
-                "code": -1,
-                "message": f"Failed to get page after {self.retry_count} retries: tid={tid}, pn={pn}",
-                "data": {
-                    "archives": [],
-                    "page": {"count": -1, "num": pn, "size": ps},
-                },
-            }
+                outcome = self.retry_policy.classify(exception=e)
+            latency = time.perf_counter() - t1
+
+            rate_controller.report(
+                is_success=outcome["category"] == "ok",
+                latency=latency if outcome["status_code"] else None,
+                status_code=outcome["status_code"],
+                code=outcome["code"],
+            )
+            self.proxy_feedback.record(
+                self.proxy,
+                latency=latency if outcome["status_code"] else None,
+                is_success=outcome["category"] == "ok",
+            )
+            decision = self.retry_policy.decide(outcome, retry_state)
+            if decision == "done":
+                return outcome["res_json"]
+            elif decision == "retry":
+                time.sleep(self.retry_policy.get_backoff_seconds(retry_state))
+            elif decision == "switch_proxy":
+                self.switch_proxy()
+                if not self.proxy:
+                    decision = "requeue"
+                    break
+            else:
+                break
 
+        task_str = f"tid={tid}, pn={pn}"
+        res_json = self.retry_policy.get_failure_json(
+            outcome, decision=decision, state=retry_state, task_str=task_str
+        )
+        res_json["data"]["page"].update({"num": pn, "size": ps})
         return res_json
 
     def log_to_file(self, log_str: str):
@@ -328,7 +629,6 @@ class Worker:
         archives = res_json.get("data", {}).get("archives", [])
         page = res_json.get("data", {}).get("page", {})
         total_count = page.get("count", -1)
-        self.response_categorizer.update_videos_count(total_count)
         current_count = pn * ps
         if total_count > 0:
             progress = round(current_count / total_count * 100, 2)
@@ -341,35 +641,105 @@ class Worker:
         logger.mesg(f"[{current_count}/{total_count}] [{progress}%]")
         return archives, current_count, total_count
 
-    def insert_rows(
-        self, archives: list, current_count: int = -1, total_count: int = -1
-    ):
-        t1 = datetime.now()
-        sql_values_list = []
+    def get_rows_from_archives(self, archives: list) -> tuple[list, list]:
+        """Returns rows of (bvid, sql_values), and (aid, digest) of changed archives."""
+        rows = []
+        aid_digests = []
+        tracked_columns = self.converter.get_tracked_columns()
         for archive in archives:
+            aid = archive.get("aid")
             sql_row = self.converter.to_sql_row(archive)
-            sql_query, sql_values = self.converter.to_sql_query_and_values(
-                sql_row,
-                table_name="videos",
-                is_many=True,
-                update_on_conflict=True,
-                primary_key="bvid",
+            digest = self.seen_aids.get_digest(sql_row, columns=tracked_columns)
+            if self.seen_aids.is_unchanged(aid, digest):
+                continue
+            aid_digests.append((aid, digest))
+            rows.append(
+                (archive.get("bvid"), self.converter.serialize_sql_row(sql_row))
+            )
+        return rows, aid_digests
+
+    def insert_rows(
+        self,
+        archives: list,
+        current_count: int = -1,
+        total_count: int = -1,
+        tid: int = -1,
+        pn: int = -1,
+    ):
+        if self.stats_history:
+            # only stats changed since last written are appended
+            self.stats_history.add_archives(archives)
+        if self.pipeline:
+            # convert and write in pipeline stages, and block here if writers lag behind
+            self.pipeline.put_page(
+                archives,
+                tid=tid,
+                pn=pn,
+                current_count=current_count,
+                total_count=total_count,
+            )
+            return
+        rows, aid_digests = self.get_rows_from_archives(archives)
+        on_written = partial(
+            self.on_page_written,
+            tid=tid,
+            pn=pn,
+            aid_digests=aid_digests,
+            current_count=current_count,
+            total_count=total_count,
+        )
+        if self.write_buffer:
+            # rows of this page are flushed with rows of other workers in one commit
+            self.write_buffer.add_many(
+                rows,
+                on_written=on_written,
+                on_failed=partial(self.on_page_write_failed, tid=tid, pn=pn),
+            )
+            return
+        if rows:
+            t1 = datetime.now()
+            counts = self.sql.copy_upsert_by_keys(
+                "videos",
+                self.converter.get_sql_columns(),
+                [values for key, values in rows],
+                keys=[key for key, values in rows],
+                primary_key=VIDEOS_PRIMARY_KEY,
+                compare_columns=self.converter.get_tracked_columns(),
             )
-            sql_values_list.append(sql_values)
-        if sql_values_list:
-            self.sql.exec(sql_query, sql_values_list, is_many=True)
-            t2 = datetime.now()
-            dt = t2 - t1
+            dt = datetime.now() - t1
             dt_str = f"{dt.seconds}.{dt.microseconds // 1000:03d} s"
-            self.generator.add_inserted_videos_num(len(archives))
+            if counts is None:
+                self.on_page_write_failed(tid=tid, pn=pn)
+                return
+            counts_str = self.sql.get_upsert_counts_str(counts)
+            logger.success(f"  + Inserted: {len(rows)} rows", end=" ")
+            logger.file(f"({dt_str}) [{counts_str}]")
+        on_written()
+
+    def on_page_written(
+        self,
+        tid: int,
+        pn: int,
+        aid_digests: list,
+        current_count: int = -1,
+        total_count: int = -1,
+    ):
+        self.seen_aids.add_many(aid_digests)
+        if aid_digests:
+            self.generator.add_inserted_videos_num(len(aid_digests))
             estimated_remaining_seconds_str = (
                 self.generator.get_estimated_remaining_time_str(
                     current_count=current_count, total_count=total_count
                 )
             )
-            logger.success(f"  + Inserted: {len(archives)} rows", end=" ")
-            logger.file(f"({dt_str})", end=" ")
+            logger.mesg(f"  + Written: tid={tid}, pn={pn}", end=" ")
             logger.mesg(f"[ETA={estimated_remaining_seconds_str}]")
+        self.generator.complete_page(tid, pn)
+
+    def on_page_write_failed(self, tid: int, pn: int):
+        """Rows of page are not marked as seen, and page is requeued to crawl again."""
+        logger.warn(f"  × Write failed, requeue: tid={tid}, pn={pn}")
+        self.generator.append_queue(tid, pn)
 
     def resolve_network_error(
         self, res_json: dict, tid: int, pn: int, task_str: str = ""
@@ -377,8 +747,12 @@ class Worker:
         res_code = res_json.get("code", -1)
         logger.warn(f"  × BAD: {task_str} [code={res_code}]")
         logger.warn(f"    {res_json.get('message', '')}")
-        self.drop_proxy()
-        self.get_proxy()
+        if res_json.get("retry_decision") == "give_up":
+            # permanent error, so retrying this page would never succeed
+            self.generator.give_up_page(tid, pn, task_str=task_str)
+            return
+        if self.proxy:
+            self.switch_proxy()
         self.generator.append_queue(tid, pn)
 
     def activate(self):
@@ -390,26 +764,41 @@ class Worker:
         self.active = False
         logger.mesg(f"> Deactivate worker {self.wid}")
 
+    def exit(self):
+        """Exit run loop after current page, e.g. before workers are replaced."""
+        self.is_exited = True
+        self.activate()
+
     def run(self):
         if not self.proxy:
             with self.lock:
                 self.get_proxy()
 
-        self.timer = Runtimer(verbose=False)
-
         while True:
             with self.condition:
                 while not self.active:
                     self.condition.wait()
 
-            self.timer.start_time()
+            if self.is_exited:
+                self.hold_lease(None)
+                logger.file(f"> Worker {self.wid} exited")
+                return
 
             if self.generator.is_terminated():
                 self.deactivate()
                 logger.file("=" * 20 + f" [Terminated] ({self.wid: >2}) " + "=" * 20)
                 continue
 
+            self.proxy_feedback.touch(self.lease_id)
+            self.renew_expired_proxy()
+            if not self.active:
+                continue
+
             tid, pn = self.generator.next()
+            if tid == -1:
+                # active regions wait for probe or tail pages, or retries
+                time.sleep(self.interval)
+                continue
 
             region_name = REGION_INFOS.get(tid, {}).get("region_name", "Unknown")
             task_str = f"region={region_name}, tid={tid}, pn={pn}, wid={self.wid: >2}"
@@ -417,18 +806,25 @@ class Worker:
 
             ps = 50
             res_json = self.get_page(tid=tid, pn=pn, ps=ps)
-            res_condition = self.response_categorizer.categorize(res_json, pn=pn, ps=ps)
+            res_condition = self.response_categorizer.categorize(
+                res_json, tid=tid, pn=pn
+            )
 
-            if res_condition == "end_of_region":
-                self.generator.flag_current_region_exhausted(
-                    exhausted_tid=tid, task_str=task_str
-                )
-            elif res_condition == "normal":
+            if res_condition in ["normal", "end_of_region"]:
                 archives, current_count, total_count = self.get_archives_from_response(
                     res_json=res_json, pn=pn, ps=ps, task_str=task_str
                 )
+                if res_condition == "end_of_region":
+                    # tail page is verified, but its rows should still be inserted
+                    self.generator.flag_current_region_exhausted(
+                        exhausted_tid=tid, task_str=task_str, pn=pn
+                    )
                 self.insert_rows(
-                    archives, current_count=current_count, total_count=total_count
+                    archives,
+                    current_count=current_count,
+                    total_count=total_count,
+                    tid=tid,
+                    pn=pn,
                 )
             elif res_condition == "network_error":
                 self.resolve_network_error(
@@ -437,9 +833,3 @@ class Worker:
             else:
                 res_code = res_json.get("code", -1)
                 logger.warn(f"  ? Unknown condition: {task_str} [code={res_code}]")
-
-            self.timer.end_time()
-            dt = self.timer.elapsed_time()
-
-            sleep_time = max(self.interval - dt.total_seconds(), 0)
-            time.sleep(sleep_time)